@@ -4,6 +4,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 
 import community.routing  # WebSocket routes from community app
+import films.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core_api.settings")
 
@@ -12,6 +13,7 @@ application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
         URLRouter(
             community.routing.websocket_urlpatterns
+            + films.routing.websocket_urlpatterns
         )
     ),
 })
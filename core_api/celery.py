@@ -2,6 +2,7 @@
 
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core_api.settings')
@@ -15,4 +16,23 @@ app = Celery('core_api')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django app configs.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@celeryd_init.connect
+def configure_transcode_worker(conf=None, options=None, **kwargs):
+    """
+    A worker started with only ``-Q transcode`` runs TRANSCODE_CONCURRENCY
+    tasks (unless ``-c`` is given) and reserves no more than it runs, so
+    waiting encodes stay in the broker in priority order.
+    """
+    from django.conf import settings
+
+    queues = options.get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+    if list(queues) != [settings.TRANSCODE_QUEUE]:
+        return
+    if not options.get("concurrency"):
+        conf.worker_concurrency = settings.TRANSCODE_CONCURRENCY
+    conf.worker_prefetch_multiplier = 1
\ No newline at end of file
@@ -0,0 +1,146 @@
+# core_api/media.py
+"""
+Serving files from ``MEDIA_ROOT``: in development, and on self-hosted
+boxes that keep media on local disk instead of S3 (``SERVE_MEDIA``).
+
+``django.views.static.serve`` ignores ``Range``, so every seek in a trailer
+downloaded the whole file again. ``file_response`` answers a single byte
+range with 206, and honours ``If-Range`` and the conditional headers
+against a strong ETag (mtime and size) and Last-Modified. Multiple ranges
+are answered with the whole file, which the RFC allows.
+
+The body is the open file itself, positioned at the start of the range and
+limited to its length. Under a WSGI server with ``wsgi.file_wrapper``
+(gunicorn) it therefore goes out with ``sendfile`` from the file's
+descriptor, bounded by Content-Length, and never passes through Python.
+Elsewhere it is streamed in ``BLOCK_SIZE`` reads.
+
+HLS ladders and full films are not served here. Ladders go through the
+signed streaming gateway (``films.views.hls_gateway``), which calls
+``file_response``, or ``open_file_response`` for edge cache copies.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from stat import S_ISREG
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+BLOCK_SIZE = 64 * 1024
+RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+PRIVATE_PREFIXES = ("hls/", "sources/", "films/videos/")
+
+
+class _RangeFile:
+    """An open file limited to ``length`` bytes from its current position."""
+
+    def __init__(self, fh, length):
+        self.fh = fh
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def tell(self):
+        return self.fh.tell()
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.fh.close()
+
+
+class MediaFileResponse(FileResponse):
+    block_size = BLOCK_SIZE
+
+
+def _byte_range(header, size):
+    """
+    ``(start, end)`` (inclusive) of a single-range ``Range`` header, or None
+    to send the whole file. ``start >= size`` means it is unsatisfiable.
+    """
+    match = RANGE.fullmatch(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:  # the last N bytes
+        suffix = int(last)
+        return (max(0, size - suffix) if suffix else size), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    return start, end
+
+
+def file_response(request, path, content_type=None):
+    """Serve the file at filesystem ``path``, honouring byte ranges and validators."""
+    try:
+        fh = open(path, "rb")
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        raise Http404
+    return open_file_response(request, fh, content_type)
+
+
+def open_file_response(request, fh, content_type=None):
+    """
+    ``file_response`` for a file that is already open (binary, at its start).
+    The response closes it. The file being open, it is served whole even if
+    its path is unlinked meanwhile.
+    """
+    stat = os.fstat(fh.fileno())
+    if not S_ISREG(stat.st_mode):
+        fh.close()
+        raise Http404
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = http_date(stat.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        fh.close()
+        not_modified["ETag"] = etag
+        not_modified["Last-Modified"] = last_modified
+        return not_modified
+
+    content_type = content_type or mimetypes.guess_type(fh.name)[0] or "application/octet-stream"
+    byte_range = None
+    if "Range" in request.headers and request.headers.get("If-Range", etag) in (etag, last_modified):
+        byte_range = _byte_range(request.headers["Range"], stat.st_size)
+
+    if byte_range is not None and byte_range[0] >= stat.st_size:
+        fh.close()
+        response = HttpResponse(status=416, content_type=content_type)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+    elif byte_range is not None:
+        start, end = byte_range
+        fh.seek(start)
+        response = MediaFileResponse(_RangeFile(fh, end - start + 1), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = end - start + 1
+    else:
+        response = MediaFileResponse(fh, content_type=content_type)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    return response
+
+
+def serve(request, path):
+    """Serve ``path`` from MEDIA_ROOT, except private media."""
+    name = posixpath.normpath(path).lstrip("/")
+    if name.startswith("../") or name == ".." or name.startswith(PRIVATE_PREFIXES):
+        raise Http404
+    return file_response(request, os.path.join(settings.MEDIA_ROOT, name))
@@ -3,6 +3,7 @@ import os
 from datetime import timedelta
 import dj_database_url
 from dotenv import load_dotenv
+from celery.schedules import crontab
 from .celery import app as celery_app
 
 # Load environment variables
@@ -64,6 +65,8 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
     "https://mbogiwood.vercel.app",
 ] + [o for o in os.getenv("CORS_ALLOWED_ORIGINS", "").split(",") if o]
+# The frontend's player sends the streaming viewer cookie (films/services/streaming.py).
+CORS_ALLOW_CREDENTIALS = True
 
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:3000",
@@ -122,17 +125,40 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "mediafiles"
+# Serve MEDIA_ROOT from Django (core_api/media.py): in development, and on
+# self-hosted boxes without a media bucket.
+SERVE_MEDIA = os.getenv("SERVE_MEDIA", str(DEBUG)).lower() == "true"
 
 # --- AWS S3 ---
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME")
-AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com" if AWS_STORAGE_BUCKET_NAME else None
+# Point at a local S3 stand-in (MinIO, moto_server) in development and tests.
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+AWS_S3_CUSTOM_DOMAIN = (
+    f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com" if AWS_STORAGE_BUCKET_NAME and not AWS_S3_ENDPOINT_URL else None
+)
 AWS_QUERYSTRING_AUTH = False
 
-STATICFILES_STORAGE = "core_api.storages.StaticStorage"
-DEFAULT_FILE_STORAGE = "core_api.storages.MediaStorage"
+# DEFAULT_FILE_STORAGE / STATICFILES_STORAGE are no longer read by Django, so
+# media only goes to S3 through STORAGES, and only when a bucket is configured.
+STORAGES = {
+    "default": {
+        "BACKEND": "core_api.storages.MediaStorage"
+        if AWS_STORAGE_BUCKET_NAME
+        else "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# --- Direct uploads ---
+# Films are uploaded straight to the media bucket with presigned multipart URLs.
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", 64 * 1024 * 1024))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 50 * 1024 ** 3))
+UPLOAD_URL_EXPIRY = int(os.getenv("UPLOAD_URL_EXPIRY", 60 * 60))
+# How long an upload may take from start to completion.
+UPLOAD_SESSION_MAX_AGE = int(os.getenv("UPLOAD_SESSION_MAX_AGE", 60 * 60 * 24))
 
 # --- Django REST Framework ---
 REST_FRAMEWORK = {
@@ -191,6 +217,110 @@ CHANNEL_LAYERS = {
     },
 }
 
+# --- Cache ---
+# Shared across web workers and Celery so pre-rendered payloads built in the
+# background are visible to every process. Falls back to local memory in dev.
+CACHE_URL = os.getenv("CACHE_URL")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "mbogiwood",
+        }
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+
+# --- Film catalog ---
+# How long a pre-rendered catalog snapshot may live in the cache. Snapshots are
+# rebuilt on every Film/Category change, so this only bounds stale leftovers.
+CATALOG_SNAPSHOT_TTL = int(os.getenv("CATALOG_SNAPSHOT_TTL", 60 * 60 * 24))
+# Upper bound on how long a cached film detail payload is kept; entries are
+# also invalidated by version bumps on every relevant save.
+FILM_DETAIL_CACHE_TTL = int(os.getenv("FILM_DETAIL_CACHE_TTL", 60 * 15))
+# "Viewers also rented": neighbours kept per film, and the minimum number of
+# shared buyers before two films are considered related.
+RELATED_FILMS_TOP_K = int(os.getenv("RELATED_FILMS_TOP_K", 12))
+RELATED_FILMS_MIN_CO_PURCHASES = int(os.getenv("RELATED_FILMS_MIN_CO_PURCHASES", 2))
+# Trending/top-rented sorted sets (films/services/leaderboards.py).
+LEADERBOARD_REDIS_URL = os.getenv("LEADERBOARD_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+LEADERBOARD_HALF_LIFE_HOURS = float(os.getenv("LEADERBOARD_HALF_LIFE_HOURS", 72))
+# Widths (px) of the resized WebP/JPEG poster derivatives served via srcset.
+POSTER_DERIVATIVE_WIDTHS = [
+    int(w) for w in os.getenv("POSTER_DERIVATIVE_WIDTHS", "320,640,1024").split(",") if w
+]
+# Uploaded trailers are re-encoded to at most this many lines, and a muted
+# preview clip this many seconds long is cut for hover-autoplay in the grid.
+TRAILER_MAX_HEIGHT = int(os.getenv("TRAILER_MAX_HEIGHT", 720))
+TRAILER_PREVIEW_SECONDS = int(os.getenv("TRAILER_PREVIEW_SECONDS", 12))
+
+# --- Transcoding ---
+# Adaptive-bitrate HLS ladder; rungs taller than the source are skipped.
+HLS_RENDITIONS = [
+    {"name": "240p", "height": 240, "video_kbps": 400, "audio_kbps": 64},
+    {"name": "360p", "height": 360, "video_kbps": 800, "audio_kbps": 96},
+    {"name": "480p", "height": 480, "video_kbps": 1400, "audio_kbps": 128},
+    {"name": "720p", "height": 720, "video_kbps": 2800, "audio_kbps": 128},
+    {"name": "1080p", "height": 1080, "video_kbps": 5000, "audio_kbps": 160},
+]
+# Named encoding profiles (see films/services/hls_transcoder.py). Keys are
+# codec, h264_profile, preset, crf (capped CRF; omit for constant bitrate),
+# segment_seconds and ladder (defaults to HLS_RENDITIONS). Compare them with
+# `manage.py benchmark_transcode` before switching HLS_PROFILE.
+HLS_PROFILES = {
+    "default": {"preset": "veryfast", "segment_seconds": 6},
+    "fast": {"preset": "superfast", "segment_seconds": 6},
+    "quality": {"h264_profile": "high", "preset": "medium", "crf": 21, "segment_seconds": 6},
+    "mobile": {
+        "h264_profile": "baseline",
+        "preset": "veryfast",
+        "segment_seconds": 4,
+        "ladder": HLS_RENDITIONS[:3],
+    },
+}
+HLS_PROFILE = os.getenv("HLS_PROFILE", "default")
+# Seek-preview thumbnails: one every `interval` seconds, written by the lowest
+# rung's ffmpeg and tiled into columns x rows sprite sheets ("jpeg" or "webp")
+# with a WebVTT track. HLS_TRICKPLAY_INTERVAL=0 turns them off.
+HLS_TRICKPLAY = {
+    "interval": int(os.getenv("HLS_TRICKPLAY_INTERVAL", 10)),
+    "width": 240,
+    "columns": 6,
+    "rows": 6,
+    "format": os.getenv("HLS_TRICKPLAY_FORMAT", "jpeg"),
+}
+# Publishing a finished ladder to the media bucket: concurrent uploads (and
+# pooled connections) and attempts per file before the publish fails.
+HLS_PUBLISH_WORKERS = int(os.getenv("HLS_PUBLISH_WORKERS", 16))
+HLS_PUBLISH_ATTEMPTS = int(os.getenv("HLS_PUBLISH_ATTEMPTS", 4))
+# Length of the chunks a film is split into for parallel encoding across
+# workers; rounded to a whole number of HLS segments.
+HLS_CHUNK_SECONDS = int(os.getenv("HLS_CHUNK_SECONDS", 120))
+# How long a film / source stays locked for transcoding if the worker holding
+# the lock dies without releasing it.
+HLS_LOCK_TIMEOUT = int(os.getenv("HLS_LOCK_TIMEOUT", 6 * 60 * 60))
+
+# --- Streaming ---
+# HLS is only served through signed, per-user URLs (films/services/streaming.py).
+# STREAM_SIGNING_KEYS is "key-id:secret,..." (ids without dots); the first key
+# signs and every listed key verifies, so keys can be rotated.
+STREAM_SIGNING_KEYS = dict(
+    pair.split(":", 1) for pair in os.getenv("STREAM_SIGNING_KEYS", "").split(",") if pair
+) or {"default": SECRET_KEY}
+# Stream URLs are bearer URLs: each lives for the film's running time plus
+# STREAM_TOKEN_GRACE, and never longer than STREAM_TOKEN_TTL.
+STREAM_TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL", 4 * 60 * 60))
+STREAM_TOKEN_GRACE = int(os.getenv("STREAM_TOKEN_GRACE", 30 * 60))
+# Parsed playlist templates each process keeps (films/services/manifests.py).
+HLS_MANIFEST_CACHE_SIZE = int(os.getenv("HLS_MANIFEST_CACHE_SIZE", 512))
+# Regional boxes: keep media bucket objects the gateway serves on local disk,
+# within a byte budget (films/services/edge_cache.py). Off unless a directory is set.
+EDGE_CACHE_DIR = os.getenv("EDGE_CACHE_DIR")
+EDGE_CACHE_MAX_BYTES = int(os.getenv("EDGE_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
 # --- Stripe ---
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
@@ -230,8 +360,52 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Africa/Nairobi"
-
-__all__ = ("celery_app",)
+# Transcoding has its own queue and workers (see films/services/scheduling.py).
+TRANSCODE_QUEUE = "transcode"
+CELERY_TASK_ROUTES = {
+    name: {"queue": TRANSCODE_QUEUE}
+    for name in (
+        "films.tasks.convert_film_to_hls",
+        "films.tasks.transcode_hls_chunk",
+        "films.tasks.stitch_hls_chunks",
+        "films.tasks.generate_trailer_derivatives",
+    )
+}
+# Redis serves priority 0 first; unprioritised tasks sit in the middle.
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+    # Transcode tasks are acked late; don't redeliver one that is still running.
+    "visibility_timeout": HLS_LOCK_TIMEOUT,
+}
+# Transcode tasks one node runs at once, and the cores each may use.
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", max(1, (os.cpu_count() or 1) // 4)))
+HLS_ENCODE_CORES = int(os.getenv("HLS_ENCODE_CORES", max(1, (os.cpu_count() or 1) // TRANSCODE_CONCURRENCY)))
+# New encodes wait while the 1-minute load average per core is above this.
+# A node whose slots are all encoding sits near 1.0, so the default only
+# defers work when something else is also loading the node.
+TRANSCODE_MAX_LOAD = float(os.getenv("TRANSCODE_MAX_LOAD", 1.5))
+TRANSCODE_DEFER_SECONDS = int(os.getenv("TRANSCODE_DEFER_SECONDS", 120))
+CELERY_BEAT_SCHEDULE = {
+    "rebuild-related-films": {
+        "task": "films.tasks.rebuild_related_films",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "reconcile-leaderboards": {
+        "task": "films.tasks.reconcile_leaderboards",
+        "schedule": crontab(minute=15),
+    },
+    "refresh-transcode-wait": {
+        "task": "films.tasks.refresh_transcode_wait",
+        "schedule": timedelta(seconds=30),
+    },
+    "requeue-deferred-transcodes": {
+        "task": "films.tasks.requeue_deferred_transcodes",
+        "schedule": timedelta(seconds=15),
+    },
+}
 
 # --- Email / SendGrid ---
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
@@ -0,0 +1,97 @@
+# core_api/slugs.py
+"""
+Unique slug allocation shared by Film, Category, Job and Article.
+
+Instead of probing ``slug``, ``slug-1``, ``slug-2``... with one ``exists()``
+query each, a single aggregate query returns the highest numeric suffix in use
+for each base (slugs matching ``^<base>(-\\d+)?$``) and we take the next one.
+Rows are selected with ``startswith``, which the slug index serves; the
+regex only classifies the rows found.
+Uniqueness is ultimately enforced by the database: saves retry on
+IntegrityError rather than trusting the check, so concurrent uploads of the
+same title cannot both win.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, Max, Q, Value, When
+from django.db.models.functions import Cast, Substr
+from django.utils.text import slugify
+
+SLUG_SAVE_ATTEMPTS = 5
+
+
+def _base_slug(value, max_length, fallback):
+    base = slugify(value or "") or fallback
+    # Leave room for a "-<n>" suffix within the column length.
+    return base[: max_length - 8].rstrip("-") if max_length else base
+
+
+def allocate_slugs(model, values, field="slug"):
+    """
+    Return one unique slug per item of ``values``, using a single query.
+
+    Slugs are unique against the table *and* within the batch, so the result
+    can be assigned directly to objects passed to ``bulk_create``.
+    """
+    max_length = model._meta.get_field(field).max_length
+    fallback = model._meta.model_name
+    bases = [_base_slug(value, max_length, fallback) for value in values]
+    if not bases:
+        return []
+
+    base_filter = Q()
+    aggregates = {}
+    distinct = list(dict.fromkeys(bases))
+    for i, base in enumerate(distinct):
+        pattern = rf"^{re.escape(base)}(-\d+)?$"
+        base_filter |= Q(**{f"{field}__startswith": base})
+        suffix = Cast(Substr(field, len(base) + 2), BigIntegerField())
+        aggregates[f"suffix_{i}"] = Max(
+            Case(
+                When(**{field: base}, then=Value(0)),
+                When(**{f"{field}__regex": pattern}, then=suffix),
+                output_field=BigIntegerField(),
+            )
+        )
+    found = model._default_manager.filter(base_filter).aggregate(**aggregates)
+
+    # base -> highest suffix in use (0 for the bare base), -1 if the base is free.
+    highest = {}
+    for i, base in enumerate(distinct):
+        suffix = found[f"suffix_{i}"]
+        highest[base] = -1 if suffix is None else suffix
+
+    slugs, allocated = [], set()
+    for base in bases:
+        # Loop only guards against batch-internal clashes such as "Foo" x2 + "Foo 1".
+        while True:
+            highest[base] += 1
+            slug = base if highest[base] == 0 else f"{base}-{highest[base]}"
+            if slug not in allocated:
+                break
+        allocated.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def save_with_unique_slug(instance, source, save, *args, field="slug", **kwargs):
+    """
+    Allocate a slug for ``instance`` from ``source`` and call ``save``.
+
+    ``save`` is the model's ``super().save``. If another writer grabs the same
+    slug between allocation and insert, the unique constraint fires and we
+    allocate again.
+    """
+    model = type(instance)
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        slug = allocate_slugs(model, [source], field=field)[0]
+        setattr(instance, field, slug)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            setattr(instance, field, "")
+            conflict = model._default_manager.filter(**{field: slug}).exists()
+            if not conflict or attempt == SLUG_SAVE_ATTEMPTS - 1:
+                raise
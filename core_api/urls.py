@@ -1,9 +1,10 @@
 # core_api/urls.py
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from core_api import media
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -28,6 +29,6 @@ urlpatterns = [
     path("api/news/", include("news.urls")),
 ]
 
-# Serve media files in development only
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Media on local disk: development and self-hosted boxes (see core_api/media.py)
+if settings.SERVE_MEDIA:
+    urlpatterns += [re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$", media.serve)]
@@ -1,6 +1,11 @@
 # films/admin.py
-from django.contrib import admin
+from datetime import timedelta
+
+from django.contrib import admin, messages
+from django.utils import timezone
+
 from .models import Film, Category
+from .services import progress, scheduling
 
 
 @admin.register(Category)
@@ -19,9 +24,46 @@ class FilmAdmin(admin.ModelAdmin):
         "price",
         "rental_period_days",
         "processing_status",
+        "transcode_estimate",
         "created_at",
     )
     list_filter = ("status", "processing_status", "category")
     search_fields = ("title", "description")
     prepopulated_fields = {"slug": ("title",)}
     readonly_fields = ("created_at", "updated_at")
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == "GET":
+            wait = scheduling.estimated_wait()
+            if wait is None:
+                self.message_user(request, "Transcode queue depth is not measured yet: is celery beat running?", messages.WARNING)
+            elif wait["depth"] is None:
+                self.message_user(request, "Transcode queue depth is unavailable: the broker can't be reached.", messages.WARNING)
+            else:
+                summary = f"Transcode queue: {wait['depth']} task(s) waiting, {wait['slots']} worker slot(s) online."
+                if wait["seconds"] is not None:
+                    summary += f" New encodes start in about {_minutes(wait['seconds'])}."
+                self.message_user(request, summary, messages.INFO)
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description="Transcode")
+    def transcode_estimate(self, film):
+        """Progress of a running encode, or when a queued one should start (at the latest)."""
+        if film.processing_status not in (Film.ProcessingStatus.PENDING, Film.ProcessingStatus.PROCESSING):
+            return "-"
+        snapshot = progress.get_progress(film.id)
+        if snapshot and snapshot["status"] != progress.SUCCESS:
+            if snapshot["eta_seconds"] is None:
+                return f"{snapshot['status'].capitalize()}, {snapshot['percent']}%"
+            return f"{snapshot['percent']}%, {_minutes(snapshot['eta_seconds'])} left"
+        if not film.video_file:
+            return "-"
+        wait = scheduling.estimated_wait()
+        if wait is None or wait["seconds"] is None:
+            return "Queued"
+        starts = timezone.localtime(timezone.now() + timedelta(seconds=wait["seconds"]))
+        return f"Queued, starts by ~{starts:%H:%M}"
+
+
+def _minutes(seconds):
+    return f"{max(1, round(seconds / 60))} min"
@@ -0,0 +1,39 @@
+# films/consumers.py
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .models import Film
+from .services import progress
+
+
+class TranscodeProgressConsumer(AsyncWebsocketConsumer):
+    """Pushes live transcode progress of a film to its filmmaker."""
+
+    async def connect(self):
+        self.film_id = int(self.scope["url_route"]["kwargs"]["film_id"])
+        if not await self.can_watch(self.scope.get("user"), self.film_id):
+            await self.close()
+            return
+        self.group_name = progress.group_name(self.film_id)
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        snapshot = await database_sync_to_async(progress.get_progress)(self.film_id)
+        if snapshot is not None:
+            await self.send(text_data=json.dumps(snapshot))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def transcode_progress(self, event):
+        await self.send(text_data=json.dumps(event["progress"]))
+
+    @database_sync_to_async
+    def can_watch(self, user, film_id):
+        if user is None or not user.is_authenticated:
+            return False
+        return user.is_staff or Film.objects.filter(id=film_id, filmmaker=user).exists()
@@ -0,0 +1,98 @@
+# films/management/commands/benchmark_transcode.py
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from films.services import hls_transcoder
+
+
+class Command(BaseCommand):
+    help = (
+        "Encode a test clip with each HLS profile and report encode fps, output size "
+        "and CPU-seconds per output minute"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile", action="append", dest="profiles",
+            help="Profile to benchmark (repeatable; default: every profile in HLS_PROFILES)",
+        )
+        parser.add_argument(
+            "--source",
+            help="Video to encode instead of the synthetic clip. Real footage is harder to "
+                 "compress than the test pattern, so prefer it when comparing sizes.",
+        )
+        parser.add_argument("--duration", type=int, default=30, help="Synthetic clip length in seconds")
+        parser.add_argument("--size", default="1920x1080", help="Synthetic clip resolution")
+
+    def handle(self, *args, **options):
+        names = options["profiles"] or list(settings.HLS_PROFILES)
+        profiles = [hls_transcoder.get_profile(name) for name in names]
+
+        with tempfile.TemporaryDirectory(prefix="hls-bench-") as workdir:
+            source_path = options["source"] or self.make_test_clip(workdir, options["duration"], options["size"])
+            source = hls_transcoder.probe(source_path)
+            if not source["duration"]:
+                raise CommandError(f"Could not read the duration of {source_path}")
+            minutes = source["duration"] / 60
+            self.stdout.write(
+                f"Source: {source['width']}x{source['height']}, {source['duration']:.1f}s"
+                f"{'' if source['has_audio'] else ', no audio'}\n"
+            )
+
+            header = f"{'profile':<12}{'rungs':>6}{'wall s':>9}{'enc fps':>10}{'size MB':>10}{'kbps':>8}{'cpu s/min':>11}"
+            self.stdout.write(header)
+            self.stdout.write("-" * len(header))
+            for profile in profiles:
+                row = self.run_profile(profile, source_path, Path(workdir) / profile.name, source, minutes)
+                self.stdout.write(
+                    f"{profile.name:<12}{row['rungs']:>6}{row['wall']:>9.1f}{row['fps']:>10.1f}"
+                    f"{row['bytes'] / 1e6:>10.1f}{row['kbps']:>8.0f}{row['cpu'] / minutes:>11.1f}"
+                )
+
+    def run_profile(self, profile, source_path, output_dir, source, minutes):
+        frames = 0
+
+        def count(seconds, new_frames):
+            nonlocal frames
+            frames += new_frames
+
+        # ffmpeg runs as child processes; their CPU time lands in RUSAGE_CHILDREN once reaped.
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.monotonic()
+        try:
+            hls_transcoder.transcode_to_hls(source_path, output_dir, profile, on_progress=count)
+        except subprocess.CalledProcessError as e:
+            raise CommandError(f"Profile {profile.name!r} failed:\n{(e.stderr or '')[-2000:]}")
+        wall = time.monotonic() - started
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        size = sum(path.stat().st_size for path in output_dir.rglob("*") if path.is_file())
+        return {
+            "rungs": len(hls_transcoder.select_renditions(profile.ladder, source["height"])),
+            "wall": wall,
+            "fps": frames / wall,
+            "bytes": size,
+            "kbps": size * 8 / 1000 / (minutes * 60),
+            "cpu": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        }
+
+    def make_test_clip(self, workdir, duration, size):
+        path = Path(workdir) / "source.mp4"
+        self.stdout.write(f"Generating a {duration}s {size} test clip...")
+        subprocess.run(
+            [
+                hls_transcoder.FFMPEG_BIN, "-y", "-nostdin", "-hide_banner", "-loglevel", "error",
+                "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=24:duration={duration}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-crf", "16", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-shortest", str(path),
+            ],
+            check=True,
+        )
+        return path
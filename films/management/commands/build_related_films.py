@@ -0,0 +1,16 @@
+# films/management/commands/build_related_films.py
+from django.core.management.base import BaseCommand
+
+from films.services.recommendations import rebuild_related_films
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed 'viewers also rented' table from successful orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, help="Neighbours kept per film")
+        parser.add_argument("--min-co-purchases", type=int, help="Minimum shared buyers")
+
+    def handle(self, *args, **options):
+        count = rebuild_related_films(top_k=options["top_k"], min_co_purchases=options["min_co_purchases"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} related-film rows"))
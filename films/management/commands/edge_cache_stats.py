@@ -0,0 +1,26 @@
+# films/management/commands/edge_cache_stats.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from films.services import edge_cache
+
+
+class Command(BaseCommand):
+    help = "Report the edge cache's hit ratio and disk use, optionally evicting down to its budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--evict", action="store_true", help="Evict least recently used files if over budget")
+
+    def handle(self, *args, **options):
+        if not settings.EDGE_CACHE_DIR:
+            raise CommandError("EDGE_CACHE_DIR is not set.")
+        cache = edge_cache.get_cache()
+        if options["evict"]:
+            self.stdout.write(f"evicted {cache.evict()} file(s)")
+        stats = cache.stats()
+        ratio = "n/a" if stats["hit_ratio"] is None else f"{stats['hit_ratio']:.1%}"
+        self.stdout.write(
+            f"hits {stats['hits']}  misses {stats['misses']}  hit ratio {ratio}  "
+            f"origin {stats['origin_bytes'] / 1024 ** 2:.1f} MiB  "
+            f"disk {stats['bytes'] / 1024 ** 3:.2f} of {stats['max_bytes'] / 1024 ** 3:.2f} GiB"
+        )
@@ -0,0 +1,247 @@
+# films/management/commands/import_films.py
+import csv
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from urllib.parse import urlparse
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date
+
+from core_api.slugs import SLUG_SAVE_ATTEMPTS, allocate_slugs
+from films.models import Category, Film
+from films.services import catalog, scheduling, search
+from films.tasks import convert_film_to_hls, generate_poster_derivatives
+
+logger = logging.getLogger(__name__)
+
+POSTER_UPLOAD_TO = "films/posters/"
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+def iter_records(path, fmt):
+    """
+    Yield ``(line number, record)`` per CSV row / JSONL line without loading
+    the file. A JSONL line that is not valid JSON yields ``None``.
+    """
+    with open(path, newline="", encoding="utf-8") as fh:
+        if fmt == "csv":
+            reader = csv.DictReader(fh)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for number, line in enumerate(fh, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def _text(record, key):
+    value = record.get(key)
+    return str(value).strip() if value is not None else ""
+
+
+def clean_record(record):
+    """
+    Check one record and convert its fields to the model's types; raise
+    ValueError saying what is wrong with it.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    cleaned = {"title": _text(record, "title")}
+    if not cleaned["title"]:
+        raise ValueError("missing title")
+    if len(cleaned["title"]) > Film._meta.get_field("title").max_length:
+        raise ValueError("title is too long")
+
+    try:
+        price = Decimal(_text(record, "price") or "0")
+    except InvalidOperation:
+        raise ValueError(f"price {record['price']!r} is not a number")
+    if not price.is_finite() or price < 0 or price >= 10 ** 8 or price != price.quantize(Decimal("0.01")):
+        raise ValueError(f"price {record['price']!r} is not an amount in KES")
+    cleaned["price"] = price
+
+    try:
+        cleaned["rental_period_days"] = int(_text(record, "rental_period_days") or 2)
+    except ValueError:
+        raise ValueError(f"rental_period_days {record['rental_period_days']!r} is not a whole number")
+    if cleaned["rental_period_days"] < 1:
+        raise ValueError("rental_period_days must be at least 1")
+
+    release_date = _text(record, "release_date")
+    try:
+        cleaned["release_date"] = parse_date(release_date) if release_date else None
+    except ValueError:  # well formed but not a real day
+        cleaned["release_date"] = None
+    if release_date and cleaned["release_date"] is None:
+        raise ValueError(f"release_date {release_date!r} is not a YYYY-MM-DD date")
+
+    cleaned["status"] = _text(record, "status") or Film.PAID
+    if cleaned["status"] not in dict(Film.STATUS_CHOICES):
+        raise ValueError(f"status {cleaned['status']!r} is not one of {', '.join(dict(Film.STATUS_CHOICES))}")
+
+    for key in ("description", "category", "filmmaker", "poster", "trailer_url", "video_file"):
+        cleaned[key] = _text(record, key) or None
+    return cleaned
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def ingest_poster(source):
+    """Copy a local file or download a URL into MediaStorage; return the stored name."""
+    if not source:
+        return None
+    filename = os.path.basename(urlparse(source).path) or "poster.jpg"
+    name = POSTER_UPLOAD_TO + filename
+    try:
+        if source.startswith(("http://", "https://")):
+            # Spool to disk past 1 MB so large posters never sit in memory.
+            with requests.get(source, stream=True, timeout=30) as resp, \
+                    tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as tmp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    tmp.write(chunk)
+                tmp.seek(0)
+                return default_storage.save(name, File(tmp))
+        with open(source, "rb") as fh:
+            return default_storage.save(name, File(fh))
+    except Exception:
+        logger.exception("Could not ingest poster %s", source)
+        return None
+
+
+class Command(BaseCommand):
+    help = "Bulk-import films from a CSV or JSONL file in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSONL file of films")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8, help="Parallel poster downloads")
+        parser.add_argument("--no-transcode", action="store_true", help="Do not enqueue HLS conversion")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+
+        self.transcode = not options["no_transcode"]
+        self.categories = dict(Category.objects.values_list("name", "id"))
+        self.filmmakers = {}
+
+        total = skipped = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for batch in batched(iter_records(path, fmt), options["batch_size"]):
+                records = self.clean_batch(batch)
+                skipped += len(batch) - len(records)
+                total += self.import_batch(records, pool)
+                self.stdout.write(f"Imported {total} films")
+
+        # bulk_create bypasses post_save, so refresh the catalog once at the end.
+        if total:
+            catalog.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Imported {total} films from {path}"))
+        if skipped:
+            self.stderr.write(self.style.WARNING(f"Skipped {skipped} invalid record(s)"))
+
+    def clean_batch(self, batch):
+        """The valid records of ``batch``; each invalid one is reported with its line number."""
+        records = []
+        for line, record in batch:
+            try:
+                records.append(clean_record(record))
+            except ValueError as exc:
+                self.stderr.write(f"Line {line}: {exc}; skipped")
+        return records
+
+    def import_batch(self, records, pool):
+        if not records:
+            return 0
+
+        self.resolve_categories({r["category"] for r in records if r["category"]})
+        self.resolve_filmmakers({r["filmmaker"] for r in records if r["filmmaker"]})
+        posters = list(pool.map(ingest_poster, [r["poster"] for r in records]))
+        titles = [r["title"] for r in records]
+        try:
+            for attempt in range(SLUG_SAVE_ATTEMPTS):
+                slugs = allocate_slugs(Film, titles)
+                films = [self.build_film(record, slug, poster) for record, slug, poster in zip(records, slugs, posters)]
+                try:
+                    self.save_batch(films)
+                    return len(films)
+                except IntegrityError:
+                    # Another writer took one of the slugs since we allocated them:
+                    # allocate the batch again, as save_with_unique_slug does.
+                    conflict = Film.objects.filter(slug__in=slugs).exists()
+                    if not conflict or attempt == SLUG_SAVE_ATTEMPTS - 1:
+                        raise
+        except BaseException:
+            # No film of the batch was saved, so nothing refers to its posters.
+            for name in filter(None, posters):
+                default_storage.delete(name)
+            raise
+
+    def build_film(self, record, slug, poster):
+        return Film(
+            title=record["title"],
+            slug=slug,
+            description=record["description"],
+            release_date=record["release_date"],
+            poster=poster,
+            category_id=self.categories.get(record["category"]),
+            filmmaker_id=self.filmmakers.get(record["filmmaker"]),
+            trailer_url=record["trailer_url"],
+            video_file=record["video_file"],
+            status=record["status"],
+            price=record["price"],
+            rental_period_days=record["rental_period_days"],
+        )
+
+    def save_batch(self, films):
+        with transaction.atomic():
+            Film.objects.bulk_create(films)
+            search.index_films([film.pk for film in films])
+            with_poster = [film.pk for film in films if film.poster]
+            transaction.on_commit(lambda: [generate_poster_derivatives.delay(pk) for pk in with_poster])
+            if self.transcode:
+                to_transcode = [(film.pk, scheduling.transcode_priority(film)) for film in films if film.video_file]
+                transaction.on_commit(
+                    lambda: [convert_film_to_hls.apply_async((pk,), priority=p) for pk, p in to_transcode]
+                )
+
+    def resolve_categories(self, names):
+        missing = sorted(names - self.categories.keys())
+        if not missing:
+            return
+        new = [Category(name=name, slug=slug) for name, slug in zip(missing, allocate_slugs(Category, missing))]
+        Category.objects.bulk_create(new)
+        self.categories.update({category.name: category.pk for category in new})
+
+    def resolve_filmmakers(self, emails):
+        missing = emails - self.filmmakers.keys()
+        if not missing:
+            return
+        User = get_user_model()
+        found = dict(User.objects.filter(email__in=missing).values_list("email", "id"))
+        for email in missing:
+            if email not in found:
+                logger.warning("No user %s; importing their films without a filmmaker", email)
+            self.filmmakers[email] = found.get(email)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0003_alter_film_hls_manifest_alter_film_price_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='film_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='film',
+            index=models.Index(fields=['filmmaker', 'created_at', 'id'], name='film_filmmaker_created_idx'),
+        ),
+    ]
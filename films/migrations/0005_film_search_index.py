@@ -0,0 +1,60 @@
+from django.db import migrations
+
+# The search index lives outside the ORM because each backend has its own
+# native structure: a tsvector column with a GIN index on Postgres and an FTS5
+# virtual table on SQLite. Runtime queries live in films/services/search.py.
+
+POSTGRES_FORWARD = [
+    """
+    CREATE TABLE films_film_search (
+        film_id bigint PRIMARY KEY REFERENCES films_film (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX films_film_search_document_gin ON films_film_search USING gin (document)",
+    """
+    INSERT INTO films_film_search (film_id, document)
+    SELECT f.id,
+           setweight(to_tsvector('simple', coalesce(f.title, '')), 'A')
+           || setweight(to_tsvector('simple', coalesce(c.name, '')), 'B')
+           || setweight(to_tsvector('simple', coalesce(f.description, '')), 'C')
+    FROM films_film f LEFT JOIN films_category c ON c.id = f.category_id
+    """,
+]
+POSTGRES_BACKWARD = ["DROP TABLE IF EXISTS films_film_search"]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE films_film_search USING fts5(
+        title, category, description, film_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO films_film_search (rowid, title, category, description, film_id)
+    SELECT f.id, coalesce(f.title, ''), coalesce(c.name, ''), coalesce(f.description, ''), f.id
+    FROM films_film f LEFT JOIN films_category c ON c.id = f.category_id
+    """,
+]
+SQLITE_BACKWARD = ["DROP TABLE IF EXISTS films_film_search"]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0004_film_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            _run({"postgresql": POSTGRES_BACKWARD, "sqlite": SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0006_film_poster_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedFilm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(help_text='Co-purchase affinity; higher is closer.')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_films', to='films.film')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='films.film')),
+            ],
+            options={
+                'ordering': ['film', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('film', 'rank'), name='relatedfilm_film_rank_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0007_relatedfilm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='video_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
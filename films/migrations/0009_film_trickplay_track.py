@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0008_film_video_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='trickplay_track',
+            field=models.FileField(blank=True, null=True, upload_to='films/hls/'),
+        ),
+    ]
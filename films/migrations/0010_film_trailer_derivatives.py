@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0009_film_trickplay_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='film',
+            name='trailer_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
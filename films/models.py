@@ -1,7 +1,8 @@
 from django.db import models
-from django.utils.text import slugify
 from django.conf import settings
 
+from core_api.slugs import save_with_unique_slug
+
 
 class Category(models.Model):
     """Represents a film category (e.g., Action, Drama, Comedy)."""
@@ -15,19 +16,42 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         """Auto-generate a unique slug if not set."""
         if not self.slug:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Category.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, self.name, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+class FilmQuerySet(models.QuerySet):
+    # Columns needed to render a film card (FilmSerializer / serialize_film_rows).
+    LISTING_FIELDS = (
+        "id",
+        "title",
+        "slug",
+        "description",
+        "release_date",
+        "poster",
+        "poster_derivatives",
+        "trailer_url",
+        "trailer_derivatives",
+        "price",
+        "created_at",
+        "category__id",
+        "category__name",
+        "category__slug",
+        "filmmaker__full_name",
+    )
+
+    def for_listing(self):
+        """Load category and filmmaker in the same query, and nothing else."""
+        return self.select_related("category", "filmmaker").only(*self.LISTING_FIELDS)
+
+    def listing_values(self):
+        """Plain dict rows for the fast list serializer."""
+        return self.values(*self.LISTING_FIELDS)
+
+
 class Film(models.Model):
     """Represents a single film available on the platform."""
 
@@ -48,6 +72,7 @@ class Film(models.Model):
     description = models.TextField(blank=True, null=True)
     release_date = models.DateField(null=True, blank=True)
     poster = models.ImageField(upload_to="films/posters/", blank=True, null=True)
+    poster_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     category = models.ForeignKey(
         Category,
@@ -66,8 +91,14 @@ class Film(models.Model):
     # --- Video & Streaming ---
     trailer_url = models.URLField(blank=True, null=True)
     trailer_file = models.FileField(upload_to="films/trailers/", blank=True, null=True)
+    # Web-sized trailer and hover preview MP4s (see films/services/trailers.py).
+    trailer_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     video_file = models.FileField(upload_to="films/videos/", blank=True, null=True)
     hls_manifest = models.FileField(upload_to="films/hls/", blank=True, null=True)
+    # WebVTT track of seek-preview sprites next to the ladder, when built.
+    trickplay_track = models.FileField(upload_to="films/hls/", blank=True, null=True)
+    # SHA-256 of the video_file content the HLS ladder was (or is being) built from.
+    video_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
 
     # --- Monetization ---
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PAID)
@@ -86,19 +117,20 @@ class Film(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FilmQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Keyset pagination of catalog sections (see films/pagination.py).
+            models.Index(fields=["status", "created_at", "id"], name="film_status_created_idx"),
+            models.Index(fields=["filmmaker", "created_at", "id"], name="film_filmmaker_created_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         """Auto-generate a unique slug from title if not set."""
         if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Film.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, self.title, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     # --- Helpers ---
@@ -114,3 +146,23 @@ class Film(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class RelatedFilm(models.Model):
+    """
+    Precomputed "viewers also rented" neighbour of a film, rebuilt nightly
+    from successful orders (see films/services/recommendations.py).
+    """
+    film = models.ForeignKey(Film, on_delete=models.CASCADE, related_name="related_films")
+    related = models.ForeignKey(Film, on_delete=models.CASCADE, related_name="recommended_for")
+    score = models.FloatField(help_text="Co-purchase affinity; higher is closer.")
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ["film", "rank"]
+        constraints = [
+            models.UniqueConstraint(fields=["film", "rank"], name="relatedfilm_film_rank_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.film_id} -> {self.related_id} (#{self.rank})"
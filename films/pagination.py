@@ -0,0 +1,111 @@
+# films/pagination.py
+"""
+Keyset (cursor) pagination for film listings.
+
+Films are ordered newest first on ``(-created_at, -id)``; the cursor encodes
+the position of the last row on the page, and the next page is fetched with
+``WHERE (created_at, id) < (cursor)`` rather than an OFFSET. Combined with the
+``(status, created_at, id)`` index on Film, page 500 costs the same as page 1.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(position):
+    created_at, pk = position
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return ``(created_at, pk)`` for a cursor token, or raise ValueError."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError) as exc:
+        raise ValueError(str(exc)) from exc
+
+
+def _position(row):
+    if isinstance(row, dict):
+        return row["created_at"], row["id"]
+    return row.created_at, row.pk
+
+
+class FilmCursorPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    ordering = ("-created_at", "-id")
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.base_url = None
+        self.next_position = None
+
+    def get_page_size(self, request):
+        if request is not None and self.page_size_query_param in request.query_params:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+            except (TypeError, ValueError):
+                return self.page_size
+            if size > 0:
+                return min(size, self.max_page_size)
+        return self.page_size
+
+    def paginate(self, queryset, page_size=None, cursor=None):
+        """Return one page of ``queryset`` starting after ``cursor``."""
+        page_size = page_size or self.page_size
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            try:
+                created_at, pk = decode_cursor(cursor)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        # Fetch one extra row to learn whether another page exists.
+        rows = list(queryset[: page_size + 1])
+        page = rows[:page_size]
+        self.next_position = _position(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        return self.paginate(
+            queryset,
+            page_size=self.get_page_size(request),
+            cursor=request.query_params.get(self.cursor_query_param),
+        )
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_data(self, data):
+        return {"next": self.get_next_link(), "results": data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
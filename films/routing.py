@@ -0,0 +1,7 @@
+# films/routing.py
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r"ws/films/(?P<film_id>\d+)/progress/$", consumers.TranscodeProgressConsumer.as_asgi()),
+]
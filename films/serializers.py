@@ -1,6 +1,11 @@
 # films/serializers.py
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import Film, Category
+from .services.posters import build_srcset
+from .services.trailers import build_url
+
+DEFAULT_FILMMAKER_NAME = "Mbogiwood Productions"
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -12,6 +17,9 @@ class CategorySerializer(serializers.ModelSerializer):
 class FilmSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     poster_url = serializers.SerializerMethodField()
+    poster_srcset = serializers.SerializerMethodField()
+    trailer_video_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     filmmaker_name = serializers.SerializerMethodField()
 
     class Meta:
@@ -23,12 +31,24 @@ class FilmSerializer(serializers.ModelSerializer):
             "description",
             "release_date",
             "poster_url",
+            "poster_srcset",
             "trailer_url",
+            "trailer_video_url",
+            "preview_url",
             "category",
             "price_kes",
             "filmmaker_name",
         ]
 
+    def get_poster_srcset(self, obj):
+        return build_srcset(obj.poster_derivatives, self.context.get("request"))
+
+    def get_trailer_video_url(self, obj):
+        return build_url(obj.trailer_derivatives, "trailer", self.context.get("request"))
+
+    def get_preview_url(self, obj):
+        return build_url(obj.trailer_derivatives, "preview", self.context.get("request"))
+
     def get_poster_url(self, obj):
         request = self.context.get("request")
         if obj.poster and hasattr(obj.poster, "url"):
@@ -36,42 +56,112 @@ class FilmSerializer(serializers.ModelSerializer):
         return None
 
     def get_filmmaker_name(self, obj):
-        if hasattr(obj.filmmaker, "get_full_name") and obj.filmmaker.get_full_name():
+        if obj.filmmaker_id and obj.filmmaker.get_full_name():
             return obj.filmmaker.get_full_name()
-        if hasattr(obj.filmmaker, "username"):
+        if obj.filmmaker_id and getattr(obj.filmmaker, "username", None):
             return obj.filmmaker.username
-        return "Mbogiwood Productions"
+        return DEFAULT_FILMMAKER_NAME
+
+
+def serialize_film_rows(rows, request=None):
+    """
+    Fast path for list endpoints: render ``Film.objects.listing_values()`` rows
+    into the same shape as FilmSerializer without DRF field machinery.
+    """
+    data = []
+    for row in rows:
+        poster_url = None
+        if row["poster"]:
+            poster_url = default_storage.url(row["poster"])
+            if request:
+                poster_url = request.build_absolute_uri(poster_url)
+
+        category = None
+        if row["category__id"] is not None:
+            category = {
+                "id": row["category__id"],
+                "name": row["category__name"],
+                "slug": row["category__slug"],
+            }
+
+        data.append({
+            "id": row["id"],
+            "title": row["title"],
+            "slug": row["slug"],
+            "description": row["description"],
+            "release_date": row["release_date"],
+            "poster_url": poster_url,
+            "poster_srcset": build_srcset(row["poster_derivatives"], request),
+            "trailer_url": row["trailer_url"],
+            "trailer_video_url": build_url(row["trailer_derivatives"], "trailer", request),
+            "preview_url": build_url(row["trailer_derivatives"], "preview", request),
+            "category": category,
+            "price_kes": int(row["price"]),
+            # Rows carry filmmaker__username only with a user model that has one.
+            "filmmaker_name": row["filmmaker__full_name"] or row.get("filmmaker__username") or DEFAULT_FILMMAKER_NAME,
+        })
+    return data
+
+
+class UploadPartSerializer(serializers.Serializer):
+    number = serializers.IntegerField(min_value=1)
+    # Base64 SHA-256 of the part; S3 rejects a PUT whose bytes don't match it.
+    sha256 = serializers.RegexField(r"^[A-Za-z0-9+/]{43}=$")
+
+
+class CompletedPartSerializer(UploadPartSerializer):
+    etag = serializers.CharField(max_length=64)
 
 
 # --- THIS IS THE UPDATED SECTION ---
 class FilmUploadSerializer(serializers.ModelSerializer):
+    """Creates the Film once its video has been uploaded straight to S3."""
     category = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(),
         required=False,
         allow_null=True
     )
-    # We now expect the S3 key (a string) from the frontend, not the file itself.
-    video_s3_key = serializers.CharField(write_only=True)
+    # The signed token from the upload start call and the parts S3 acknowledged;
+    # the view verifies them and sets video_file itself.
+    upload = serializers.CharField(write_only=True)
+    parts = CompletedPartSerializer(many=True, write_only=True, allow_empty=False)
 
     class Meta:
         model = Film
         fields = [
+            "id",
+            "slug",
             "title",
             "description",
             "release_date",
             "poster",
             "trailer_url",
-            "video_s3_key", # Changed from 'video_file'
+            "upload",
+            "parts",
             "category",
             "price_kes",
+            "processing_status",
         ]
-    
+        read_only_fields = ["id", "slug", "processing_status"]
+
     def create(self, validated_data):
-        # The 'filmmaker' is added automatically in the view.
-        # This will now correctly save the s3 key to your Film model.
+        # The 'filmmaker' and 'video_file' are added by the view.
+        validated_data.pop("upload", None)
+        validated_data.pop("parts", None)
         return Film.objects.create(**validated_data)
 
 
+class UploadStartSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.RegexField(r"^video/[\w.+-]+$", required=False, default="video/mp4")
+
+
+class UploadPartsSerializer(serializers.Serializer):
+    upload = serializers.CharField()
+    parts = UploadPartSerializer(many=True)
+
+
 class RevenueSummarySerializer(serializers.Serializer):
     total_cents = serializers.IntegerField()
     pending_cents = serializers.IntegerField()
@@ -0,0 +1,124 @@
+# films/services/catalog.py
+"""
+Pre-rendered, versioned snapshot of the public film catalog.
+
+The home page hits ``film_list_api`` far more than anything else, yet the
+catalog only changes when a Film or Category is edited. Instead of querying
+and serializing on every request we keep the rendered JSON in the shared
+cache under a version number:
+
+    films:catalog:version            -> int, bumped on every catalog change
+    films:catalog:snapshot:<version> -> {"etag": ..., "body": bytes}
+
+Bumping the version makes the old snapshot unreachable immediately; it simply
+ages out of the cache. A Celery task rebuilds the new snapshot in the
+background so that, in the common case, requests never touch the database.
+
+Live responses carry absolute URLs (``poster_url``, ``next``...), but the
+task has no request to take the host from. The snapshot is rendered with
+the placeholder ``ORIGIN`` instead, and ``body_for`` swaps in the origin of
+the request being served.
+"""
+import hashlib
+import logging
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.http import urlencode
+from rest_framework.renderers import JSONRenderer
+
+from films.models import Film
+from films.pagination import FilmCursorPagination
+from films.serializers import serialize_film_rows
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "films:catalog:version"
+SNAPSHOT_KEY = "films:catalog:snapshot:{version}"
+
+# Response key -> Film.status for each section of the catalog.
+CATALOG_SECTIONS = (("promo_films", Film.PROMO), ("paid_films", Film.PAID))
+
+# Stands in for the scheme and host in a snapshot's URLs.
+ORIGIN = "http://catalog-snapshot.invalid"
+
+
+class _SnapshotRequest:
+    """What the serializers need of a request, with ``ORIGIN`` as the host."""
+
+    def build_absolute_uri(self, location):
+        return urljoin(ORIGIN + "/", location)
+
+
+def get_version():
+    """Return the current catalog version, initialising it if missing."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_version():
+    """Invalidate the current snapshot by moving to a new version."""
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key was evicted or never set; any fresh value invalidates old snapshots.
+        cache.add(VERSION_KEY, 1, timeout=None)
+        return cache.incr(VERSION_KEY)
+
+
+def render_catalog():
+    """Serialize the first page of each catalog section into JSON bytes."""
+    list_url = reverse("films:film-list-api")
+    request = _SnapshotRequest()
+    data = {}
+    for key, status in CATALOG_SECTIONS:
+        paginator = FilmCursorPagination()
+        paginator.base_url = request.build_absolute_uri(f"{list_url}?{urlencode({'status': status})}")
+        page = paginator.paginate(Film.objects.filter(status=status).listing_values())
+        data[key] = paginator.get_paginated_data(serialize_film_rows(page, request))
+    return JSONRenderer().render(data)
+
+
+def build_snapshot(version=None):
+    """Render the catalog and store it under ``version`` (default: current)."""
+    if version is None:
+        version = get_version()
+    body = render_catalog()
+    snapshot = {
+        "etag": '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+        "body": body,
+    }
+    cache.set(SNAPSHOT_KEY.format(version=version), snapshot, timeout=settings.CATALOG_SNAPSHOT_TTL)
+    return snapshot
+
+
+def get_snapshot():
+    """Return the current snapshot, building it inline on a cold cache."""
+    version = get_version()
+    snapshot = cache.get(SNAPSHOT_KEY.format(version=version))
+    if snapshot is None:
+        snapshot = build_snapshot(version)
+    return snapshot
+
+
+def body_for(snapshot, request):
+    """The snapshot's JSON with its URLs on the origin ``request`` was made to."""
+    origin = request.build_absolute_uri("/")[:-1]
+    return snapshot["body"].replace(ORIGIN.encode(), origin.encode())
+
+
+def invalidate():
+    """Bump the catalog version and schedule a background rebuild."""
+    from films.tasks import rebuild_catalog_snapshot
+
+    version = bump_version()
+    try:
+        rebuild_catalog_snapshot.delay(version)
+    except Exception:
+        # The next request will rebuild inline; never fail the write path.
+        logger.exception("Could not enqueue catalog snapshot rebuild (version %s)", version)
@@ -0,0 +1,109 @@
+# films/services/detail.py
+"""
+Cached film detail payloads.
+
+Each cached entry remembers the versions of everything it was rendered from:
+
+    films:detail:<host>:<slug> -> {"data": ..., "deps": {"films:version:film:7": 1697..., ...}}
+
+A Film save, a Category change or a filmmaker renaming themselves bumps one
+version key, which is O(1) no matter how many entries depend on it; entries
+whose recorded versions no longer match are treated as misses and simply
+age out of the cache.
+
+On a miss only one request per slug rebuilds the entry (guarded by a
+``cache.add`` lock). Concurrent requests serve the stale entry if there is
+one, or wait briefly for the rebuild instead of all hitting the database.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from films.models import Film
+from films.serializers import FilmSerializer
+
+ENTRY_KEY = "films:detail:{host}:{slug}"
+LOCK_KEY = "films:detail:lock:{host}:{slug}"
+VERSION_KEY = "films:version:{kind}:{pk}"
+
+LOCK_TIMEOUT = 10
+WAIT_SECONDS = 2.0
+POLL_SECONDS = 0.05
+
+
+def version_key(kind, pk):
+    return VERSION_KEY.format(kind=kind, pk=pk)
+
+
+def bump(kind, pk):
+    """Invalidate every cached entry that depends on ``kind``/``pk``."""
+    cache.set(version_key(kind, pk), time.time_ns(), timeout=None)
+
+
+def _current_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Never record a missing version: an evicted key must not make an
+            # old entry look fresh again.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def _is_fresh(entry):
+    if entry is None:
+        return False
+    current = cache.get_many(list(entry["deps"]))
+    return all(current.get(key) == version for key, version in entry["deps"].items())
+
+
+def _build(slug, request, entry_key):
+    ids = Film.objects.filter(slug=slug).values_list("id", "category_id", "filmmaker_id").first()
+    if ids is None:
+        return None
+    film_id, category_id, filmmaker_id = ids
+    deps = [version_key("film", film_id)]
+    if category_id:
+        deps.append(version_key("category", category_id))
+    if filmmaker_id:
+        deps.append(version_key("filmmaker", filmmaker_id))
+    # Record versions *before* loading the row, so a save that commits while
+    # we render bumps past what we store and is never masked.
+    versions = _current_versions(deps)
+    film = Film.objects.for_listing().filter(id=film_id).first()
+    if film is None:
+        return None
+    data = FilmSerializer(film, context={"request": request}).data
+    cache.set(entry_key, {"data": data, "deps": versions}, timeout=settings.FILM_DETAIL_CACHE_TTL)
+    return data
+
+
+def get_film_detail(slug, request):
+    """Return the serialized film for ``slug`` or None if it does not exist."""
+    host = request.get_host()
+    entry_key = ENTRY_KEY.format(host=host, slug=slug)
+    entry = cache.get(entry_key)
+    if _is_fresh(entry):
+        return entry["data"]
+
+    lock_key = LOCK_KEY.format(host=host, slug=slug)
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _build(slug, request, entry_key)
+        finally:
+            cache.delete(lock_key)
+
+    # Somebody else is rebuilding this film.
+    if entry is not None:
+        return entry["data"]
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        entry = cache.get(entry_key)
+        if _is_fresh(entry):
+            return entry["data"]
+        if cache.get(lock_key) is None:
+            break  # rebuild finished without caching anything (e.g. no such film)
+    return _build(slug, request, entry_key)
@@ -0,0 +1,291 @@
+# films/services/edge_cache.py
+"""
+Read-through disk cache of media bucket objects, for regional boxes.
+
+A box serving HLS close to its viewers fetched every segment from S3 on
+every request. With ``EDGE_CACHE_DIR`` set, the streaming gateway asks
+``open`` for a local copy instead and sends that from disk:
+
+    EDGE_CACHE_DIR/hls/<source hash>/default/720p/seg_00042.ts
+
+* Misses download the object next to its final path and rename it into
+  place, so a reader never sees a partial file. The copy keeps the object's
+  LastModified as its mtime, so its ETag is the same on every box.
+* ``open`` returns an open file, not a path: once open, a file that is
+  evicted is still read to the end.
+* Concurrent misses for one key are coalesced: the first request takes an
+  ``flock`` on ``<file>.lock`` and fetches, and the others (threads or
+  worker processes) wait on the lock and then find the file. ``evict``
+  deletes the lock files of objects that are no longer cached, once it can
+  take their lock without waiting. A process that opened a lock file just
+  before it was deleted finds, once it holds the lock, that the name now
+  points elsewhere, and locks again, so two fetches never run at once.
+* Eviction is LRU within ``EDGE_CACHE_MAX_BYTES``. Each hit sets the file's
+  atime, so every worker process shares one recency order. Each process
+  keeps a running total of the bytes on disk: it scans the directory once,
+  then adds its own downloads. When the total is over budget, a background
+  thread scans the directory and deletes the least recently used files
+  until the cache is at ``LOW_WATER`` of the budget, so no request waits
+  for the scan. Processes only count their own downloads between scans, so
+  the cache can overshoot by one budget margin per process.
+* Hits and misses are counted per process and added to shared counters in
+  the default cache every ``STATS_FLUSH_EVERY`` lookups; ``stats()``
+  (``manage.py edge_cache_stats``) reports the hit ratio.
+"""
+import fcntl
+import logging
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.cache import cache
+
+from core_api.storages import MediaStorage
+from films.services import publishing
+
+logger = logging.getLogger(__name__)
+
+LOW_WATER = 0.9
+LOCK_SUFFIX = ".lock"
+PART_PREFIX = "."
+PART_MAX_AGE = 60 * 60
+CHUNK_SIZE = 1024 * 1024
+STATS_FLUSH_EVERY = 100
+STATS_KEYS = {"hits": "films:edge:hits", "misses": "films:edge:misses", "origin_bytes": "films:edge:origin_bytes"}
+
+
+class EdgeCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # estimated bytes on disk; None until the first scan
+        self._eviction = None  # the background eviction thread, if one was started
+        self._counts = dict.fromkeys(STATS_KEYS, 0)
+        self._lookups = 0
+
+    def path(self, name):
+        name = posixpath.normpath(name)
+        if name.startswith(("/", "..")):
+            raise ValueError(f"Not a media name: {name}")
+        return self.directory / name
+
+    def open(self, name):
+        """
+        The local copy of the media object ``name``, open for binary reading,
+        downloading it on a miss. Raises FileNotFoundError if the bucket has
+        no such object.
+        """
+        path = self.path(name)
+        fh = self._open_cached(path)
+        if fh is not None:
+            self._count(hits=1)
+            return fh
+        with self._locked(path):
+            fh = self._open_cached(path)  # fetched while we waited for the lock
+            if fh is not None:
+                self._count(hits=1)
+                return fh
+            fh, size = self._download(name, path)
+        self._count(misses=1, origin_bytes=size)
+        self._grow(size)
+        return fh
+
+    @staticmethod
+    def _open_cached(path):
+        """Open ``path`` and mark it as just used; None if it is not cached."""
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        # Keep the exact mtime: it is part of the ETag.
+        os.utime(fh.fileno(), ns=(time.time_ns(), os.fstat(fh.fileno()).st_mtime_ns))
+        return fh
+
+    @contextmanager
+    def _locked(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = path.with_name(path.name + LOCK_SUFFIX)
+        while True:
+            lock = open(lock_path, "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if _is_current(lock, lock_path):
+                break
+            lock.close()  # deleted by evict() while we waited; lock the new file
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def _download(self, name, path):
+        """Download ``name`` to ``path``; return the file, open at its start, and its size."""
+        key = posixpath.join(MediaStorage.location, name)
+        try:
+            obj = publishing.get_client().get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise FileNotFoundError(name) from exc
+            raise
+        fd, part = tempfile.mkstemp(dir=path.parent, prefix=PART_PREFIX + path.name)
+        fh = os.fdopen(fd, "w+b")
+        try:
+            for chunk in obj["Body"].iter_chunks(CHUNK_SIZE):
+                fh.write(chunk)
+            fh.flush()
+            os.chmod(part, 0o644)  # mkstemp creates files readable by us only
+            os.utime(part, (time.time(), obj["LastModified"].timestamp()))
+            os.replace(part, path)
+        except BaseException:
+            fh.close()
+            Path(part).unlink(missing_ok=True)
+            raise
+        fh.seek(0)
+        return fh, obj["ContentLength"]
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counts[name] += delta
+            self._lookups += 1
+            if self._lookups < STATS_FLUSH_EVERY:
+                return
+            counts, self._counts, self._lookups = self._counts, dict.fromkeys(STATS_KEYS, 0), 0
+        self._flush(counts)
+
+    @staticmethod
+    def _flush(counts):
+        for name, delta in counts.items():
+            if not delta:
+                continue
+            key = STATS_KEYS[name]
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, delta)
+            except ValueError:  # evicted between add and incr
+                cache.set(key, delta, timeout=None)
+
+    def flush_stats(self):
+        with self._lock:
+            counts, self._counts, self._lookups = self._counts, dict.fromkeys(STATS_KEYS, 0), 0
+        self._flush(counts)
+
+    def _grow(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self.max_bytes:
+                    return
+            if self._eviction is not None and self._eviction.is_alive():
+                return
+            self._eviction = threading.Thread(target=self._evict_in_background, name="edge-cache-eviction", daemon=True)
+            self._eviction.start()
+
+    def _evict_in_background(self):
+        try:
+            self.evict()
+        except Exception:
+            logger.exception("Edge cache eviction failed")
+
+    def wait_for_eviction(self):
+        """Block until a background eviction, if one is running, has finished."""
+        eviction = self._eviction
+        if eviction is not None:
+            eviction.join()
+
+    def _entries(self, locks=None):
+        """
+        ``(atime, size, path)`` of every cached file; removes abandoned
+        downloads. Lock files are appended to ``locks`` if it is given.
+        """
+        entries, now = [], time.time()
+        for root, _dirs, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith(LOCK_SUFFIX):
+                    if locks is not None:
+                        locks.append(Path(root) / filename)
+                    continue
+                path = Path(root) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if filename.startswith(PART_PREFIX):
+                    if stat.st_mtime < now - PART_MAX_AGE:
+                        path.unlink(missing_ok=True)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Delete least recently used files until the cache fits in LOW_WATER of
+        its budget, then the lock files of objects that are not cached.
+        """
+        locks = []
+        entries = sorted(self._entries(locks), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * LOW_WATER
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                evicted += 1
+            logger.info("Edge cache evicted %s file(s); %s of %s bytes used", evicted, total, self.max_bytes)
+        for lock_path in locks:
+            _remove_stale_lock(lock_path)
+        with self._lock:
+            self._size = total
+        return evicted
+
+    def stats(self):
+        """Shared hit/miss counters, hit ratio and bytes on disk."""
+        self.flush_stats()
+        counts = {name: cache.get(key) or 0 for name, key in STATS_KEYS.items()}
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_ratio"] = counts["hits"] / lookups if lookups else None
+        counts["bytes"] = sum(size for _, size, _ in self._entries())
+        counts["max_bytes"] = self.max_bytes
+        return counts
+
+
+def _is_current(lock, lock_path):
+    """True if ``lock_path`` still names the open file ``lock``."""
+    try:
+        return os.stat(lock_path).st_ino == os.fstat(lock.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _remove_stale_lock(lock_path):
+    """Delete ``lock_path`` if its object is not cached and nobody holds the lock."""
+    try:
+        lock = open(lock_path, "a")
+    except FileNotFoundError:
+        return
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # a fetch holds it
+        if not lock_path.with_name(lock_path.name[: -len(LOCK_SUFFIX)]).exists() and _is_current(lock, lock_path):
+            lock_path.unlink()
+
+
+def is_enabled():
+    return bool(settings.EDGE_CACHE_DIR) and publishing.is_configured()
+
+
+@lru_cache(maxsize=1)
+def get_cache():
+    return EdgeCache(settings.EDGE_CACHE_DIR, settings.EDGE_CACHE_MAX_BYTES)
@@ -1,27 +1,392 @@
+# films/services/hls_transcoder.py
+"""
+Adaptive-bitrate HLS encoding.
+
+How a film is encoded is described by a named profile from
+``settings.HLS_PROFILES`` (codec, H.264 profile, x264 preset, CRF or
+constant-bitrate rate control, segment length and ladder); ``HLS_PROFILE``
+picks the one used for uploads and ``manage.py benchmark_transcode``
+measures them against each other. The source is encoded into every rung of
+the profile's ladder that is not taller than the source, each into its own
+media playlist:
+
+    <output_dir>/master.m3u8
+    <output_dir>/240p/index.m3u8, seg_00000.ts, ...
+    <output_dir>/720p/index.m3u8, ...
+
+Renditions are encoded concurrently, one ffmpeg process each, with at most
+``HLS_ENCODE_CORES`` in flight; ffmpeg's own threads are split between them.
+We launch the ffmpeg processes from threads rather than a
+multiprocessing pool because Celery's prefork workers are daemonic and may
+not fork children of their own.
+
+Keyframes are forced on segment boundaries so every rendition's segments
+line up and players can switch bitrate between any two segments.
+
+Long films are also split in time so the work can be spread over many
+Celery workers (see ``films.tasks.convert_film_to_hls``). ``plan_chunks``
+cuts the timeline on segment boundaries; ``encode_chunk`` encodes one chunk
+of every rendition into ``<name>/chunk_00003.m3u8`` + ``seg_00003_*.ts`` with
+its timestamps offset to the chunk start, and ``stitch_chunks`` concatenates
+the chunk playlists into the final media playlists. Because every chunk
+starts on a forced keyframe at a segment boundary the stitched stream is
+continuous and needs no discontinuity tags.
+
+The lowest rung's ffmpeg also writes the trickplay thumbnails, which are
+tiled into sprite sheets with a WebVTT track once the ladder is complete
+(see ``films.services.trickplay``).
+"""
+import json
+import math
 import os
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
+from films.services import trickplay
 
 FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.environ.get("FFPROBE_BIN", "ffprobe")
 
+MASTER_PLAYLIST = "master.m3u8"
+MEDIA_PLAYLIST = "index.m3u8"
+SEGMENT_PATTERN = "seg_%05d.ts"
+CHUNK_PLAYLIST_PREFIX = "chunk_"
+CHUNK_PLAYLIST = CHUNK_PLAYLIST_PREFIX + "{index:05d}.m3u8"
+CHUNK_SEGMENT_PATTERN = "seg_{index:05d}_%05d.ts"
+CHUNK_TS_OFFSET = 1
+# RFC 6381 codec strings advertised in the master playlist (level 4.0).
+VIDEO_CODEC_TAGS = {
+    ("libx264", "baseline"): "avc1.42e028",
+    ("libx264", "main"): "avc1.4d4028",
+    ("libx264", "high"): "avc1.640028",
+}
+AUDIO_CODEC_TAG = "mp4a.40.2"  # AAC-LC
 
-def transcode_to_hls(source_path: str, output_dir: str, playlist_name: str = "index.m3u8") -> str:
-"""
-Convert MP4 (or other) to HLS.
-Returns path to generated playlist.
-"""
-Path(output_dir).mkdir(parents=True, exist_ok=True)
-playlist_path = os.path.join(output_dir, playlist_name)
-
-
-# Simple 720p ladder (tweak as needed)
-cmd = [
-FFMPEG_BIN,
-"-y", "-i", source_path,
-"-profile:v", "main", "-level", "3.1",
-"-start_number", "0", "-hls_time", "6", "-hls_list_size", "0",
-"-f", "hls", playlist_path,
-]
-subprocess.check_call(cmd)
-return playlist_path
\ No newline at end of file
+
+class Rendition(NamedTuple):
+    name: str
+    height: int
+    video_kbps: int
+    audio_kbps: int = 96
+
+    def width_for(self, source_width, source_height):
+        """Width preserving the source aspect ratio, rounded to an even number."""
+        return 2 * round(source_width * self.height / source_height / 2)
+
+    @property
+    def bandwidth(self):
+        """Peak bits/s for the master playlist (maxrate is 110% of the target)."""
+        return int((self.video_kbps * 1.1 + self.audio_kbps) * 1000)
+
+
+class Profile(NamedTuple):
+    name: str
+    ladder: tuple
+    codec: str = "libx264"
+    h264_profile: str = "main"
+    preset: str = "veryfast"
+    # Capped CRF when set (maxrate/bufsize still follow the ladder),
+    # otherwise each rung is encoded at its video_kbps.
+    crf: int = None
+    segment_seconds: int = 6
+
+    def codecs(self, source):
+        """CODECS of this profile's encode of ``source``: no audio tag when the source is silent."""
+        tags = [VIDEO_CODEC_TAGS[(self.codec, self.h264_profile)]]
+        if source["has_audio"]:
+            tags.append(AUDIO_CODEC_TAG)
+        return ",".join(tags)
+
+
+class Chunk(NamedTuple):
+    index: int
+    start: float
+    # None for the last chunk, which runs to the end of the source.
+    duration: float = None
+
+
+def get_profile(name=None):
+    """The profile called ``name``, or the default ``settings.HLS_PROFILE``."""
+    name = name or settings.HLS_PROFILE
+    try:
+        options = dict(settings.HLS_PROFILES[name])
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown HLS profile {name!r}; choose from {sorted(settings.HLS_PROFILES)}")
+    ladder = tuple(Rendition(**rung) for rung in options.pop("ladder", settings.HLS_RENDITIONS))
+    profile = Profile(name=name, ladder=ladder, **options)
+    if (profile.codec, profile.h264_profile) not in VIDEO_CODEC_TAGS:
+        raise ImproperlyConfigured(f"HLS profile {name!r}: unsupported codec {profile.codec}/{profile.h264_profile}")
+    return profile
+
+
+def probe(source_path):
+    """Return ``{"width", "height", "duration", "has_audio"}`` for a video file."""
+    result = subprocess.run(
+        [
+            FFPROBE_BIN, "-v", "error",
+            "-show_entries", "stream=codec_type,width,height:format=duration",
+            "-of", "json", str(source_path),
+        ],
+        check=True, capture_output=True, text=True,
+    )
+    info = json.loads(result.stdout)
+    video = next(s for s in info["streams"] if s.get("codec_type") == "video")
+    return {
+        "width": int(video["width"]),
+        "height": int(video["height"]),
+        "duration": float(info.get("format", {}).get("duration") or 0),
+        "has_audio": any(s.get("codec_type") == "audio" for s in info["streams"]),
+    }
+
+
+def select_renditions(ladder, source_height):
+    """Drop rungs that would upscale; always keep at least the smallest one."""
+    return [r for r in ladder if r.height <= source_height] or ladder[:1]
+
+
+def plan_chunks(duration, profile, chunk_seconds=None):
+    """Split ``duration`` seconds into chunks that start on segment boundaries."""
+    segment = profile.segment_seconds
+    chunk_seconds = chunk_seconds or settings.HLS_CHUNK_SECONDS
+    chunk_seconds = max(1, round(chunk_seconds / segment)) * segment
+    count = max(1, math.ceil(duration / chunk_seconds))
+    return [
+        Chunk(index, index * chunk_seconds, chunk_seconds if index < count - 1 else None)
+        for index in range(count)
+    ]
+
+
+def rendition_command(source_path, output_dir, profile, rendition, source, threads, chunk=None, thumbnails=None):
+    out = Path(output_dir) / rendition.name
+    command = [FFMPEG_BIN, "-y", "-nostdin"]
+    if chunk is not None:
+        # Input seeking is frame-accurate when re-encoding.
+        command += ["-ss", str(chunk.start)]
+    command += ["-i", str(source_path)]
+    if chunk is not None and chunk.duration:
+        command += ["-t", str(chunk.duration)]
+    command += [
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:{rendition.height}",
+        "-c:v", profile.codec, "-profile:v", profile.h264_profile, "-preset", profile.preset,
+        "-pix_fmt", "yuv420p",
+    ]
+    if profile.crf is not None:
+        command += ["-crf", str(profile.crf)]
+    else:
+        command += ["-b:v", f"{rendition.video_kbps}k"]
+    command += [
+        "-maxrate", f"{int(rendition.video_kbps * 1.1)}k",
+        "-bufsize", f"{rendition.video_kbps * 2}k",
+        "-force_key_frames", f"expr:gte(t,n_forced*{profile.segment_seconds})",
+        "-sc_threshold", "0",
+        "-threads", str(threads),
+    ]
+    if source["has_audio"]:
+        command += ["-c:a", "aac", "-b:a", f"{rendition.audio_kbps}k", "-ac", "2"]
+    if chunk is not None:
+        segments = CHUNK_SEGMENT_PATTERN.format(index=chunk.index)
+        # Keep timestamps continuous across chunks. The constant lead keeps
+        # every chunk's DTS positive; otherwise the muxer would shift only
+        # the first chunk by the encoder's B-frame delay.
+        command += ["-output_ts_offset", str(chunk.start + CHUNK_TS_OFFSET)]
+    else:
+        segments = SEGMENT_PATTERN
+    command += [
+        "-start_number", "0",
+        "-hls_time", str(profile.segment_seconds),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", str(out / segments),
+        "-f", "hls", str(playlist_path(output_dir, rendition, chunk)),
+    ]
+    if thumbnails is not None:
+        command += trickplay.output_args(output_dir, thumbnails, source, chunk)
+    return command
+
+
+def playlist_path(output_dir, rendition, chunk=None):
+    name = CHUNK_PLAYLIST.format(index=chunk.index) if chunk is not None else MEDIA_PLAYLIST
+    return Path(output_dir) / rendition.name / name
+
+
+def is_complete(path):
+    """ffmpeg only ends a VOD playlist once its last segment is written."""
+    try:
+        return Path(path).read_text().rstrip().endswith("#EXT-X-ENDLIST")
+    except FileNotFoundError:
+        return False
+
+
+def encode_rendition(
+    source_path, output_dir, profile, rendition, source, threads, chunk=None, on_progress=None, thumbnails=None
+):
+    """
+    Run ffmpeg for one rendition, also writing trickplay thumbnails when
+    ``thumbnails`` options are given. ``on_progress(seconds, frames)`` is
+    called with the output time and frames encoded since the previous call,
+    parsed from ffmpeg's ``-progress`` stream as it runs.
+    """
+    (Path(output_dir) / rendition.name).mkdir(parents=True, exist_ok=True)
+    command = rendition_command(source_path, output_dir, profile, rendition, source, threads, chunk, thumbnails)
+    command[1:1] = ["-hide_banner", "-loglevel", "error", "-progress", "pipe:1", "-nostats"]
+
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        report, seconds, frames = {}, 0.0, 0
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            report[key] = value
+            if key != "progress":
+                continue
+            # One report block ends with progress=continue|end.
+            out_seconds = _parse_number(report.get("out_time_us")) / 1_000_000
+            out_frames = int(_parse_number(report.get("frame")))
+            if on_progress and (out_seconds > seconds or out_frames > frames):
+                on_progress(max(0.0, out_seconds - seconds), max(0, out_frames - frames))
+            seconds, frames = max(seconds, out_seconds), max(frames, out_frames)
+        returncode = process.wait()
+        if returncode:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(returncode, command, stderr=stderr.read())
+    return rendition
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0  # "N/A" until the first frame is written
+
+
+def encode_renditions(source_path, output_dir, profile, renditions, source, chunk=None, on_progress=None):
+    """
+    Encode ``renditions`` (of the whole source, or of one chunk) concurrently.
+    Renditions whose playlist is already complete, e.g. from an earlier
+    attempt that failed part-way, are kept as they are.
+    """
+    thumbnails, lowest = trickplay.get_options(), min(renditions, key=lambda r: r.height)
+    pending = []
+    for rendition in renditions:
+        path = playlist_path(output_dir, rendition, chunk)
+        if not is_complete(path):
+            pending.append(rendition)
+        elif on_progress:
+            on_progress(sum(duration for duration, _ in _read_entries(path)), 0)
+    if pending:
+        cores = settings.HLS_ENCODE_CORES
+        workers = max(1, min(len(pending), cores))
+        threads = max(1, math.floor(cores / workers))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    encode_rendition, source_path, output_dir, profile, r, source, threads, chunk, on_progress,
+                    thumbnails if r is lowest else None,
+                )
+                for r in pending
+            ]
+            for future in futures:
+                future.result()
+    return renditions
+
+
+def encode_chunk(source_path, output_dir, profile, chunk, source, on_progress=None):
+    """Encode one chunk of every applicable rendition; returns the chunk index."""
+    renditions = select_renditions(profile.ladder, source["height"])
+    encode_renditions(source_path, output_dir, profile, renditions, source, chunk, on_progress)
+    return chunk.index
+
+
+def _read_entries(playlist_path):
+    """``(duration, uri)`` pairs from a media playlist."""
+    entries, duration = [], None
+    for line in Path(playlist_path).read_text().splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+        elif line and not line.startswith("#") and duration is not None:
+            entries.append((duration, line))
+            duration = None
+    return entries
+
+
+def write_media_playlist(path, entries, segment_seconds):
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(max((d for d, _ in entries), default=segment_seconds))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for duration, uri in entries:
+        lines += [f"#EXTINF:{duration:.6f},", uri]
+    lines.append("#EXT-X-ENDLIST")
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+def stitch_chunks(output_dir, profile, chunk_count, source):
+    """
+    Join the chunk playlists of every rendition into its ``index.m3u8``,
+    build the trickplay track and write the master playlist. Returns the
+    path of the master playlist.
+    """
+    renditions = select_renditions(profile.ladder, source["height"])
+    spans = []
+    for rendition in renditions:
+        directory = Path(output_dir) / rendition.name
+        # Chunk playlists are kept: they mark finished work if the film is re-encoded.
+        chunks = [_read_entries(directory / CHUNK_PLAYLIST.format(index=i)) for i in range(chunk_count)]
+        write_media_playlist(directory / MEDIA_PLAYLIST, [e for entries in chunks for e in entries], profile.segment_seconds)
+        if not spans:
+            spans = _chunk_spans(chunks)
+    build_trickplay(output_dir, spans, source)
+    return write_master_playlist(output_dir, profile, renditions, source)
+
+
+def _chunk_spans(chunks):
+    """``(index, start, end)`` of each chunk, from its playlist's segment durations."""
+    spans, start = [], 0.0
+    for index, entries in enumerate(chunks):
+        end = start + sum(duration for duration, _ in entries)
+        spans.append((index, start, end))
+        start = end
+    return spans
+
+
+def build_trickplay(output_dir, spans, source):
+    """Build the trickplay track if thumbnails are enabled; returns its path or None."""
+    options = trickplay.get_options()
+    return trickplay.build_track(output_dir, spans, options, source) if options else None
+
+
+def write_master_playlist(output_dir, profile, renditions, source):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for rendition in sorted(renditions, key=lambda r: r.bandwidth):
+        width = rendition.width_for(source["width"], source["height"])
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={rendition.bandwidth},"
+            f"RESOLUTION={width}x{rendition.height},CODECS=\"{profile.codecs(source)}\""
+        )
+        lines.append(f"{rendition.name}/{MEDIA_PLAYLIST}")
+    path = Path(output_dir) / MASTER_PLAYLIST
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def transcode_to_hls(source_path, output_dir, profile=None, on_progress=None):
+    """
+    Encode ``source_path`` into an HLS ladder under ``output_dir`` in this
+    process, without chunking. Returns the path of the master playlist.
+    """
+    profile = profile or get_profile()
+    source = probe(source_path)
+    renditions = select_renditions(profile.ladder, source["height"])
+    encoded = encode_renditions(source_path, output_dir, profile, renditions, source, on_progress=on_progress)
+    lowest = min(encoded, key=lambda r: r.height)
+    build_trickplay(output_dir, _chunk_spans([_read_entries(playlist_path(output_dir, lowest))]), source)
+    return write_master_playlist(output_dir, profile, encoded, source)
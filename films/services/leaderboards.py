@@ -0,0 +1,183 @@
+# films/services/leaderboards.py
+"""
+Trending and top-rented leaderboards kept in Redis sorted sets.
+
+Scores are updated incrementally as orders succeed and ratings arrive, so
+reading the top N is a single ZREVRANGE instead of a Count('orders') over
+the whole Order table.
+
+"Trending" uses forward exponential decay: an event at time ``t`` adds
+``weight * 2 ** ((t - epoch) / half_life)``. Newer events are worth more, and
+because every member grows by the same factor over time the ranking is
+correct without ever rewriting old scores. ``reconcile()`` periodically
+rebuilds every board from the database against a fresh epoch, which keeps
+the numbers small and repairs anything missed while Redis was unreachable.
+
+    films:lb:trending            films:lb:trending:cat:<category_id>
+    films:lb:top-rented          films:lb:top-rented:cat:<category_id>
+
+Events keep arriving while ``reconcile()`` reads the database. So it first
+sets ``films:lb:rebuild`` to the new epoch. While that is set, every
+increment also goes to ``films:lb:delta:<board>``, weighed against the new
+epoch, and the final transaction merges the deltas into the rebuilt boards.
+No event is lost. One committed while the database is being read may be
+counted twice.
+"""
+import logging
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TRENDING = "trending"
+TOP_RENTED = "top-rented"
+BOARDS = (TRENDING, TOP_RENTED)
+
+EPOCH_KEY = "films:lb:epoch"
+REGISTRY_KEY = "films:lb:keys"
+REBUILD_KEY = "films:lb:rebuild"
+DELTA_KEY = "films:lb:delta:{key}"
+REBUILD_TIMEOUT = 15 * 60
+RATING_WEIGHT = 0.5
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    return redis.Redis.from_url(settings.LEADERBOARD_REDIS_URL, socket_timeout=2)
+
+
+def board_key(board, category_id=None):
+    key = f"films:lb:{board}"
+    return f"{key}:cat:{category_id}" if category_id else key
+
+
+def _decay(timestamp, epoch):
+    return 2 ** ((timestamp - epoch) / (settings.LEADERBOARD_HALF_LIFE_HOURS * 3600))
+
+
+def _epoch(client):
+    epoch = client.get(EPOCH_KEY)
+    if epoch is None:
+        client.set(EPOCH_KEY, time.time(), nx=True)
+        epoch = client.get(EPOCH_KEY)
+    return float(epoch)
+
+
+def _increment(film_id, category_id, trending_weight, rented=0):
+    client = get_redis()
+    now = time.time()
+    epoch, rebuild_epoch = client.mget(EPOCH_KEY, REBUILD_KEY)
+    epoch = _epoch(client) if epoch is None else float(epoch)
+    # The boards, and the deltas reconcile() merges into the boards it is rebuilding.
+    targets = [("{key}", epoch)]
+    if rebuild_epoch is not None:
+        targets.append((DELTA_KEY, float(rebuild_epoch)))
+
+    increments = []
+    for category in (None, category_id) if category_id else (None,):
+        increments.append((board_key(TRENDING, category), True))
+        if rented:
+            increments.append((board_key(TOP_RENTED, category), False))
+    with client.pipeline(transaction=False) as pipe:
+        for pattern, base in targets:
+            weight = trending_weight * _decay(now, base)
+            for key, trending in increments:
+                pipe.zincrby(pattern.format(key=key), weight if trending else rented, film_id)
+        pipe.sadd(REGISTRY_KEY, *(key for key, _ in increments))
+        pipe.execute()
+
+
+def record_rental(film_id, category_id):
+    """Count a successful order. Never raises: boards are reconciled later."""
+    try:
+        _increment(film_id, category_id, trending_weight=1.0, rented=1)
+    except redis.RedisError:
+        logger.exception("Could not record rental of film %s on leaderboards", film_id)
+
+
+def record_rating(film_id, category_id, value):
+    """Nudge the trending score up for good ratings and down for poor ones."""
+    try:
+        _increment(film_id, category_id, trending_weight=(value - 3) * RATING_WEIGHT)
+    except redis.RedisError:
+        logger.exception("Could not record rating of film %s on leaderboards", film_id)
+
+
+def top_film_ids(board, category_id=None, limit=20):
+    """Return the ids of the top ``limit`` films, best first."""
+    members = get_redis().zrevrange(board_key(board, category_id), 0, limit - 1)
+    return [int(member) for member in members]
+
+
+def reconcile():
+    """Rebuild every board from the database against a fresh epoch."""
+    from payments.models import Order
+    from reviews.models import Rating
+
+    client = get_redis()
+    epoch = time.time()
+    # Deltas of a rebuild that died, or of increments that raced the last
+    # merge, are already on the live boards.
+    known = [key.decode() for key in client.smembers(REGISTRY_KEY)]
+    with client.pipeline(transaction=True) as pipe:
+        if known:
+            pipe.delete(*(DELTA_KEY.format(key=key) for key in known))
+        pipe.set(REBUILD_KEY, epoch, ex=REBUILD_TIMEOUT)
+        pipe.execute()
+
+    window_start = epoch - settings.LEADERBOARD_HALF_LIFE_HOURS * 3600 * 8
+    scores = {}
+
+    def add(board, film_id, category_id, value):
+        for category in (None, category_id) if category_id else (None,):
+            board_scores = scores.setdefault(board_key(board, category), {})
+            board_scores[film_id] = board_scores.get(film_id, 0) + value
+
+    successful = Order.objects.filter(status=Order.Status.SUCCESS)
+    for row in successful.values("film_id", "film__category_id").annotate(n=Count("id")):
+        add(TOP_RENTED, row["film_id"], row["film__category_id"], row["n"])
+
+    # Aggregate per film per day in the database; decay is applied to each day.
+    recent = successful.filter(created_at__gte=_aware(window_start))
+    for row in recent.values("film_id", "film__category_id", day=TruncDate("created_at")).annotate(n=Count("id")):
+        add(TRENDING, row["film_id"], row["film__category_id"], row["n"] * _day_decay(row["day"], epoch))
+
+    ratings = Rating.objects.filter(created_at__gte=_aware(window_start))
+    for row in ratings.values("film_id", "film__category_id", day=TruncDate("created_at")).annotate(
+        total=Sum(F("value") - 3)
+    ):
+        add(TRENDING, row["film_id"], row["film__category_id"], row["total"] * RATING_WEIGHT * _day_decay(row["day"], epoch))
+
+    # Boards first written during the rebuild only have deltas.
+    keys = scores.keys() | {key.decode() for key in client.smembers(REGISTRY_KEY)}
+    with client.pipeline(transaction=True) as pipe:
+        for key in keys:
+            delta = DELTA_KEY.format(key=key)
+            pipe.delete(key)
+            if scores.get(key):
+                pipe.zadd(key, scores[key])
+            pipe.zunionstore(key, [key, delta])  # summed; an empty board is removed
+            pipe.delete(delta)
+        pipe.delete(REGISTRY_KEY)
+        if keys:
+            pipe.sadd(REGISTRY_KEY, *keys)
+        pipe.set(EPOCH_KEY, epoch)
+        pipe.delete(REBUILD_KEY)
+        pipe.execute()
+    return len(scores)
+
+
+def _aware(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def _day_decay(day, epoch):
+    midday = timezone.make_aware(datetime.combine(day, dt_time(12))).timestamp()
+    return _decay(min(midday, epoch), epoch)
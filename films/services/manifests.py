@@ -0,0 +1,170 @@
+# films/services/manifests.py
+"""
+Per-user playlists rendered from cached templates.
+
+The gateway renders playlists and the trickplay track itself rather than
+redirecting to storage. After a redirect the player would resolve the
+relative URIs against the bucket's URL, which is not signed. Each file is
+read from storage and parsed once into a template: the text split at every
+URI that points into the ladder, with each URI made relative to the ladder
+directory. ``render`` therefore only joins the pieces with the user's
+gateway prefix:
+
+    ("#EXTM3U\\n...#EXTINF:6.000000,\\n", "240p/seg_00000.ts\\n#EXTINF:...", ...)
+    -> prefix.join(template)
+
+so a 700-segment playlist takes one ``str.join``. Handled URIs are the URI
+lines and ``URI="..."`` attributes of HLS playlists, and the cue payloads
+of WebVTT tracks (whose ``#xywh=`` fragments are kept).
+
+With ``sign``, ``render`` links only other playlists and tracks through the
+gateway, and every segment, init file and sprite through ``sign`` instead.
+The gateway passes a presigner for the bucket, so players fetch media
+straight from storage.
+
+Templates live in a per-process LRU of ``HLS_MANIFEST_CACHE_SIZE`` files,
+keyed by a version of the ladder held in the shared cache. Re-transcoding a
+film bumps that version (``invalidate``), and every process drops its old
+templates on the next request. ``duration`` sums the segments of the first
+variant playlist to get the running time that stream tokens are sized by.
+"""
+import posixpath
+import re
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from films.services import hls_transcoder
+
+VERSION_KEY = "films:manifest:version:{scope}"
+SUFFIXES = (".m3u8", ".vtt")
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+
+
+def is_manifest(name):
+    return name.endswith(SUFFIXES)
+
+
+def _version(scope):
+    key = VERSION_KEY.format(scope=scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(scope):
+    """Drop the templates of every file under the ladder directory ``scope``."""
+    cache.set(VERSION_KEY.format(scope=scope), time.time_ns(), timeout=None)
+
+
+def _resolve(directory, uri):
+    """``uri`` relative to the ladder directory, or None if it points elsewhere."""
+    if not uri or "://" in uri or uri.startswith(("/", "data:")):
+        return None
+    path = posixpath.normpath(posixpath.join(directory, uri))
+    return None if path.startswith("..") else path
+
+
+class _Template:
+    """Pieces to join with a prefix; each piece after the first starts with a path."""
+
+    def __init__(self):
+        self.pieces = [""]
+        self.path_lengths = []
+
+    def text(self, text):
+        self.pieces[-1] += text
+
+    def uri(self, directory, uri):
+        path = _resolve(directory, uri)
+        if path is None:
+            self.text(uri)
+        else:
+            self.pieces.append(path)
+            self.path_lengths.append(len(path))
+
+
+def _parse_playlist(text, directory, template):
+    for line in text.splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        if body.startswith("#"):
+            end = 0
+            for match in URI_ATTRIBUTE.finditer(body):
+                template.text(body[end:match.start(1)])
+                template.uri(directory, match.group(1))
+                end = match.end(1)
+            template.text(line[end:])
+        elif body.strip():
+            template.uri(directory, body.strip())
+            template.text(line[len(body):])
+        else:
+            template.text(line)
+
+
+def _parse_track(text, directory, template):
+    in_cue = False
+    for line in text.splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        if in_cue and body:
+            uri, hash_, fragment = body.partition("#")
+            template.uri(directory, uri)
+            template.text(hash_ + fragment + line[len(body):])
+            in_cue = False
+            continue
+        template.text(line)
+        in_cue = "-->" in body
+
+
+@lru_cache(maxsize=settings.HLS_MANIFEST_CACHE_SIZE)
+def _template(scope, path, version):
+    with default_storage.open(posixpath.join(scope, path), "rb") as fh:
+        text = fh.read().decode("utf-8")
+    template = _Template()
+    parse = _parse_track if path.endswith(".vtt") else _parse_playlist
+    parse(text, posixpath.dirname(path), template)
+    return tuple(template.pieces), tuple(template.path_lengths)
+
+
+@lru_cache(maxsize=settings.HLS_MANIFEST_CACHE_SIZE)
+def _duration(scope, version):
+    master = "".join(_template(scope, hls_transcoder.MASTER_PLAYLIST, version)[0])
+    variant = next(line for line in master.splitlines() if line.strip() and not line.startswith("#"))
+    playlist = "".join(_template(scope, variant.strip(), version)[0])
+    return sum(
+        float(line[len("#EXTINF:"):].split(",", 1)[0]) for line in playlist.splitlines() if line.startswith("#EXTINF:")
+    )
+
+
+def duration(scope):
+    """
+    Running time in seconds of the ladder ``scope``, from its first variant
+    playlist. Raises FileNotFoundError if the ladder is incomplete.
+    """
+    try:
+        return _duration(scope, _version(scope))
+    except StopIteration:
+        raise FileNotFoundError(f"{scope}/{hls_transcoder.MASTER_PLAYLIST} lists no variants")
+
+
+def render(scope, path, prefix, sign=None):
+    """
+    The file ``path`` of the ladder ``scope`` with every URI into the ladder
+    made absolute under ``prefix`` (the user's gateway URL, ending in "/").
+    With ``sign``, URIs of media rather than playlists become
+    ``sign(<storage name>)``. Raises FileNotFoundError if the file does not
+    exist.
+    """
+    pieces, path_lengths = _template(scope, path, _version(scope))
+    if sign is None:
+        return prefix.join(pieces)
+    parts = [pieces[0]]
+    for piece, length in zip(pieces[1:], path_lengths):
+        target = piece[:length]
+        parts.append(prefix + target if is_manifest(target) else sign(posixpath.join(scope, target)))
+        parts.append(piece[length:])
+    return "".join(parts)
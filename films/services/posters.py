@@ -0,0 +1,90 @@
+# films/services/posters.py
+"""
+Responsive poster derivatives.
+
+Uploaded posters are often multi-megabyte JPEGs, far more than a catalog card
+needs on a phone. After upload a Celery task renders each width in
+``settings.POSTER_DERIVATIVE_WIDTHS`` as WebP and JPEG into MediaStorage and
+records them on ``Film.poster_derivatives``:
+
+    {"source": "films/posters/x.jpg",
+     "webp": {"320": "films/posters/derivatives/7/3f9a0c.../320.webp", ...},
+     "jpeg": {"320": "films/posters/derivatives/7/3f9a0c.../320.jpg", ...}}
+
+``source`` lets the signal tell whether the current poster was already processed.
+Names are addressed by the poster's content hash. A new poster therefore
+gets new URLs, and the old files keep serving, including from CDN caches,
+until the new set is recorded and ``delete_derivatives`` removes them.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+DERIVATIVE_DIR = "films/posters/derivatives/{film_id}/{digest}/"
+FORMATS = {
+    "webp": {"format": "WEBP", "ext": "webp", "options": {"quality": 80, "method": 4}},
+    "jpeg": {"format": "JPEG", "ext": "jpg", "options": {"quality": 82, "optimize": True, "progressive": True}},
+}
+
+
+def needs_derivatives(film):
+    return bool(film.poster) and (film.poster_derivatives or {}).get("source") != film.poster.name
+
+
+def generate_derivatives(film):
+    """Render and store every derivative for ``film.poster``; return the mapping ({} if no widths are set)."""
+    widths = sorted(settings.POSTER_DERIVATIVE_WIDTHS)
+    if not widths:
+        return {}
+    with default_storage.open(film.poster.name, "rb") as fh:
+        data = fh.read()
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder downscale while decoding: far cheaper than a full decode.
+    image.draft("RGB", (widths[-1], widths[-1] * 4))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    # Never upscale; an image narrower than every width still gets one derivative.
+    widths = [w for w in widths if w < image.width] or [image.width]
+
+    derivatives = {"source": film.poster.name, **{key: {} for key in FORMATS}}
+    base = DERIVATIVE_DIR.format(film_id=film.pk, digest=hashlib.sha256(data).hexdigest()[:16])
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        for key, spec in FORMATS.items():
+            name = f"{base}{width}.{spec['ext']}"
+            if not default_storage.exists(name):  # else rendered from these same bytes before
+                buffer = io.BytesIO()
+                resized.save(buffer, spec["format"], **spec["options"])
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            derivatives[key][str(width)] = name
+    return derivatives
+
+
+def delete_derivatives(derivatives, keep=None):
+    """Delete the files of ``derivatives`` that ``keep`` does not also use."""
+    kept = {name for key in FORMATS for name in (keep or {}).get(key, {}).values()}
+    for key in FORMATS:
+        for name in (derivatives or {}).get(key, {}).values():
+            if name not in kept:
+                default_storage.delete(name)
+
+
+def build_srcset(derivatives, request=None):
+    """Return ``{"webp": "<url> 320w, ...", "jpeg": ...}`` or None if not processed."""
+    if not derivatives or not derivatives.get("source"):
+        return None
+    srcset = {}
+    for key in FORMATS:
+        entries = []
+        for width, name in sorted(derivatives.get(key, {}).items(), key=lambda item: int(item[0])):
+            url = default_storage.url(name)
+            if request:
+                url = request.build_absolute_uri(url)
+            entries.append(f"{url} {width}w")
+        srcset[key] = ", ".join(entries)
+    return srcset
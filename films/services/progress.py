@@ -0,0 +1,176 @@
+# films/services/progress.py
+"""
+Live transcode progress.
+
+A film's encode may be spread over many ffmpeg processes on many workers
+(one per chunk and rendition), so progress is kept as shared counters in the
+cache rather than on the Film row:
+
+    films:transcode:<id>         {"status", "total", "started_at"}
+    films:transcode:<id>:done    milliseconds of output encoded so far
+    films:transcode:<id>:frames  frames encoded so far
+
+Each worker accumulates ffmpeg's ``-progress`` reports in a ``ProgressTracker``
+and flushes them with ``cache.incr`` at most once every ``FLUSH_SECONDS``,
+pushing a snapshot to the film's Channels group at the same time. Readers
+derive percent, encode fps and ETA from the counters.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RECORD_KEY = "films:transcode:{film_id}"
+DONE_KEY = "films:transcode:{film_id}:done"
+FRAMES_KEY = "films:transcode:{film_id}:frames"
+GROUP_NAME = "film_{film_id}_transcode"
+
+RECORD_TIMEOUT = 60 * 60 * 24
+FLUSH_SECONDS = 1.0
+
+ENCODING = "encoding"
+STITCHING = "stitching"
+PUBLISHING = "publishing"
+SUCCESS = "success"
+FAILED = "failed"
+
+
+def group_name(film_id):
+    return GROUP_NAME.format(film_id=film_id)
+
+
+def start(film_id, total_seconds):
+    """Reset the record for a new encode of ``total_seconds`` of output."""
+    cache.set_many(
+        {
+            RECORD_KEY.format(film_id=film_id): {
+                "status": ENCODING,
+                "total": total_seconds,
+                "started_at": time.time(),
+            },
+            DONE_KEY.format(film_id=film_id): 0,
+            FRAMES_KEY.format(film_id=film_id): 0,
+        },
+        timeout=RECORD_TIMEOUT,
+    )
+    publish(film_id)
+
+
+def set_status(film_id, status):
+    key = RECORD_KEY.format(film_id=film_id)
+    record = cache.get(key)
+    if record is not None:
+        record = {**record, "status": status}
+        if status in (SUCCESS, FAILED):
+            record["finished_at"] = time.time()
+        cache.set(key, record, timeout=RECORD_TIMEOUT)
+    publish(film_id)
+
+
+def get_progress(film_id):
+    """Return the current snapshot for ``film_id`` or None if nothing is tracked."""
+    keys = [key.format(film_id=film_id) for key in (RECORD_KEY, DONE_KEY, FRAMES_KEY)]
+    values = cache.get_many(keys)
+    record = values.get(keys[0])
+    if record is None:
+        return None
+    done = values.get(keys[1], 0) / 1000
+    frames = values.get(keys[2], 0)
+    total = record["total"]
+    elapsed = max(record.get("finished_at", time.time()) - record["started_at"], 1e-6)
+
+    # The probed duration is approximate; the last frames may end short of it.
+    percent = min(100.0, 100.0 * done / total) if total else 0.0
+    if record["status"] == SUCCESS:
+        percent = 100.0
+    eta = None
+    if record["status"] == ENCODING and done:
+        eta = max(0, round((total - done) / (done / elapsed)))
+    return {
+        "status": record["status"],
+        "percent": round(percent, 1),
+        "fps": round(frames / elapsed, 1),
+        "eta_seconds": eta,
+        "elapsed_seconds": round(elapsed),
+    }
+
+
+def publish(film_id, snapshot=None):
+    """Push a snapshot to filmmakers watching the film. Never raises."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    snapshot = snapshot or get_progress(film_id)
+    if snapshot is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            group_name(film_id), {"type": "transcode_progress", "progress": snapshot}
+        )
+    except Exception:
+        logger.warning("Could not publish transcode progress of film %s", film_id, exc_info=True)
+
+
+class ProgressTracker:
+    """
+    Collects progress deltas from the ffmpeg processes of one task (they may
+    run on several threads) and flushes them to the shared counters.
+    """
+
+    def __init__(self, film_id, flush_seconds=FLUSH_SECONDS):
+        self.film_id = film_id
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._seconds = 0.0
+        self._frames = 0
+        self._counted_millis = 0  # output time this tracker has added to the counters
+        self._flushed_at = time.monotonic()
+
+    def __call__(self, seconds, frames):
+        with self._lock:
+            self._seconds += seconds
+            self._frames += frames
+            if time.monotonic() - self._flushed_at < self.flush_seconds:
+                return
+            self._flush()
+        publish(self.film_id)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        publish(self.film_id)
+
+    def discard(self):
+        """
+        Take back the output time this tracker counted, before the task that
+        owns it is retried and reports it again. Frames stay counted: they
+        were encoded, and fps measures the work done.
+        """
+        with self._lock:
+            millis, self._counted_millis = self._counted_millis, 0
+            self._seconds, self._frames = 0.0, 0
+            self._flushed_at = time.monotonic()
+        try:
+            if millis:
+                cache.decr(DONE_KEY.format(film_id=self.film_id), millis)
+        except ValueError:
+            pass  # record expired or was never started
+        publish(self.film_id)
+
+    def _flush(self):
+        millis, frames = round(self._seconds * 1000), self._frames
+        self._seconds, self._frames = self._seconds - millis / 1000, 0
+        self._flushed_at = time.monotonic()
+        try:
+            if millis:
+                cache.incr(DONE_KEY.format(film_id=self.film_id), millis)
+                self._counted_millis += millis
+            if frames:
+                cache.incr(FRAMES_KEY.format(film_id=self.film_id), frames)
+        except ValueError:
+            pass  # record expired or was never started
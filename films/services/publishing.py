@@ -0,0 +1,152 @@
+# films/services/publishing.py
+"""
+Publishing finished HLS ladders to the media bucket.
+
+Transcoding writes into ``MEDIA_ROOT/hls/...``; when media lives in S3 the
+ladder is copied to the same relative key under ``MediaStorage``. A feature
+film is thousands of small segments, so files are uploaded concurrently by a
+bounded thread pool sharing one boto3 client (clients are thread-safe, and
+its connection pool is sized to the pool). Each file is retried on its own
+with backoff; a file that still fails fails the publish.
+
+Uploads happen in three waves — segments and trickplay sprites, then media
+playlists and the thumbnail track, then the master playlist — and a wave
+only starts once the previous one has fully succeeded, so a player can
+never fetch a playlist that references a file that is not there yet. Objects already in the bucket with the same size are
+skipped, which makes re-publishing after a failure cheap.
+
+Ladders are uploaded private: players only reach them through the signed
+streaming gateway, which redirects to a short-lived presigned URL.
+"""
+import logging
+import mimetypes
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+
+from core_api.storages import MediaStorage
+from films.services import hls_transcoder, trickplay
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    ".ts": "video/mp2t",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".vtt": "text/vtt",
+    ".webp": "image/webp",
+}
+# Intermediate files that only matter to the encoder.
+LOCAL_ONLY_PREFIXES = (hls_transcoder.CHUNK_PLAYLIST_PREFIX, trickplay.THUMB_PREFIX)
+INDEX_SUFFIXES = (".m3u8", ".vtt")
+# Segment and sprite names are unique per source hash and profile, so they never change.
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PLAYLIST_CACHE_CONTROL = "public, max-age=300"
+RETRY_BACKOFF = 0.5
+PRESIGNED_URL_SECONDS = 5 * 60
+# Segments are small: one PUT each, no per-file transfer threads.
+TRANSFER_CONFIG = TransferConfig(use_threads=False)
+
+
+def is_configured():
+    return bool(settings.AWS_STORAGE_BUCKET_NAME)
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    return boto3.client(
+        "s3",
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+        region_name=settings.AWS_S3_REGION_NAME,
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        config=Config(max_pool_connections=settings.HLS_PUBLISH_WORKERS),
+    )
+
+
+def bucket_key(path):
+    relative = Path(path).relative_to(settings.MEDIA_ROOT).as_posix()
+    return posixpath.join(MediaStorage.location, relative)
+
+
+def presigned_url(name, expires_in=PRESIGNED_URL_SECONDS):
+    """Short-lived GET URL of the private MediaStorage object ``name``."""
+    return get_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": settings.AWS_STORAGE_BUCKET_NAME, "Key": posixpath.join(MediaStorage.location, name)},
+        ExpiresIn=expires_in,
+    )
+
+
+def _waves(directory):
+    """Segments and sprites, media playlists and tracks, master playlist."""
+    segments, playlists, master = [], [], []
+    for path in sorted(Path(directory).rglob("*")):
+        if not path.is_file() or path.name.startswith(LOCAL_ONLY_PREFIXES):
+            continue
+        if path.name == hls_transcoder.MASTER_PLAYLIST:
+            master.append(path)
+        elif path.suffix in INDEX_SUFFIXES:
+            playlists.append(path)
+        else:
+            segments.append(path)
+    return [segments, playlists, master]
+
+
+def _existing_sizes(prefix):
+    sizes = {}
+    paginator = get_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            sizes[obj["Key"]] = obj["Size"]
+    return sizes
+
+
+def _upload(path, key):
+    content_type = CONTENT_TYPES.get(path.suffix) or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    extra = {
+        "ContentType": content_type,
+        "CacheControl": PLAYLIST_CACHE_CONTROL if path.suffix in INDEX_SUFFIXES else SEGMENT_CACHE_CONTROL,
+    }
+
+    for attempt in range(1, settings.HLS_PUBLISH_ATTEMPTS + 1):
+        try:
+            get_client().upload_file(
+                str(path), settings.AWS_STORAGE_BUCKET_NAME, key, ExtraArgs=extra, Config=TRANSFER_CONFIG
+            )
+            return
+        except (BotoCoreError, ClientError, OSError):
+            if attempt == settings.HLS_PUBLISH_ATTEMPTS:
+                raise
+            logger.warning("Upload of %s failed (attempt %s); retrying", key, attempt, exc_info=True)
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def publish_ladder(output_dir):
+    """
+    Upload the ladder in ``output_dir`` (under MEDIA_ROOT) to the media bucket.
+    Returns the number of files uploaded; a no-op when media is stored locally.
+    """
+    if not is_configured():
+        return 0
+    existing = _existing_sizes(bucket_key(output_dir) + "/")
+    uploaded = 0
+    with ThreadPoolExecutor(max_workers=settings.HLS_PUBLISH_WORKERS) as pool:
+        for wave in _waves(output_dir):
+            pending = [(path, bucket_key(path)) for path in wave]
+            pending = [(path, key) for path, key in pending if existing.get(key) != path.stat().st_size]
+            futures = [pool.submit(_upload, path, key) for path, key in pending]
+            # Let the whole wave finish (or exhaust its retries) before failing.
+            errors = [future.exception() for future in futures]
+            failed = [error for error in errors if error is not None]
+            if failed:
+                raise failed[0]
+            uploaded += len(pending)
+    return uploaded
@@ -0,0 +1,69 @@
+# films/services/recommendations.py
+"""
+"Viewers also rented" recommendations from the Order purchase graph.
+
+The film x film co-occurrence matrix is computed entirely inside the database
+in one ``INSERT ... SELECT``: successful orders are reduced to distinct
+(user, film) pairs, self-joined on user to count co-purchases, normalised by
+each film's audience size (squared cosine similarity, which ranks exactly
+like cosine without needing sqrt() on SQLite) and cut to the top K per film
+with a window function. Only the sparse non-zero cells are ever materialised,
+and no rows leave the database, so millions of orders take minutes, not hours.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+from films.models import Film, RelatedFilm
+
+REBUILD_SQL = """
+INSERT INTO {related} (film_id, related_id, score, rank)
+WITH purchases AS (
+    SELECT DISTINCT user_id, film_id FROM {orders} WHERE status = %s
+),
+audience AS (
+    SELECT film_id, COUNT(*) AS n FROM purchases GROUP BY film_id
+),
+pairs AS (
+    SELECT a.film_id AS film_id, b.film_id AS related_id, COUNT(*) AS co
+    FROM purchases a JOIN purchases b ON a.user_id = b.user_id AND a.film_id <> b.film_id
+    GROUP BY a.film_id, b.film_id
+),
+scored AS (
+    SELECT p.film_id, p.related_id,
+           (p.co * p.co * 1.0) / (fa.n * fb.n) AS score,
+           ROW_NUMBER() OVER (
+               PARTITION BY p.film_id ORDER BY (p.co * p.co * 1.0) / (fa.n * fb.n) DESC, p.co DESC, p.related_id
+           ) AS rank
+    FROM pairs p
+    JOIN audience fa ON fa.film_id = p.film_id
+    JOIN audience fb ON fb.film_id = p.related_id
+    WHERE p.co >= %s
+)
+SELECT film_id, related_id, score, rank FROM scored WHERE rank <= %s
+"""
+
+
+def rebuild_related_films(top_k=None, min_co_purchases=None):
+    """Replace the RelatedFilm table with freshly computed neighbours."""
+    from payments.models import Order
+
+    # ``is None``, so an explicit 0 is honoured rather than replaced by the setting.
+    if top_k is None:
+        top_k = settings.RELATED_FILMS_TOP_K
+    if min_co_purchases is None:
+        min_co_purchases = settings.RELATED_FILMS_MIN_CO_PURCHASES
+    sql = REBUILD_SQL.format(related=RelatedFilm._meta.db_table, orders=Order._meta.db_table)
+    with transaction.atomic():
+        RelatedFilm.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [Order.Status.SUCCESS, min_co_purchases, top_k])
+            return cursor.rowcount
+
+
+def related_film_rows(slug, limit):
+    """``listing_values()`` rows of the precomputed neighbours of ``slug``."""
+    return (
+        Film.objects.filter(recommended_for__film__slug=slug)
+        .order_by("recommended_for__rank")
+        .listing_values()[:limit]
+    )
@@ -0,0 +1,142 @@
+# films/services/scheduling.py
+"""
+Scheduling of transcode work.
+
+Encodes and trailer renders are routed to their own ``transcode`` queue
+(``CELERY_TASK_ROUTES``) so a feature-length encode never sits in front of
+payment callbacks and emails on the default queue. Run dedicated workers:
+
+    celery -A core_api worker -Q transcode    # encode nodes
+    celery -A core_api worker -Q celery       # everything else
+
+A worker consuming only the transcode queue runs ``TRANSCODE_CONCURRENCY``
+tasks at once (a quarter of the node's cores unless set) and prefetches
+nothing beyond them, so waiting work stays in the broker in priority order;
+each task splits ``HLS_ENCODE_CORES`` between its ffmpeg processes (see
+``core_api.celery``).
+
+Messages carry a priority and the Redis transport serves lower numbers
+first: new paid releases, then new promo films, then re-encodes, then
+trailers. Every task of a film's encode inherits the film's priority.
+
+Admission control: a new encode is only dispatched while the node's load
+average per core is at most ``TRANSCODE_MAX_LOAD``, which is set above the
+~1.0 of a node busy with its own encodes. Otherwise the task parks the film
+in a Redis sorted set scored by when it is due (``defer``) and returns, so
+the slot is free at once. The ``requeue_deferred_transcodes`` beat task puts
+due films back on the queue at their priority. A countdown would not do: a
+worker holds ETA tasks in memory and runs them when due, ahead of
+higher-priority work in the broker.
+
+The admin shows how long queued work waits (``estimated_wait``). Measuring
+it means asking every worker, so the ``refresh_transcode_wait`` beat task
+does that every ``WAIT_REFRESH_SECONDS`` and the admin reads the cache.
+"""
+import logging
+import os
+import time
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+from core_api.celery import app
+from films.models import Film
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_NEW_PAID = 0
+PRIORITY_NEW_PROMO = 3
+PRIORITY_REENCODE = 6
+PRIORITY_TRAILER = 8
+
+TASK_SECONDS_KEY = "films:transcode:task_seconds"
+WAIT_KEY = "films:transcode:wait"
+DEFERRED_KEY = "films:transcode:deferred"
+WAIT_REFRESH_SECONDS = 30
+INSPECT_TIMEOUT = 1.0
+
+
+def transcode_priority(film):
+    if film.hls_manifest:
+        return PRIORITY_REENCODE
+    return PRIORITY_NEW_PAID if film.status == Film.PAID else PRIORITY_NEW_PROMO
+
+
+def is_overloaded():
+    """True when this node's 1-minute load average per core is above TRANSCODE_MAX_LOAD."""
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):  # not available on this platform
+        return False
+    return load / (os.cpu_count() or 1) > settings.TRANSCODE_MAX_LOAD
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    return redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=2)
+
+
+def defer(film_id, seconds):
+    """Park the encode of ``film_id`` for ``seconds``; deferring it again moves its due time."""
+    get_redis().zadd(DEFERRED_KEY, {film_id: time.time() + seconds})
+
+
+def pop_due_deferrals():
+    """Remove and return the ids of the films whose deferral is over."""
+    client = get_redis()
+    due = client.zrangebyscore(DEFERRED_KEY, "-inf", time.time())
+    # Only keep the ones this call removed, should two schedulers overlap.
+    return [int(member) for member in due if client.zrem(DEFERRED_KEY, member)]
+
+
+def record_task_seconds(seconds):
+    """Fold one transcode task's runtime into the moving average used for estimates."""
+    average = cache.get(TASK_SECONDS_KEY)
+    average = seconds if average is None else 0.8 * average + 0.2 * seconds
+    cache.set(TASK_SECONDS_KEY, average, timeout=None)
+
+
+def queue_depth():
+    """Messages waiting on the transcode queue, or None if the broker can't be reached."""
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)  # fail fast; this serves the admin
+            return connection.default_channel.queue_declare(settings.TRANSCODE_QUEUE, passive=True).message_count
+    except Exception:
+        logger.warning("Could not read the depth of the %s queue", settings.TRANSCODE_QUEUE, exc_info=True)
+        return None
+
+
+def transcode_slots():
+    """Concurrent task slots of the online workers that consume the transcode queue."""
+    inspect = app.control.inspect(timeout=INSPECT_TIMEOUT)
+    queues = inspect.active_queues() or {}
+    stats = inspect.stats() or {}
+    return sum(
+        stats.get(worker, {}).get("pool", {}).get("max-concurrency", 0)
+        for worker, consumed in queues.items()
+        if any(queue["name"] == settings.TRANSCODE_QUEUE for queue in consumed)
+    )
+
+
+def refresh_estimated_wait():
+    """
+    Measure and cache ``{"depth", "slots", "seconds"}``: how long work queued
+    now waits for a slot, from the queue depth, the online slots and the
+    average task time. ``seconds`` is None when it can't be estimated.
+    """
+    depth = queue_depth()
+    slots = transcode_slots() if depth is not None else 0
+    average = cache.get(TASK_SECONDS_KEY) or settings.HLS_CHUNK_SECONDS
+    seconds = round(depth * average / slots) if depth is not None and slots else None
+    wait = {"depth": depth, "slots": slots, "seconds": seconds}
+    # Outlive a missed beat or two, but not a stopped scheduler.
+    cache.set(WAIT_KEY, wait, timeout=WAIT_REFRESH_SECONDS * 3)
+    return wait
+
+
+def estimated_wait():
+    """The last measurement of ``refresh_estimated_wait``, or None if there is none."""
+    return cache.get(WAIT_KEY)
@@ -0,0 +1,121 @@
+# films/services/search.py
+"""
+Ranked full-text search over film title, category name and description.
+
+The index table ``films_film_search`` is created by migration 0005 using the
+database's own inverted index: a weighted ``tsvector`` with a GIN index on
+Postgres, an FTS5 virtual table on SQLite. Rows are upserted from the Film
+and Category signals, so the index is always maintained incrementally.
+
+Every search term is matched as a prefix so the endpoint can back a
+type-ahead box ("mbo" matches "Mbogi").
+"""
+import re
+
+from django.db import connection
+
+from films.models import Film
+
+# Deeper pages are refused: nobody pages that far, and huge offsets only
+# cost the database (or overflow its integer type).
+MAX_PAGE = 100
+
+# Title hits outrank category hits, which outrank description hits.
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+
+_TERM_RE = re.compile(r"[^\W_]+")
+
+_POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('simple', coalesce(f.title, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce(c.name, '')), 'B')
+    || setweight(to_tsvector('simple', coalesce(f.description, '')), 'C')
+"""
+
+
+def parse_terms(query):
+    """Split a free-text query into lower-cased word terms."""
+    return _TERM_RE.findall(query.lower())[:8]
+
+
+def index_films(film_ids):
+    """(Re)build the index rows for ``film_ids``."""
+    film_ids = [int(pk) for pk in film_ids]
+    if not film_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(film_ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                f"""
+                INSERT INTO films_film_search (film_id, document)
+                SELECT f.id, {_POSTGRES_DOCUMENT}
+                FROM films_film f LEFT JOIN films_category c ON c.id = f.category_id
+                WHERE f.id IN ({placeholders})
+                ON CONFLICT (film_id) DO UPDATE SET document = EXCLUDED.document
+                """,
+                film_ids,
+            )
+        elif connection.vendor == "sqlite":
+            # FTS5 has no upsert; delete and re-insert the rows instead.
+            cursor.execute(f"DELETE FROM films_film_search WHERE rowid IN ({placeholders})", film_ids)
+            cursor.execute(
+                f"""
+                INSERT INTO films_film_search (rowid, title, category, description, film_id)
+                SELECT f.id, coalesce(f.title, ''), coalesce(c.name, ''), coalesce(f.description, ''), f.id
+                FROM films_film f LEFT JOIN films_category c ON c.id = f.category_id
+                WHERE f.id IN ({placeholders})
+                """,
+                film_ids,
+            )
+
+
+def remove_film(film_id):
+    """Drop a deleted film from the index (Postgres cascades on its own)."""
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM films_film_search WHERE rowid = %s", [film_id])
+
+
+def search_film_ids(query, limit, offset=0):
+    """Return film ids matching ``query``, best match first."""
+    terms = parse_terms(query)
+    if not terms:
+        return []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            tsquery = " & ".join(f"{term}:*" for term in terms)
+            cursor.execute(
+                """
+                SELECT film_id FROM films_film_search, to_tsquery('simple', %s) AS q
+                WHERE document @@ q
+                ORDER BY ts_rank(document, q) DESC, film_id DESC
+                LIMIT %s OFFSET %s
+                """,
+                [tsquery, limit, offset],
+            )
+        elif connection.vendor == "sqlite":
+            match = " ".join(f'"{term}"*' for term in terms)
+            cursor.execute(
+                """
+                SELECT film_id FROM films_film_search
+                WHERE films_film_search MATCH %s
+                ORDER BY bm25(films_film_search, %s, %s, %s)
+                LIMIT %s OFFSET %s
+                """,
+                [match, *SQLITE_WEIGHTS, limit, offset],
+            )
+        else:
+            return list(
+                Film.objects.filter(title__icontains=" ".join(terms))
+                .order_by("-created_at")
+                .values_list("id", flat=True)[offset:offset + limit]
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_films(query, limit, offset=0):
+    """Return ``listing_values()`` rows for a page of search results, in rank order."""
+    film_ids = search_film_ids(query, limit, offset)
+    rows = {row["id"]: row for row in Film.objects.filter(id__in=film_ids).listing_values()}
+    return [rows[pk] for pk in film_ids if pk in rows]
@@ -0,0 +1,140 @@
+# films/services/sources.py
+"""
+Identity and locking for transcode sources.
+
+Uploads are identified by the SHA-256 of their content, computed with a
+streaming read so a multi-gigabyte file never sits in memory. HLS output is
+written under ``hls/<hash>/<profile>/`` rather than per film, so:
+
+* a film whose source matches an already transcoded film reuses its ladder;
+* a retried or re-dispatched encode finds the renditions that already
+  finished on disk and only encodes the rest.
+
+Sources uploaded straight to S3 are copied into ``MEDIA_ROOT/sources/``
+(which, like the HLS output, every worker shares) in the same pass that
+hashes them, and removed once the ladder is built.
+
+Two cache locks (``cache.add``, shared by all workers through the Redis
+cache) keep a film from being processed by two workers at once, and two
+films with identical content from encoding into the same directory at once.
+A redelivered task keeps its id and so finds its own locks; once it has
+handed the encode to a chord it is marked as dispatched, so a redelivery
+after that does not dispatch the chunks a second time.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from films.models import Film
+
+HASH_CHUNK_SIZE = 1024 * 1024
+LOCAL_COPY_DIR = "sources"
+FILM_LOCK_KEY = "films:transcode:lock:film:{film_id}"
+SOURCE_LOCK_KEY = "films:transcode:lock:source:{digest}"
+DISPATCHED_KEY = "films:transcode:dispatched:{token}"
+
+
+def hash_file(field_file):
+    """Return the hex SHA-256 of a stored file, read in chunks."""
+    digest = hashlib.sha256()
+    with field_file.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def localize(field_file):
+    """
+    Return ``(sha256, local path)`` for a stored video, reading it once.
+    Local files are only hashed; remote ones are downloaded while hashing.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        pass
+    else:
+        return hash_file(field_file), path
+
+    directory = Path(settings.MEDIA_ROOT) / LOCAL_COPY_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+        try:
+            with field_file.open("rb") as fh:
+                for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+        except BaseException:
+            # Don't leave a partial copy behind when the read fails or is interrupted.
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    path = directory / (digest.hexdigest() + Path(field_file.name).suffix)
+    os.replace(tmp.name, path)
+    return digest.hexdigest(), str(path)
+
+
+def discard_local_copy(digest):
+    for path in (Path(settings.MEDIA_ROOT) / LOCAL_COPY_DIR).glob(f"{digest}.*"):
+        path.unlink(missing_ok=True)
+
+
+def output_dir_name(digest, profile_name):
+    """MEDIA_ROOT-relative directory of the HLS ladder for a source hash."""
+    return f"hls/{digest}/{profile_name}"
+
+
+def is_transcoded(film, digest, profile_name):
+    return (
+        film.video_hash == digest
+        and film.processing_status == Film.ProcessingStatus.SUCCESS
+        and bool(film.hls_manifest)
+        and film.hls_manifest.name.startswith(output_dir_name(digest, profile_name) + "/")
+    )
+
+
+def find_transcoded(digest, profile_name, exclude_id=None):
+    """Another film whose identical source was already transcoded, or None."""
+    return (
+        Film.objects.filter(
+            video_hash=digest,
+            processing_status=Film.ProcessingStatus.SUCCESS,
+            hls_manifest__startswith=output_dir_name(digest, profile_name) + "/",
+        )
+        .exclude(id=exclude_id)
+        .only("id", "hls_manifest", "trickplay_track")
+        .first()
+    )
+
+
+def acquire(key, token):
+    """Take the lock ``key`` for ``token``; True if it was free or already ours."""
+    # A redelivered task keeps its id, so it may find its own lock.
+    return cache.add(key, token, timeout=settings.HLS_LOCK_TIMEOUT) or cache.get(key) == token
+
+
+def release(key, token):
+    # Only release our own lock; one that expired and was retaken is left alone.
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def film_lock(film_id):
+    return FILM_LOCK_KEY.format(film_id=film_id)
+
+
+def source_lock(digest):
+    return SOURCE_LOCK_KEY.format(digest=digest)
+
+
+def mark_dispatched(token):
+    """Record that the task ``token`` handed its encode to a chord."""
+    cache.set(DISPATCHED_KEY.format(token=token), True, timeout=settings.HLS_LOCK_TIMEOUT)
+
+
+def was_dispatched(token):
+    return bool(cache.get(DISPATCHED_KEY.format(token=token)))
@@ -1,29 +1,153 @@
+# films/services/streaming.py
+"""
+Signed streaming URLs.
+
+HLS ladders are not public. A player reaches one through the gateway view
+(``films.views.hls_gateway``):
+
+    /api/films/hls/<token>/master.m3u8
+
+A token grants every file under one ladder directory (its *scope*, e.g.
+``hls/<source hash>/default``) until it expires. The gateway serves
+playlists with every rendition, segment and sprite URI made absolute under
+the same token (see ``manifests``), so each segment request is checked too.
+
+A token is bound to its user. Players send no API credentials, so the
+stream API also sets ``VIEWER_COOKIE``: the user id, signed, for the
+gateway's path only (``set_viewer_cookie``). The gateway serves a token only
+to a browser whose cookie names the token's user (``is_viewer``), so a
+leaked URL plays nothing elsewhere. ``viewing_ttl`` also limits each token
+to the film's running time plus ``STREAM_TOKEN_GRACE`` for pauses, and
+never more than ``STREAM_TOKEN_TTL``.
+
+When the ladder is in a bucket, the gateway renders playlists with
+presigned bucket URLs for every segment, valid until the token expires.
+Segments are then fetched straight from storage, and Django serves only
+the playlists. A presigned URL gives that one file, and the playlists that
+list them all are only served to the viewer.
+
+A token is ``<key id>.<payload>.<signature>``. The payload is
+``user:expiry:scope`` in URL-safe base64, and the signature is an
+HMAC-SHA256 of it under the key that the key id names. Verification needs
+no database or cache: decode the token, look up the key in
+``settings.STREAM_SIGNING_KEYS``, compare signatures and check the clock.
+
+The first key signs. To rotate, put a new key first, then remove the old
+one once ``STREAM_TOKEN_TTL`` has passed.
+
+Expiry is rounded up to ``EXPIRY_STEP``, so a user keeps the same URLs for
+a while and the browser can cache them.
+"""
+import base64
+import binascii
 import hmac
+import math
+import posixpath
 import time
-import base64
-from hashlib import sha256
-from urllib.parse import urlencode
+from typing import NamedTuple
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import salted_hmac
+
+from films.services import hls_transcoder, manifests
+
+KEY_SALT = "films.streaming"
+EXPIRY_STEP = 5 * 60
+VIEWER_COOKIE = "hls_viewer"
+
+
+class Grant(NamedTuple):
+    user_id: int
+    expires: int
+    scope: str
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(key_id, payload):
+    secret = settings.STREAM_SIGNING_KEYS[key_id]
+    return _b64encode(salted_hmac(KEY_SALT, f"{key_id}.{payload}", secret, algorithm="sha256").digest())
+
+
+def scope_for(film):
+    """The ladder directory of ``film``, which its tokens grant."""
+    return posixpath.dirname(film.hls_manifest.name)
+
+
+def viewing_ttl(scope):
+    """Seconds a token for ``scope`` should live: one viewing of the ladder."""
+    try:
+        running_time = manifests.duration(scope)
+    except (FileNotFoundError, ValueError):
+        return settings.STREAM_TOKEN_TTL
+    return min(settings.STREAM_TOKEN_TTL, math.ceil(running_time) + settings.STREAM_TOKEN_GRACE)
+
+
+def make_token(user_id, scope, ttl=None):
+    ttl = settings.STREAM_TOKEN_TTL if ttl is None else ttl
+    expires = math.ceil((time.time() + ttl) / EXPIRY_STEP) * EXPIRY_STEP
+    key_id = next(iter(settings.STREAM_SIGNING_KEYS))
+    payload = _b64encode(f"{user_id}:{expires}:{scope}".encode())
+    return f"{key_id}.{payload}.{_signature(key_id, payload)}"
+
+
+def read_token(token):
+    """The Grant of a valid, unexpired token, or None."""
+    try:
+        key_id, payload, signature = token.split(".")
+        if key_id not in settings.STREAM_SIGNING_KEYS:
+            return None
+        if not hmac.compare_digest(signature, _signature(key_id, payload)):
+            return None
+        user_id, expires, scope = _b64decode(payload).decode().split(":", 2)
+        grant = Grant(int(user_id), int(expires), scope)
+    except (ValueError, binascii.Error):
+        return None
+    return grant if grant.expires > time.time() else None
 
 
-SECRET = ("super-secret-change-me").encode()
+def set_viewer_cookie(response, request, user_id, ttl):
+    """Let the browser of ``request`` play the tokens of ``user_id`` for ``ttl`` seconds."""
+    secure = request.is_secure()
+    response.set_signed_cookie(
+        VIEWER_COOKIE,
+        str(user_id),
+        salt=KEY_SALT,
+        max_age=ttl,
+        path=url_prefix("-").removesuffix("-/"),
+        secure=secure,
+        httponly=True,
+        # The player may be on the frontend's origin; cross-site cookies must be Secure.
+        samesite="None" if secure else "Lax",
+    )
 
 
-# Very lightweight signed-URL generator for dev/self-hosting.
-# For S3/CloudFront, switch to their native signed URL solutions.
+def is_viewer(request, grant):
+    """True if the cookie of ``request`` names the user ``grant`` was issued to."""
+    user_id = request.get_signed_cookie(VIEWER_COOKIE, default=None, salt=KEY_SALT, max_age=settings.STREAM_TOKEN_TTL)
+    return user_id == str(grant.user_id)
 
 
-def sign_url(url: str, ttl_seconds: int = 3600) -> str:
-exp = int(time.time()) + ttl_seconds
-payload = f"{url}|{exp}".encode()
-sig = base64.urlsafe_b64encode(hmac.new(SECRET, payload, sha256).digest()).decode()
-return f"{url}?" + urlencode({"exp": exp, "sig": sig})
+def resolve(grant, path):
+    """The storage name of ``path`` under ``grant``'s scope, or None if it leaves the scope."""
+    parts = path.split("/")
+    if path.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        return None
+    return posixpath.join(grant.scope, path)
 
 
+def url_prefix(token, request=None):
+    """Gateway URL of the token's scope, ending in "/"."""
+    url = reverse("films:film-hls-gateway", args=[token, "-"])[:-1]
+    return request.build_absolute_uri(url) if request else url
 
 
-def verify_signature(url: str, exp: int, sig: str) -> bool:
-if exp < int(time.time()):
-return False
-payload = f"{url}|{exp}".encode()
-expected = base64.urlsafe_b64encode(hmac.new(SECRET, payload, sha256).digest()).decode()
-return hmac.compare_digest(expected, sig)
\ No newline at end of file
+def build_url(token, path=hls_transcoder.MASTER_PLAYLIST, request=None):
+    return url_prefix(token, request) + path
@@ -0,0 +1,136 @@
+# films/services/trailers.py
+"""
+Web-sized trailer and hover preview derivatives.
+
+Uploaded trailers are whatever the filmmaker exported, often hundreds of
+megabytes, so after upload a Celery task renders two MP4s into MediaStorage
+and records them on ``Film.trailer_derivatives``:
+
+    {"source": "films/trailers/x.mov",
+     "trailer": "films/trailers/derivatives/7/3f9a0c.../trailer.mp4",
+     "preview": "films/trailers/derivatives/7/3f9a0c.../preview.mp4"}
+
+* ``trailer``: H.264/AAC at most ``TRAILER_MAX_HEIGHT`` lines, capped CRF.
+* ``preview``: ``TRAILER_PREVIEW_SECONDS`` muted seconds from a quarter of
+  the way in (past the studio cards), 360p at ~200 kb/s: about 300 KB for
+  the catalog grid to autoplay on hover.
+
+Both are faststart MP4s so they play while downloading, without an HLS
+player. ``source`` lets the signal tell whether the current trailer was
+already processed. If ffmpeg fails, the mapping holds ``source`` and the
+``error`` tail instead, so that trailer is not encoded again until it is
+replaced.
+
+As with posters, names are addressed by the trailer's content hash. A task
+still encoding a replaced trailer therefore cannot overwrite the files of
+the new one, and cached URLs never change content. The old files are
+removed by ``delete_derivatives`` once the new set is recorded.
+"""
+import hashlib
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from films.services import hls_transcoder
+
+DERIVATIVE_DIR = "films/trailers/derivatives/{film_id}/{digest}/"
+KEYS = ("trailer", "preview")
+PREVIEW_HEIGHT = 360
+PREVIEW_KBPS = 200
+
+
+def needs_derivatives(film):
+    return bool(film.trailer_file) and (film.trailer_derivatives or {}).get("source") != film.trailer_file.name
+
+
+def _local_path(field_file, workdir):
+    try:
+        return field_file.path
+    except NotImplementedError:
+        path = Path(workdir) / ("source" + Path(field_file.name).suffix)
+        with field_file.open("rb") as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return str(path)
+
+
+def _digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+def _scale(height):
+    # Never upscale; keep the width even for yuv420p.
+    return f"scale=-2:'min({height},ih)'"
+
+
+def trailer_command(source_path, output_path, source):
+    command = [
+        hls_transcoder.FFMPEG_BIN, "-y", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", str(source_path),
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", _scale(settings.TRAILER_MAX_HEIGHT),
+        "-c:v", "libx264", "-profile:v", "main", "-preset", "medium", "-pix_fmt", "yuv420p",
+        "-crf", "23", "-maxrate", "1500k", "-bufsize", "3000k",
+    ]
+    if source["has_audio"]:
+        command += ["-c:a", "aac", "-b:a", "96k", "-ac", "2"]
+    return command + ["-movflags", "+faststart", str(output_path)]
+
+
+def preview_command(source_path, output_path, source):
+    seconds = settings.TRAILER_PREVIEW_SECONDS
+    start = max(0.0, min(source["duration"] / 4, source["duration"] - seconds))
+    return [
+        hls_transcoder.FFMPEG_BIN, "-y", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.3f}", "-i", str(source_path), "-t", str(seconds),
+        "-map", "0:v:0", "-an",
+        "-vf", _scale(PREVIEW_HEIGHT),
+        "-c:v", "libx264", "-profile:v", "main", "-preset", "slow", "-pix_fmt", "yuv420p",
+        "-crf", "28", "-maxrate", f"{PREVIEW_KBPS}k", "-bufsize", f"{PREVIEW_KBPS * 2}k",
+        "-movflags", "+faststart", str(output_path),
+    ]
+
+
+def generate_derivatives(film):
+    """Render and store the trailer and preview for ``film.trailer_file``; return the mapping."""
+    derivatives = {"source": film.trailer_file.name}
+    with tempfile.TemporaryDirectory(prefix="trailer-") as workdir:
+        source_path = _local_path(film.trailer_file, workdir)
+        base = DERIVATIVE_DIR.format(film_id=film.pk, digest=_digest(source_path))
+        source = None
+        for key, build in zip(KEYS, (trailer_command, preview_command)):
+            name = f"{base}{key}.mp4"
+            if not default_storage.exists(name):  # else encoded from these same bytes before
+                source = source or hls_transcoder.probe(source_path)
+                output_path = Path(workdir) / f"{key}.mp4"
+                subprocess.run(build(source_path, output_path, source), check=True, capture_output=True, text=True)
+                with open(output_path, "rb") as fh:
+                    name = default_storage.save(name, File(fh))
+            derivatives[key] = name
+    return derivatives
+
+
+def delete_derivatives(derivatives, keep=None):
+    """Delete the files of ``derivatives`` that ``keep`` does not also use."""
+    kept = {(keep or {}).get(key) for key in KEYS}
+    for key in KEYS:
+        name = (derivatives or {}).get(key)
+        if name and name not in kept:
+            default_storage.delete(name)
+
+
+def build_url(derivatives, key, request=None):
+    """URL of the ``trailer`` or ``preview`` derivative, or None if not processed."""
+    name = (derivatives or {}).get(key)
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,126 @@
+# films/services/trickplay.py
+"""
+Trickplay (seek preview) thumbnails.
+
+Scrubbing should not cost segment downloads, so every HLS ladder gets sprite
+sheets of small thumbnails and a WebVTT track pointing into them. The
+thumbnails come from the decode the lowest rung already does: its ffmpeg
+gets a second output (``output_args``) that writes one JPEG every
+``interval`` seconds of each chunk:
+
+    <output_dir>/trickplay/thumb_00003_00000.jpg, ...
+
+Once every chunk is encoded, ``build_track`` tiles them into sheets of
+``columns`` x ``rows`` and writes the track, in the ``#xywh=`` media-fragment
+form players' thumbnail plugins read:
+
+    <output_dir>/trickplay/thumbnails.vtt, sprite_000.jpg, ...
+
+    00:00:10.000 --> 00:00:20.000
+    sprite_000.jpg#xywh=240,0,240,136
+
+Per-chunk thumbnails stay local, like the chunk playlists.
+"""
+import math
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+from PIL import Image
+
+from films.services.posters import FORMATS
+
+TRICKPLAY_DIR = "trickplay"
+TRACK_NAME = "thumbnails.vtt"
+THUMB_PREFIX = "thumb_"
+THUMB_PATTERN = THUMB_PREFIX + "{index:05d}_%05d.jpg"
+SPRITE_NAME = "sprite_{number:03d}.{ext}"
+
+
+class Options(NamedTuple):
+    interval: int = 10
+    width: int = 240
+    columns: int = 6
+    rows: int = 6
+    format: str = "jpeg"
+
+
+def get_options():
+    """``settings.HLS_TRICKPLAY`` as Options, or None when it is disabled."""
+    options = Options(**(settings.HLS_TRICKPLAY or {"interval": 0}))
+    return options if options.interval > 0 else None
+
+
+def thumb_size(options, source):
+    """Thumbnail width and height, keeping the source aspect ratio (even height)."""
+    return options.width, 2 * round(options.width * source["height"] / source["width"] / 2)
+
+
+def track_path(output_dir):
+    return Path(output_dir) / TRICKPLAY_DIR / TRACK_NAME
+
+
+def output_args(output_dir, options, source, chunk=None):
+    """Extra ffmpeg output writing the thumbnails of ``chunk`` (or of the whole source)."""
+    directory = Path(output_dir) / TRICKPLAY_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    width, height = thumb_size(options, source)
+    args = ["-map", "0:v:0"]
+    if chunk is not None and chunk.duration:
+        args += ["-t", str(chunk.duration)]  # output options apply per output
+    return args + [
+        # round=up keeps the frame at each tick rather than the last one before the next.
+        "-vf", f"fps=1/{options.interval}:round=up,scale={width}:{height}",
+        "-q:v", "3",
+        "-f", "image2", "-start_number", "0",
+        str(directory / THUMB_PATTERN.format(index=chunk.index if chunk is not None else 0)),
+    ]
+
+
+def _timestamp(seconds):
+    millis = round(seconds * 1000)
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    return f"{hours:02d}:{minutes:02d}:{millis // 1000:02d}.{millis % 1000:03d}"
+
+
+def build_track(output_dir, spans, options, source):
+    """
+    Tile the thumbnails into sprite sheets and write the WebVTT track.
+    ``spans`` is ``[(chunk index, start, end), ...]`` in seconds of the film.
+    Returns the track's path, or None if a chunk has no thumbnails (it was
+    encoded before trickplay was enabled).
+    """
+    directory = Path(output_dir) / TRICKPLAY_DIR
+    track = track_path(output_dir)
+    track.unlink(missing_ok=True)
+
+    cues = []
+    for index, start, end in spans:
+        thumbs = sorted(directory.glob(f"{THUMB_PREFIX}{index:05d}_*.jpg"))
+        if not thumbs:
+            return None
+        for n, thumb in enumerate(thumbs):
+            at = start + n * options.interval
+            if at >= end:
+                break
+            cues.append((at, min(at + options.interval, end), thumb))
+
+    width, height = thumb_size(options, source)
+    fmt = FORMATS[options.format]
+    per_sheet = options.columns * options.rows
+    lines = ["WEBVTT", ""]
+    for number in range(math.ceil(len(cues) / per_sheet)):
+        batch = cues[number * per_sheet:(number + 1) * per_sheet]
+        columns = min(options.columns, len(batch))
+        sheet = Image.new("RGB", (columns * width, math.ceil(len(batch) / columns) * height))
+        name = SPRITE_NAME.format(number=number, ext=fmt["ext"])
+        for position, (cue_start, cue_end, thumb) in enumerate(batch):
+            x, y = position % columns * width, position // columns * height
+            with Image.open(thumb) as image:
+                sheet.paste(image.convert("RGB"), (x, y))
+            lines += [f"{_timestamp(cue_start)} --> {_timestamp(cue_end)}", f"{name}#xywh={x},{y},{width},{height}", ""]
+        sheet.save(directory / name, fmt["format"], **fmt["options"])
+
+    track.write_text("\n".join(lines))
+    return track
@@ -0,0 +1,228 @@
+# films/services/uploads.py
+"""
+Direct-to-S3 multipart uploads of film sources.
+
+The browser never sends video bytes through Django:
+
+1. ``start()`` creates an S3 multipart upload under the media storage and
+   returns a signed ``upload`` token (bucket key, upload id, declared size,
+   owner) plus the part size to cut the file into.
+2. ``presign_parts()`` hands out presigned ``UploadPart`` URLs. The client
+   must send each part's base64 SHA-256, computed from its own file. The
+   checksum is signed into the URL, so S3 rejects a part whose bytes do not
+   match it.
+3. ``complete()`` claims the upload so only one request can complete it. It
+   checks the parts S3 stored against what the client says it uploaded, then
+   completes the upload with the part checksums, and S3 verifies those
+   against the stored parts. It then checks the object's size and multipart
+   ETag (the MD5 of the part MD5s) before returning the storage name for
+   ``Film.video_file``. A failed check deletes the object, and so does
+   ``discard()`` when the Film cannot be created.
+
+The token is signed with SECRET_KEY, so no upload state is kept server-side;
+configure an AbortIncompleteMultipartUpload lifecycle rule on the bucket to
+reap uploads that are never completed.
+"""
+import binascii
+import hashlib
+import math
+import posixpath
+import uuid
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.text import get_valid_filename
+
+from core_api.storages import MediaStorage
+
+UPLOAD_DIR = "films/videos/"
+TOKEN_SALT = "films.uploads"
+CLAIM_KEY = "films:upload:claim:{upload_id}"
+CHECKSUM_ALGORITHM = "SHA256"
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_PARTS_PER_REQUEST = 100
+
+
+class UploadError(Exception):
+    pass
+
+
+def is_configured():
+    return bool(settings.AWS_STORAGE_BUCKET_NAME)
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    return boto3.client(
+        "s3",
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+        region_name=settings.AWS_S3_REGION_NAME,
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        # SigV4 signs Content-MD5 into presigned part URLs.
+        config=Config(signature_version="s3v4"),
+    )
+
+
+def _bucket_key(name):
+    return posixpath.join(MediaStorage.location, name)
+
+
+def part_size_for(size):
+    """The configured part size, grown if the file would need more than 10,000 parts."""
+    part_size = max(settings.UPLOAD_PART_SIZE, MIN_PART_SIZE)
+    if math.ceil(size / part_size) > MAX_PARTS:
+        part_size = math.ceil(size / MAX_PARTS / (1024 * 1024)) * 1024 * 1024
+    return part_size
+
+
+def start(user, filename, size, content_type="video/mp4"):
+    if not 0 < size <= settings.UPLOAD_MAX_BYTES:
+        raise UploadError(f"File size must be between 1 byte and {settings.UPLOAD_MAX_BYTES} bytes.")
+    name = f"{UPLOAD_DIR}{uuid.uuid4().hex}/{get_valid_filename(posixpath.basename(filename)) or 'video'}"
+    key = _bucket_key(name)
+    upload = get_client().create_multipart_upload(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key, ContentType=content_type, ChecksumAlgorithm=CHECKSUM_ALGORITHM
+    )
+    part_size = part_size_for(size)
+    token = signing.dumps(
+        {"name": name, "key": key, "upload_id": upload["UploadId"], "size": size, "user": user.pk},
+        salt=TOKEN_SALT,
+    )
+    return {"upload": token, "part_size": part_size, "part_count": math.ceil(size / part_size)}
+
+
+def _load(token, user):
+    try:
+        session = signing.loads(token, salt=TOKEN_SALT, max_age=settings.UPLOAD_SESSION_MAX_AGE)
+    except signing.BadSignature:
+        raise UploadError("Invalid or expired upload.")
+    if session["user"] != user.pk:
+        raise UploadError("Invalid or expired upload.")
+    return session
+
+
+def presign_parts(token, user, parts):
+    """``parts`` is ``[{"number": 1, "sha256": "<base64>"}, ...]``; returns their URLs."""
+    session = _load(token, user)
+    if len(parts) > MAX_PARTS_PER_REQUEST:
+        raise UploadError(f"Request at most {MAX_PARTS_PER_REQUEST} part URLs at a time.")
+    part_count = math.ceil(session["size"] / part_size_for(session["size"]))
+    urls = []
+    for part in parts:
+        number = int(part["number"])
+        if not 1 <= number <= part_count:
+            raise UploadError(f"Part number must be between 1 and {part_count}.")
+        params = {
+            "Bucket": settings.AWS_STORAGE_BUCKET_NAME,
+            "Key": session["key"],
+            "UploadId": session["upload_id"],
+            "PartNumber": number,
+            "ChecksumSHA256": part["sha256"],
+        }
+        url = get_client().generate_presigned_url(
+            "upload_part", Params=params, ExpiresIn=settings.UPLOAD_URL_EXPIRY
+        )
+        urls.append({"number": number, "url": url})
+    return urls
+
+
+def _stored_parts(session):
+    stored, marker = [], 0
+    while True:
+        page = get_client().list_parts(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=session["key"],
+            UploadId=session["upload_id"],
+            PartNumberMarker=marker,
+        )
+        stored += page.get("Parts", [])
+        if not page.get("IsTruncated"):
+            return stored
+        marker = page["NextPartNumberMarker"]
+
+
+def _multipart_etag(etags):
+    digests = b"".join(binascii.unhexlify(etag.strip('"')) for etag in etags)
+    return f'"{hashlib.md5(digests).hexdigest()}-{len(etags)}"'
+
+
+def complete(token, user, parts):
+    """
+    Verify and complete the upload; ``parts`` is ``[{"number", "etag",
+    "sha256"}, ...]``: the ETag S3 returned for each PUT and the checksum the
+    part was presigned with. Returns the storage name of the video.
+    """
+    session = _load(token, user)
+    claim_key = CLAIM_KEY.format(upload_id=session["upload_id"])
+    if not cache.add(claim_key, True, timeout=settings.UPLOAD_SESSION_MAX_AGE):
+        raise UploadError("This upload has already been completed.")
+    try:
+        _complete(session, parts)
+    except BaseException:
+        cache.delete(claim_key)  # nothing was completed; the client may retry
+        raise
+    return session["name"]
+
+
+def _complete(session, parts):
+    client, bucket = get_client(), settings.AWS_STORAGE_BUCKET_NAME
+    claimed = {int(part["number"]): part for part in parts}
+    try:
+        stored = _stored_parts(session)
+    except ClientError:
+        raise UploadError("Upload not found; it may have been completed or aborted already.")
+
+    numbers = [part["PartNumber"] for part in stored]
+    if numbers != list(range(1, len(stored) + 1)) or set(claimed) != set(numbers):
+        raise UploadError("Uploaded parts do not match the parts listed.")
+    for part in stored:
+        mine = claimed[part["PartNumber"]]
+        # S3 also re-checks the SHA-256s when completing; listing them is a cheap early out.
+        if mine["etag"].strip('"') != part["ETag"].strip('"') or part.get("ChecksumSHA256", mine["sha256"]) != mine["sha256"]:
+            raise UploadError("A part's checksum does not match what was uploaded.")
+    if sum(part["Size"] for part in stored) != session["size"]:
+        raise UploadError("Uploaded size does not match the declared size.")
+
+    try:
+        client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=session["key"],
+            UploadId=session["upload_id"],
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": p["PartNumber"], "ETag": p["ETag"], "ChecksumSHA256": claimed[p["PartNumber"]]["sha256"]}
+                    for p in stored
+                ]
+            },
+        )
+    except ClientError as exc:
+        # EntityTooSmall, InvalidPart (a checksum S3 disagrees with), NoSuchUpload...
+        raise UploadError(f"S3 refused to complete the upload ({exc.response['Error']['Code']}).")
+
+    head = client.head_object(Bucket=bucket, Key=session["key"])
+    etag_ok = "-" not in head["ETag"] or head["ETag"] == _multipart_etag([p["ETag"] for p in stored])
+    if head["ContentLength"] != session["size"] or not etag_ok:
+        client.delete_object(Bucket=bucket, Key=session["key"])
+        raise UploadError("Stored object failed verification and was discarded.")
+
+
+def discard(name):
+    """Delete a completed upload that will not be used, e.g. because its Film could not be created."""
+    get_client().delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=_bucket_key(name))
+
+
+def abort(token, user):
+    session = _load(token, user)
+    try:
+        get_client().abort_multipart_upload(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=session["key"], UploadId=session["upload_id"]
+        )
+    except ClientError:
+        pass  # already completed or aborted
@@ -1,12 +1,119 @@
 # films/signals.py
 
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Film
-from .tasks import convert_film_to_hls
+from .models import Category, Film
+from .services import catalog, detail, leaderboards, posters, scheduling, search, trailers
+from .tasks import convert_film_to_hls, generate_poster_derivatives, generate_trailer_derivatives
+
+# File fields whose replacement starts background work.
+WATCHED_FILES = ("video_file", "poster", "trailer_file")
+
+
+def _file_name(instance, field):
+    # Read the raw attribute: touching a deferred field would cost a query.
+    value = instance.__dict__.get(field)
+    return getattr(value, "name", value)
+
+
+@receiver(post_init, sender=Film)
+def remember_files(sender, instance, **kwargs):
+    instance._loaded_files = {field: _file_name(instance, field) for field in WATCHED_FILES}
+
+
+def _file_changed(instance, field, created):
+    """True if ``field`` holds a file that is new since the instance was loaded (or last saved)."""
+    name = _file_name(instance, field)
+    changed = bool(name) and (created or name != instance._loaded_files.get(field))
+    instance._loaded_files[field] = name
+    return changed
+
 
 @receiver(post_save, sender=Film)
 def trigger_hls_conversion(sender, instance, created, **kwargs):
-    # 'created' is True only the first time the object is saved
-    if created and instance.video_file:
-        convert_film_to_hls.delay(instance.id)
\ No newline at end of file
+    # On upload, and whenever the video file is replaced. The task itself
+    # skips content it has already transcoded.
+    if _file_changed(instance, "video_file", created):
+        priority = scheduling.transcode_priority(instance)
+        transaction.on_commit(lambda: convert_film_to_hls.apply_async((instance.id,), priority=priority))
+
+
+@receiver(post_save, sender=Film)
+def trigger_poster_derivatives(sender, instance, created, **kwargs):
+    # Only when the poster changes: other saves must not queue duplicates,
+    # nor retry a poster that failed to render.
+    if _file_changed(instance, "poster", created) and posters.needs_derivatives(instance):
+        transaction.on_commit(lambda: generate_poster_derivatives.delay(instance.pk))
+
+
+@receiver(post_save, sender=Film)
+def trigger_trailer_derivatives(sender, instance, created, **kwargs):
+    # Same as posters: a failed encode is recorded, and only a new trailer retries it.
+    if _file_changed(instance, "trailer_file", created) and trailers.needs_derivatives(instance):
+        transaction.on_commit(
+            lambda: generate_trailer_derivatives.apply_async((instance.pk,), priority=scheduling.PRIORITY_TRAILER)
+        )
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_delete, sender=Film)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_snapshot(sender, **kwargs):
+    # Wait for the commit so the background rebuild sees the new rows.
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver(post_save, sender=Film)
+def index_film_for_search(sender, instance, **kwargs):
+    search.index_films([instance.pk])
+
+
+@receiver(post_delete, sender=Film)
+def remove_film_from_search(sender, instance, **kwargs):
+    search.remove_film(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_films(sender, instance, created, **kwargs):
+    if not created:
+        search.index_films(instance.films.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_films(sender, instance, **kwargs):
+    # Films are detached (SET_NULL) before post_delete fires, so collect them now.
+    instance._search_film_ids = list(instance.films.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_detached_films(sender, instance, **kwargs):
+    search.index_films(getattr(instance, "_search_film_ids", []))
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_delete, sender=Film)
+def bump_film_detail(sender, instance, **kwargs):
+    transaction.on_commit(lambda: detail.bump("film", instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_detail(sender, instance, **kwargs):
+    transaction.on_commit(lambda: detail.bump("category", instance.pk))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def bump_filmmaker_detail(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only; just a name change affects film pages.
+    if update_fields is None or "full_name" in update_fields:
+        transaction.on_commit(lambda: detail.bump("filmmaker", instance.pk))
+
+
+@receiver(post_save, sender="reviews.Rating")
+def record_rating_on_leaderboards(sender, instance, created, **kwargs):
+    if created:
+        category_id = Film.objects.filter(pk=instance.film_id).values_list("category_id", flat=True).first()
+        transaction.on_commit(lambda: leaderboards.record_rating(instance.film_id, category_id, instance.value))
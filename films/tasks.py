@@ -1,53 +1,262 @@
 # films/tasks.py
 
+import logging
+import posixpath
 import subprocess
+import time
+import uuid
 from pathlib import Path
-from celery import shared_task
+from celery import chord, shared_task
 from django.conf import settings
 from .models import Film
+from .services import catalog, detail, hls_transcoder, leaderboards, manifests, posters, progress, publishing, recommendations, scheduling, sources, trailers, trickplay
 
-@shared_task
-def convert_film_to_hls(film_id):
+logger = logging.getLogger(__name__)
+
+# Transcode tasks are acked late so a crashed worker's task is redelivered;
+# every step is safe to repeat.
+@shared_task(bind=True, acks_late=True)
+def convert_film_to_hls(self, film_id):
+    """
+    Hash the upload, then either reuse an existing ladder for identical
+    content or split it into segment-aligned chunks and fan the chunks out
+    over the workers as a chord; ``stitch_hls_chunks`` finishes the job.
+    Workers must share MEDIA_ROOT. Every task of the encode runs at the
+    film's priority (see ``films.services.scheduling``).
+    """
+    token = self.request.id or uuid.uuid4().hex
+    film_lock = sources.film_lock(film_id)
+    if not sources.acquire(film_lock, token):
+        logger.info("Film %s is already being transcoded", film_id)
+        return
+    if sources.was_dispatched(token):
+        # Redelivered after its chord went out; the chord's callbacks own the locks.
+        logger.info("Encode of film %s was already dispatched", film_id)
+        return
+    digest, dispatched, defer = None, False, 0
     try:
         film = Film.objects.get(id=film_id)
-        film.processing_status = Film.ProcessingStatus.PROCESSING
-        film.save()
+        priority = scheduling.transcode_priority(film)
+        if scheduling.is_overloaded():
+            # Admission control: leave the cores to the encodes already running.
+            defer = settings.TRANSCODE_DEFER_SECONDS
+            return
+        profile = hls_transcoder.get_profile()
+        digest, source_path = sources.localize(film.video_file)
+        if sources.is_transcoded(film, digest, profile.name):
+            sources.discard_local_copy(digest)
+            return  # this exact file is already transcoded
+        Film.objects.filter(id=film_id).update(processing_status=Film.ProcessingStatus.PROCESSING, video_hash=digest)
 
-        # Input and output paths
-        source_path = film.video_file.path
-        output_dir = Path(settings.MEDIA_ROOT) / 'hls' / str(film.id)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        manifest_path = output_dir / "manifest.m3u8"
-
-        # FFmpeg command to convert the video
-        command = [
-            'ffmpeg',
-            '-i', str(source_path),
-            '-profile:v', 'baseline',  # for wide compatibility
-            '-level', '3.0',
-            '-start_number', '0',
-            '-hls_time', '10',  # 10-second segments
-            '-hls_list_size', '0',  # keep all segments in the playlist
-            '-f', 'hls',
-            str(manifest_path),
-        ]
+        original = sources.find_transcoded(digest, profile.name, exclude_id=film_id)
+        if original is not None:
+            _mark_success(
+                film,
+                original.hls_manifest.name,
+                f"Reused the HLS ladder of film {original.id} (identical source).",
+                original.trickplay_track.name,
+            )
+            sources.discard_local_copy(digest)
+            return
+
+        if not sources.acquire(sources.source_lock(digest), token):
+            # A film with the same content is encoding right now; come back
+            # once it is done and reuse its ladder.
+            defer = 60
+            return
 
-        subprocess.run(command, check=True)
+        output_dir = Path(settings.MEDIA_ROOT) / sources.output_dir_name(digest, profile.name)
+        output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Save the path to the manifest file
-        film.hls_manifest_path = str(manifest_path.relative_to(settings.MEDIA_ROOT))
-        film.processing_status = Film.ProcessingStatus.SUCCESS
-        film.save()
+        source = hls_transcoder.probe(source_path)
+        chunks = hls_transcoder.plan_chunks(source["duration"], profile)
+        renditions = hls_transcoder.select_renditions(profile.ladder, source["height"])
+        progress.start(film_id, source["duration"] * len(renditions))
+        job = (film_id, str(source_path), str(output_dir), profile.name)
+        header = [
+            transcode_hls_chunk.s(*job, chunk.index, chunk.start, chunk.duration, source).set(priority=priority)
+            for chunk in chunks
+        ]
+        lock = (digest, token)
+        callback = stitch_hls_chunks.s(film_id, str(output_dir), profile.name, source, *lock).set(priority=priority)
+        callback = callback.on_error(
+            hls_chunks_failed.s(film_id, *lock)
+        )
+        chord(header)(callback)
+        dispatched = True
+        sources.mark_dispatched(token)
 
     except Film.DoesNotExist:
         # Handle case where film is not found
         pass
     except subprocess.CalledProcessError as e:
-        # Handle ffmpeg conversion errors
-        film.processing_status = Film.ProcessingStatus.FAILED
-        film.save()
-        # You might want to log the error `e` here
+        # Keep the tail of ffprobe's output so failures can be diagnosed from the admin
+        logger.exception("HLS conversion failed for film %s", film_id)
+        _mark_failed(film_id, (e.stderr or str(e))[-4000:])
     except Exception as e:
-        # Handle other unexpected errors
-        film.processing_status = Film.ProcessingStatus.FAILED
-        film.save()
\ No newline at end of file
+        logger.exception("HLS conversion failed for film %s", film_id)
+        _mark_failed(film_id, str(e))
+    finally:
+        # Once the chord is out, its callback or errback releases the locks.
+        if not dispatched:
+            sources.release(film_lock, token)
+            if digest:
+                sources.release(sources.source_lock(digest), token)
+        if defer:
+            # Return now and free the slot; requeue_deferred_transcodes puts
+            # the film back on the queue at its priority once it is due.
+            scheduling.defer(film_id, defer)
+
+
+# Failed chunks are retried; renditions they already finished are kept.
+@shared_task(autoretry_for=(subprocess.CalledProcessError,), max_retries=2, retry_backoff=True, acks_late=True)
+def transcode_hls_chunk(film_id, source_path, output_dir, profile_name, index, start, duration, source):
+    """Encode one chunk of every rendition of the ladder."""
+    profile = hls_transcoder.get_profile(profile_name)
+    chunk = hls_transcoder.Chunk(index, start, duration)
+    tracker = progress.ProgressTracker(film_id)
+    started = time.monotonic()
+    try:
+        index = hls_transcoder.encode_chunk(source_path, output_dir, profile, chunk, source, on_progress=tracker)
+    except Exception:
+        # A retry reports the whole chunk again, finished renditions included.
+        tracker.discard()
+        raise
+    tracker.close()
+    scheduling.record_task_seconds(time.monotonic() - started)
+    return index
+
+
+@shared_task(acks_late=True)
+def stitch_hls_chunks(chunk_indexes, film_id, output_dir, profile_name, source, digest, token):
+    """Join the chunk playlists into the final ladder and publish it to media storage."""
+    try:
+        progress.set_status(film_id, progress.STITCHING)
+        profile = hls_transcoder.get_profile(profile_name)
+        master_path = hls_transcoder.stitch_chunks(output_dir, profile, len(chunk_indexes), source)
+        # Every segment is in the bucket before any playlist that lists it.
+        progress.set_status(film_id, progress.PUBLISHING)
+        published = publishing.publish_ladder(output_dir)
+        track = trickplay.track_path(output_dir)
+
+        film = Film.objects.filter(id=film_id).first()
+        if film is None:
+            return
+        snapshot = progress.get_progress(film_id) or {}
+        _mark_success(
+            film,
+            str(Path(master_path).relative_to(settings.MEDIA_ROOT)),
+            "Encoded {} chunk(s) in {}s at {} fps; published {} file(s).".format(
+                len(chunk_indexes), snapshot.get("elapsed_seconds", "?"), snapshot.get("fps", "?"), published
+            ),
+            str(track.relative_to(settings.MEDIA_ROOT)) if track.exists() else "",
+        )
+        sources.discard_local_copy(digest)
+    finally:
+        _release_locks(film_id, digest, token)
+
+
+@shared_task
+def hls_chunks_failed(request, exc, traceback, film_id, digest, token):
+    """Chord error callback: a chunk (or the stitch) failed."""
+    log = getattr(exc, "stderr", None) or str(exc)
+    logger.error("HLS conversion failed for film %s: %s", film_id, exc)
+    _mark_failed(film_id, log[-4000:])
+    _release_locks(film_id, digest, token)
+
+
+def _release_locks(film_id, digest, token):
+    sources.release(sources.film_lock(film_id), token)
+    sources.release(sources.source_lock(digest), token)
+
+
+def _mark_success(film, manifest_name, log, trickplay_name=""):
+    film.hls_manifest.name = manifest_name
+    film.trickplay_track.name = trickplay_name or None
+    film.processing_status = Film.ProcessingStatus.SUCCESS
+    film.processing_log = log
+    film.save(update_fields=["hls_manifest", "trickplay_track", "processing_status", "processing_log", "updated_at"])
+    manifests.invalidate(posixpath.dirname(manifest_name))
+    progress.set_status(film.id, progress.SUCCESS)
+
+
+def _mark_failed(film_id, log):
+    Film.objects.filter(id=film_id).update(processing_status=Film.ProcessingStatus.FAILED, processing_log=log)
+    progress.set_status(film_id, progress.FAILED)
+
+
+@shared_task
+def rebuild_catalog_snapshot(version):
+    """Pre-render the catalog for ``version`` unless a newer one superseded it."""
+    if catalog.get_version() != version:
+        return
+    catalog.build_snapshot(version)
+
+
+@shared_task
+def generate_poster_derivatives(film_id):
+    """Render the responsive WebP/JPEG poster sizes off the request thread."""
+    film = Film.objects.filter(id=film_id).first()
+    if film is None or not posters.needs_derivatives(film):
+        return
+    derivatives = posters.generate_derivatives(film)
+    # Only record them if the poster was not replaced while we were rendering.
+    updated = Film.objects.filter(id=film_id, poster=film.poster.name).update(poster_derivatives=derivatives)
+    if updated:
+        detail.bump("film", film_id)
+        catalog.invalidate()
+        posters.delete_derivatives(film.poster_derivatives, keep=derivatives)
+
+
+@shared_task
+def generate_trailer_derivatives(film_id):
+    """Encode the web trailer and the hover preview clip off the request thread."""
+    film = Film.objects.filter(id=film_id).first()
+    if film is None or not trailers.needs_derivatives(film):
+        return
+    error = None
+    try:
+        derivatives = trailers.generate_derivatives(film)
+    except subprocess.CalledProcessError as e:
+        error = (e.stderr or str(e))[-2000:]
+    except (ValueError, KeyError, StopIteration) as e:
+        # ffprobe's output had no usable video stream (ValueError covers bad JSON).
+        error = f"Could not probe the trailer: {e!r}"
+    if error is not None:
+        logger.error("Trailer encoding failed for film %s: %s", film_id, error)
+        # Record the failure against this source so it is not encoded again
+        # until the filmmaker uploads a new trailer.
+        derivatives = {"source": film.trailer_file.name, "error": error}
+    # Only record them if the trailer was not replaced while we were encoding.
+    updated = Film.objects.filter(id=film_id, trailer_file=film.trailer_file.name).update(trailer_derivatives=derivatives)
+    if updated:
+        detail.bump("film", film_id)
+        catalog.invalidate()
+        trailers.delete_derivatives(film.trailer_derivatives, keep=derivatives)
+
+
+@shared_task
+def requeue_deferred_transcodes():
+    """Put encodes deferred by admission control back on the transcode queue."""
+    film_ids = scheduling.pop_due_deferrals()
+    for film in Film.objects.filter(id__in=film_ids):
+        convert_film_to_hls.apply_async((film.id,), priority=scheduling.transcode_priority(film))
+    return len(film_ids)
+
+
+@shared_task
+def refresh_transcode_wait():
+    """Refresh the cached transcode wait estimate shown in the admin."""
+    return scheduling.refresh_estimated_wait()
+
+
+@shared_task
+def rebuild_related_films():
+    """Nightly rebuild of the "viewers also rented" table."""
+    return recommendations.rebuild_related_films()
+
+
+@shared_task
+def reconcile_leaderboards():
+    """Rebuild the Redis leaderboards from the database on a fresh decay epoch."""
+    return leaderboards.reconcile()
@@ -1,3 +1,1429 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import requests
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core_api import media
+from core_api.slugs import allocate_slugs
+
+from .models import Category, Film, RelatedFilm
+from .serializers import FilmSerializer, serialize_film_rows
+from .tasks import generate_poster_derivatives, generate_trailer_derivatives
+from .services import (
+    edge_cache,
+    hls_transcoder,
+    leaderboards,
+    manifests,
+    posters,
+    progress,
+    publishing,
+    recommendations,
+    scheduling,
+    search,
+    sources,
+    streaming,
+    trailers,
+    trickplay,
+    uploads,
+)
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for the S3 upload tests
+    mock_aws = None
+
+try:
+    import fakeredis
+except ImportError:  # fakeredis is only needed for the leaderboard tests
+    fakeredis = None
+
+
+class FilmQueryCountTests(TestCase):
+    """List endpoints must cost a constant number of queries, whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.filmmaker = User.objects.create_user(
+            email="maker@example.com", password="pass", full_name="Wanjiru Kamau", role="filmmaker"
+        )
+        with mock.patch("films.tasks.rebuild_catalog_snapshot.delay"):
+            drama = Category.objects.create(name="Drama")
+            comedy = Category.objects.create(name="Comedy")
+            for i in range(12):
+                Film.objects.create(
+                    title=f"Film {i}",
+                    category=drama if i % 2 else comedy,
+                    filmmaker=cls.filmmaker,
+                    status=Film.PROMO if i % 3 == 0 else Film.PAID,
+                    price=150,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_catalog_snapshot_queries(self):
+        url = reverse("films:film-list-api")
+        with self.assertNumQueries(2):  # one per section on a cold cache
+            self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_snapshot_matches_live_response(self):
+        Film.objects.filter(status=Film.PAID).update(poster="films/posters/x.jpg")
+        url = reverse("films:film-list-api")
+        self.client.get(url)  # warm the snapshot
+        with self.assertNumQueries(0):
+            snapshot = self.client.get(url, {"utm_source": "newsletter"}, HTTP_HOST="films.example.com").json()
+        live = self.client.get(url, {"status": Film.PAID}, HTTP_HOST="films.example.com").json()
+        self.assertEqual(snapshot["paid_films"], live["paid_films"])
+        self.assertTrue(snapshot["paid_films"]["results"][0]["poster_url"].startswith("http://films.example.com/media/"))
+
+    def test_paginated_list_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("films:film-list-api"), {"status": Film.PAID, "page_size": 50})
+        self.assertEqual(len(response.json()["paid_films"]["results"]), 8)
+
+    def test_filmmaker_list_queries(self):
+        self.client.force_authenticate(self.filmmaker)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("films:filmmaker-film-list-api"), {"page_size": 50})
+        self.assertEqual(len(response.json()["results"]), 12)
+
+    def test_detail_queries(self):
+        film = Film.objects.first()
+        url = reverse("films:film-detail-api", args=[film.slug])
+        with self.assertNumQueries(2):  # id lookup + the joined film row on a cold cache
+            response = self.client.get(url)
+        self.assertEqual(response.json()["filmmaker_name"], "Wanjiru Kamau")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), response.json())
+
+    def test_detail_invalidated_by_filmmaker_rename(self):
+        film = Film.objects.first()
+        url = reverse("films:film-detail-api", args=[film.slug])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.filmmaker.full_name = "Wanjiru Otieno"
+            self.filmmaker.save()
+        self.assertEqual(self.client.get(url).json()["filmmaker_name"], "Wanjiru Otieno")
+
+    def test_filmmaker_name_falls_back_to_username(self):
+        film = Film.objects.select_related("filmmaker").first()
+        film.filmmaker.full_name = ""
+        self.assertEqual(FilmSerializer().get_filmmaker_name(film), "Mbogiwood Productions")
+        film.filmmaker.username = "wanjiru"  # only on user models that have one
+        self.assertEqual(FilmSerializer().get_filmmaker_name(film), "wanjiru")
+        row = {**Film.objects.listing_values().get(pk=film.pk), "filmmaker__full_name": "", "filmmaker__username": "wanjiru"}
+        self.assertEqual(serialize_film_rows([row])[0]["filmmaker_name"], "wanjiru")
+
+    def test_fast_rows_match_serializer(self):
+        films = Film.objects.for_listing()
+        self.assertEqual(
+            serialize_film_rows(Film.objects.listing_values()),
+            [dict(row) for row in FilmSerializer(films, many=True).data],
+        )
+
+
+class FilmCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with mock.patch("films.tasks.rebuild_catalog_snapshot.delay"):
+            cls.films = [Film.objects.create(title=f"Film {i}", status=Film.PAID) for i in range(7)]
+            Film.objects.create(title="Promo", status=Film.PROMO)
+        # Five films share a timestamp, as a bulk import's rows can.
+        tied = timezone.now()
+        Film.objects.filter(pk__in=[film.pk for film in cls.films[1:6]]).update(created_at=tied)
+        Film.objects.filter(pk=cls.films[0].pk).update(created_at=tied - timedelta(days=1))
+        Film.objects.filter(pk=cls.films[6].pk).update(created_at=tied + timedelta(days=1))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_pages_follow_next_without_gaps_or_repeats(self):
+        url = reverse("films:film-list-api") + f"?status={Film.PAID}&page_size=2"
+        ids, pages = [], 0
+        while url:
+            section = self.client.get(url).json()["paid_films"]
+            self.assertLessEqual(len(section["results"]), 2)
+            ids += [film["id"] for film in section["results"]]
+            url, pages = section["next"], pages + 1
+        expected = Film.objects.filter(status=Film.PAID).order_by("-created_at", "-id").values_list("id", flat=True)
+        self.assertEqual(ids, list(expected))
+        self.assertEqual(pages, 4)
+
+    def test_each_section_links_its_own_next_page(self):
+        data = self.client.get(reverse("films:film-list-api"), {"page_size": 3}).json()
+        self.assertIsNone(data["promo_films"]["next"])
+        next_url = data["paid_films"]["next"]
+        self.assertIn(f"status={Film.PAID}", next_url)
+        self.assertEqual(len(self.client.get(next_url).json()["paid_films"]["results"]), 3)
+
+    def test_malformed_cursor_is_not_found(self):
+        url = reverse("films:film-list-api")
+        for cursor in ("%%%", base64.urlsafe_b64encode(b"no separator").decode(),
+                       base64.urlsafe_b64encode(b"2024-01-01T00:00:00|x").decode(),
+                       base64.urlsafe_b64encode(b"yesterday|3").decode(), "gA"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {"status": Film.PAID, "cursor": cursor}).status_code, 404)
+
+
+class SlugAllocationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("films.tasks.rebuild_catalog_snapshot.delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_next_free_suffix(self):
+        slugs = [Film.objects.create(title="Sauti ya Mtaa").slug for _ in range(3)]
+        self.assertEqual(slugs, ["sauti-ya-mtaa", "sauti-ya-mtaa-1", "sauti-ya-mtaa-2"])
+
+    def test_batch_allocation_uses_one_query(self):
+        Film.objects.create(title="Kesho")
+        with self.assertNumQueries(1):
+            slugs = allocate_slugs(Film, ["Kesho", "Kesho", "Kesho 1", "Leo"])
+        self.assertEqual(slugs, ["kesho-1", "kesho-2", "kesho-1-1", "leo"])
+
+    def test_batch_collisions_within_one_call(self):
+        Film.objects.create(title="Leo Usiku")  # shares the prefix, not the base
+        with self.assertNumQueries(1):
+            slugs = allocate_slugs(Film, ["Leo", "Leo", "Leo 1", "Leo"])
+        self.assertEqual(slugs, ["leo", "leo-1", "leo-1-1", "leo-2"])
+        self.assertEqual(len(set(slugs)), len(slugs))
+
+
+@skipUnless(mock_aws, "moto is not installed")
+@override_settings(
+    AWS_STORAGE_BUCKET_NAME="mbogiwood-test",
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_S3_REGION_NAME="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+)
+class DirectUploadTests(TestCase):
+    """The multipart upload flow against moto's in-process S3."""
+
+    def setUp(self):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.addCleanup(self.aws.stop)
+        uploads.get_client.cache_clear()
+        self.addCleanup(uploads.get_client.cache_clear)
+        uploads.get_client().create_bucket(Bucket="mbogiwood-test")
+
+        self.user = get_user_model().objects.create_user(
+            email="maker@example.com", password="pass", full_name="Wanjiru Kamau", role="filmmaker"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, data):
+        started = self.client.post(reverse("films:film-upload-start-api"), {"filename": "film.mp4", "size": len(data)}, format="json")
+        self.assertEqual(started.status_code, 201)
+        token, part_size = started.json()["upload"], started.json()["part_size"]
+        chunks = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+        checksums = [base64.b64encode(hashlib.sha256(chunk).digest()).decode() for chunk in chunks]
+        presigned = self.client.post(
+            reverse("films:film-upload-parts-api"),
+            {"upload": token, "parts": [{"number": n, "sha256": c} for n, c in enumerate(checksums, start=1)]},
+            format="json",
+        )
+        urls = presigned.json()["parts"]
+        self.assertEqual(len(urls), len(chunks))
+        self.assertIn("x-amz-checksum-sha256", urls[0]["url"])  # signed into the URL
+
+        parts = []
+        for part, chunk, checksum in zip(urls, chunks, checksums):
+            response = requests.put(part["url"], data=chunk, headers={"x-amz-checksum-sha256": checksum})
+            parts.append({"number": part["number"], "etag": response.headers["ETag"], "sha256": checksum})
+        return token, parts
+
+    def test_old_upload_endpoint_points_to_the_new_flow(self):
+        response = self.client.post("/api/films/upload/", {"title": "Old client"}, format="json")
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json()["start"], reverse("films:film-upload-start-api"))
+        self.assertEqual(response.json()["complete"], reverse("films:film-upload-api"))
+
+    def complete(self, token, parts):
+        return self.client.post(
+            reverse("films:film-upload-api"), {"upload": token, "parts": parts, "title": "Direct"}, format="json"
+        )
+
+    def test_complete_creates_film(self):
+        data = b"\x00" * (6 * 1024 * 1024)
+        token, parts = self.upload(data)
+        with mock.patch("films.tasks.convert_film_to_hls.apply_async"), mock.patch("films.tasks.rebuild_catalog_snapshot.delay"):
+            response = self.client.post(
+                reverse("films:film-upload-api"), {"upload": token, "parts": parts, "title": "Direct"}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        film = Film.objects.get(pk=response.json()["id"])
+        self.assertEqual(film.filmmaker, self.user)
+        stored = uploads.get_client().get_object(Bucket="mbogiwood-test", Key=uploads._bucket_key(film.video_file.name))
+        self.assertEqual(hashlib.sha256(stored["Body"].read()).hexdigest(), hashlib.sha256(data).hexdigest())
+
+    def test_mismatched_part_is_rejected(self):
+        token, parts = self.upload(b"\x01" * 1024)
+        parts[0]["etag"] = '"0123456789abcdef0123456789abcdef"'
+        self.assertEqual(self.complete(token, parts).status_code, 400)
+        self.assertFalse(Film.objects.exists())
+
+    def test_upload_is_completed_once(self):
+        token, parts = self.upload(b"\x02" * 1024)
+        with mock.patch("django.db.transaction.on_commit"):
+            self.assertEqual(self.complete(token, parts).status_code, 201)
+            second = self.complete(token, parts)
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(Film.objects.count(), 1)
+
+    def test_s3_refusal_is_a_validation_error(self):
+        token, parts = self.upload(b"\x03" * 1024)
+        refusal = ClientError({"Error": {"Code": "InvalidPart", "Message": "bad checksum"}}, "CompleteMultipartUpload")
+        with mock.patch.object(uploads.get_client(), "complete_multipart_upload", side_effect=refusal):
+            response = self.complete(token, parts)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("InvalidPart", response.json()["upload"][0])
+
+    def test_object_is_deleted_if_film_creation_fails(self):
+        token, parts = self.upload(b"\x04" * 1024)
+        with mock.patch("films.serializers.FilmUploadSerializer.create", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.complete(token, parts)
+        listing = uploads.get_client().list_objects_v2(Bucket="mbogiwood-test")
+        self.assertEqual(listing["KeyCount"], 0)
+
+
+class TranscodeSchedulingTests(TestCase):
+    def setUp(self):
+        cache.clear()  # film ids repeat across tests; so would their locks
+
+    @override_settings(TRANSCODE_DEFER_SECONDS=120)
+    def test_priorities_and_admission(self):
+        from . import tasks
+
+        maker = get_user_model().objects.create_user(
+            email="maker@example.com", password="pass", full_name="Wanjiru Kamau", role="filmmaker"
+        )
+        with mock.patch("django.db.transaction.on_commit"):
+            paid = Film.objects.create(title="Paid", filmmaker=maker, status=Film.PAID)
+            promo = Film.objects.create(title="Promo", filmmaker=maker, status=Film.PROMO)
+            encoded = Film.objects.create(title="Encoded", filmmaker=maker, hls_manifest="hls/x/default/master.m3u8")
+        self.assertLess(scheduling.transcode_priority(paid), scheduling.transcode_priority(promo))
+        self.assertLess(scheduling.transcode_priority(promo), scheduling.transcode_priority(encoded))
+        self.assertLess(scheduling.transcode_priority(encoded), scheduling.PRIORITY_TRAILER)
+
+        with mock.patch.object(scheduling, "is_overloaded", return_value=True), \
+                mock.patch.object(scheduling, "defer") as defer, \
+                mock.patch.object(tasks.convert_film_to_hls, "apply_async") as requeue:
+            tasks.convert_film_to_hls.run(paid.id)
+        defer.assert_called_once_with(paid.id, 120)
+        requeue.assert_not_called()  # the beat task requeues it, at its priority
+        self.assertEqual(Film.objects.get(id=paid.id).processing_status, Film.ProcessingStatus.PENDING)
+        self.assertTrue(tasks.sources.acquire(tasks.sources.film_lock(paid.id), "next"))  # free for the requeued copy
+
+    @skipUnless(fakeredis, "fakeredis is not installed")
+    def test_deferred_encodes_are_requeued_when_due(self):
+        from . import tasks
+
+        self.enterContext(mock.patch.object(scheduling, "get_redis", return_value=fakeredis.FakeRedis()))
+        with mock.patch("django.db.transaction.on_commit"):
+            paid = Film.objects.create(title="Paid", status=Film.PAID)
+            promo = Film.objects.create(title="Promo", status=Film.PROMO)
+        scheduling.defer(paid.id, 0)
+        scheduling.defer(promo.id, 60)
+        scheduling.defer(paid.id, -1)  # deferred again: one entry
+        with mock.patch.object(tasks.convert_film_to_hls, "apply_async") as requeue:
+            self.assertEqual(tasks.requeue_deferred_transcodes.run(), 1)
+            self.assertEqual(tasks.requeue_deferred_transcodes.run(), 0)
+        requeue.assert_called_once_with((paid.id,), priority=scheduling.PRIORITY_NEW_PAID)
+
+        with mock.patch("time.time", return_value=time.time() + 61), \
+                mock.patch.object(tasks.convert_film_to_hls, "apply_async") as requeue:
+            tasks.requeue_deferred_transcodes.run()
+        requeue.assert_called_once_with((promo.id,), priority=scheduling.PRIORITY_NEW_PROMO)
+
+    @override_settings(TRANSCODE_MAX_LOAD=1.5)
+    def test_busy_node_still_admits_encodes(self):
+        with mock.patch("os.cpu_count", return_value=8):
+            with mock.patch("os.getloadavg", return_value=(8.4, 8.0, 8.0)):
+                self.assertFalse(scheduling.is_overloaded())  # every slot encoding
+            with mock.patch("os.getloadavg", return_value=(13.0, 9.0, 8.0)):
+                self.assertTrue(scheduling.is_overloaded())
+
+    def test_admin_reads_the_cached_wait(self):
+        cache.delete(scheduling.WAIT_KEY)
+        self.assertIsNone(scheduling.estimated_wait())
+        cache.set(scheduling.TASK_SECONDS_KEY, 30)
+        self.addCleanup(cache.delete_many, [scheduling.TASK_SECONDS_KEY, scheduling.WAIT_KEY])
+        with mock.patch.object(scheduling, "queue_depth", return_value=4), \
+                mock.patch.object(scheduling, "transcode_slots", return_value=2):
+            scheduling.refresh_estimated_wait()
+        with mock.patch.object(scheduling.app.control, "inspect") as inspect:
+            self.assertEqual(scheduling.estimated_wait(), {"depth": 4, "slots": 2, "seconds": 60})
+        inspect.assert_not_called()
+
+
+class HlsLadderTests(TestCase):
+    def setUp(self):
+        self.profile = hls_transcoder.Profile(
+            name="test",
+            ladder=(hls_transcoder.Rendition("240p", 240, 400), hls_transcoder.Rendition("720p", 720, 2800)),
+        )
+        self.output_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def test_master_playlist_codecs_follow_the_source(self):
+        source = {"width": 1280, "height": 720, "duration": 60.0, "has_audio": True}
+        master = hls_transcoder.write_master_playlist(self.output_dir, self.profile, self.profile.ladder, source)
+        self.assertIn('CODECS="avc1.4d4028,mp4a.40.2"', master.read_text())
+
+        silent = {**source, "has_audio": False}
+        master = hls_transcoder.write_master_playlist(self.output_dir, self.profile, self.profile.ladder, silent)
+        self.assertIn('CODECS="avc1.4d4028"\n', master.read_text())
+
+    def test_chunks_start_on_segment_boundaries(self):
+        # 100s chunks are rounded to 102s, a whole number of 6s segments.
+        chunks = hls_transcoder.plan_chunks(250.0, self.profile, chunk_seconds=100)
+        self.assertEqual([(c.index, c.start) for c in chunks], [(0, 0), (1, 102), (2, 204)])
+        self.assertEqual([c.duration for c in chunks], [102, 102, None])  # the last runs to the end
+        self.assertTrue(all(c.start % self.profile.segment_seconds == 0 for c in chunks))
+        self.assertEqual(hls_transcoder.plan_chunks(5.0, self.profile, chunk_seconds=2), [hls_transcoder.Chunk(0, 0, None)])
+        self.assertEqual(len(hls_transcoder.plan_chunks(0.0, self.profile)), 1)
+
+    def test_renditions_never_upscale(self):
+        ladder = self.profile.ladder
+        self.assertEqual([r.name for r in hls_transcoder.select_renditions(ladder, 1080)], ["240p", "720p"])
+        self.assertEqual([r.name for r in hls_transcoder.select_renditions(ladder, 720)], ["240p", "720p"])
+        self.assertEqual([r.name for r in hls_transcoder.select_renditions(ladder, 480)], ["240p"])
+        self.assertEqual([r.name for r in hls_transcoder.select_renditions(ladder, 144)], ["240p"])  # smallest kept
+
+    @override_settings(HLS_TRICKPLAY=None)
+    def test_stitched_playlists_keep_chunk_order(self):
+        source = {"width": 1280, "height": 720, "duration": 15.0, "has_audio": True}
+        durations = [(6.0, 6.0), (3.0,)]
+        for rendition in self.profile.ladder:
+            directory = self.output_dir / rendition.name
+            directory.mkdir()
+            # Written out of order, as parallel chunks finish.
+            for index in reversed(range(len(durations))):
+                entries = [(d, f"seg_{index:05d}_{n:05d}.ts") for n, d in enumerate(durations[index])]
+                hls_transcoder.write_media_playlist(
+                    directory / hls_transcoder.CHUNK_PLAYLIST.format(index=index), entries, 6
+                )
+        master = hls_transcoder.stitch_chunks(self.output_dir, self.profile, len(durations), source)
+
+        self.assertEqual(master, self.output_dir / hls_transcoder.MASTER_PLAYLIST)
+        index = (self.output_dir / "720p" / hls_transcoder.MEDIA_PLAYLIST).read_text().splitlines()
+        segments = [line for line in index if line and not line.startswith("#")]
+        self.assertEqual(segments, ["seg_00000_00000.ts", "seg_00000_00001.ts", "seg_00001_00000.ts"])
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:0", index)
+        self.assertIn("#EXT-X-TARGETDURATION:6", index)
+        self.assertEqual(index[-1], "#EXT-X-ENDLIST")
+        self.assertEqual([line for line in index if line.startswith("#EXTINF")][-1], "#EXTINF:3.000000,")
+
+    def test_master_playlist_bandwidth_and_resolution(self):
+        source = {"width": 1920, "height": 800, "duration": 60.0, "has_audio": True}  # 2.40:1
+        master = hls_transcoder.write_master_playlist(
+            self.output_dir, self.profile, list(reversed(self.profile.ladder)), source
+        )
+        lines = master.read_text().splitlines()
+        self.assertEqual(lines[:3], ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-INDEPENDENT-SEGMENTS"])
+        # Lowest bandwidth first; peak is 110% of the video rate plus audio.
+        self.assertTrue(lines[3].startswith("#EXT-X-STREAM-INF:BANDWIDTH=536000,RESOLUTION=576x240,"))
+        self.assertEqual(lines[4], "240p/index.m3u8")
+        self.assertTrue(lines[5].startswith("#EXT-X-STREAM-INF:BANDWIDTH=3176000,RESOLUTION=1728x720,"))
+        self.assertEqual(lines[6], "720p/index.m3u8")
+
+    def test_benchmark_reports_each_profile(self):
+        source = {"width": 1280, "height": 720, "duration": 120.0, "has_audio": False}
+
+        def transcode(source_path, output_dir, profile, on_progress):
+            output_dir.mkdir(parents=True)
+            (output_dir / "seg_00000.ts").write_bytes(b"\x47" * 1_500_000)  # 1.5 MB over 2 minutes
+            on_progress(120.0, 2880)
+            return output_dir / hls_transcoder.MASTER_PLAYLIST
+
+        out = io.StringIO()
+        with mock.patch.object(hls_transcoder, "probe", return_value=source), \
+                mock.patch.object(hls_transcoder, "transcode_to_hls", side_effect=transcode) as encode:
+            call_command("benchmark_transcode", "--source", "/clip.mp4", "--profile", "fast", "--profile", "mobile", stdout=out)
+        self.assertEqual([call.args[2].name for call in encode.call_args_list], ["fast", "mobile"])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "Source: 1280x720, 120.0s, no audio")
+        rows = {line.split()[0]: line.split() for line in lines[3:]}
+        self.assertEqual(set(rows), {"fast", "mobile"})
+        self.assertEqual(rows["fast"][4:6], ["1.5", "100"])  # size MB, kbps
+
+        failure = subprocess.CalledProcessError(1, ["ffmpeg"], stderr="Unknown encoder 'libx264'")
+        with mock.patch.object(hls_transcoder, "probe", return_value=source), \
+                mock.patch.object(hls_transcoder, "transcode_to_hls", side_effect=failure), \
+                self.assertRaisesMessage(CommandError, "Unknown encoder"):
+            call_command("benchmark_transcode", "--source", "/clip.mp4", "--profile", "fast", stdout=io.StringIO())
+
+
+class TranscodeProgressTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch.object(progress, "publish"))
+        # Flush every report so the counters move while the chunk encodes.
+        self.enterContext(mock.patch.object(progress.ProgressTracker.__init__, "__defaults__", (0,)))
+
+    def test_tracker_counters_and_status(self):
+        clock = mock.Mock(**{"time.return_value": 1000.0, "monotonic.return_value": 0.0})
+        with mock.patch.object(progress, "time", clock):
+            progress.start(7, 120.0)
+            self.assertEqual(progress.get_progress(7)["status"], progress.ENCODING)
+            tracker = progress.ProgressTracker(7, flush_seconds=5)
+            tracker(10.0, 250)
+            tracker(20.0, 500)
+            self.assertEqual(progress.get_progress(7)["percent"], 0.0)  # not flushed yet
+            clock.monotonic.return_value = 6.0
+            clock.time.return_value = 1030.0
+            tracker(0.0, 0)
+            self.assertEqual(
+                progress.get_progress(7),
+                {"status": progress.ENCODING, "percent": 25.0, "fps": 25.0, "eta_seconds": 90, "elapsed_seconds": 30},
+            )
+            tracker(0.0005, 0)  # under a millisecond: carried to the next flush
+            tracker.close()
+            self.assertEqual(progress.get_progress(7)["percent"], 25.0)
+
+            progress.set_status(7, progress.STITCHING)
+            self.assertEqual(progress.get_progress(7)["eta_seconds"], None)
+            clock.time.return_value = 1060.0
+            progress.set_status(7, progress.SUCCESS)
+            clock.time.return_value = 5000.0
+            snapshot = progress.get_progress(7)
+        self.assertEqual((snapshot["status"], snapshot["percent"]), (progress.SUCCESS, 100.0))
+        self.assertEqual(snapshot["elapsed_seconds"], 60)  # stops at finished_at
+        self.assertIsNone(progress.get_progress(8))
+
+    def test_progress_stream_is_parsed(self):
+        profile = hls_transcoder.Profile(name="test", ladder=(hls_transcoder.Rendition("240p", 240, 400),))
+        source = {"width": 640, "height": 360, "duration": 6.0, "has_audio": True}
+        blocks = [
+            {"frame": "0", "out_time_us": "N/A", "progress": "continue"},
+            {"frame": "48", "out_time_us": "2000000", "progress": "continue"},
+            {"frame": "48", "out_time_us": "2000000", "progress": "continue"},  # no new output
+            {"frame": "144", "out_time_us": "6000000", "progress": "end"},
+        ]
+        stdout = [f"{key}={value}\n" for block in blocks for key, value in block.items()]
+
+        def popen(command, stdout=None, stderr=None, text=None):
+            self.assertIn("-progress", command)
+            stderr.write("" if returncode == 0 else "Conversion failed!")
+            return mock.Mock(stdout=iter(lines), **{"wait.return_value": returncode})
+
+        output_dir = self.enterContext(tempfile.TemporaryDirectory())
+        reports, lines, returncode = [], stdout, 0
+        with mock.patch.object(hls_transcoder.subprocess, "Popen", side_effect=popen):
+            hls_transcoder.encode_rendition(
+                "/src.mp4", output_dir, profile, profile.ladder[0], source, 1, on_progress=lambda *r: reports.append(r)
+            )
+            self.assertEqual(reports, [(2.0, 48), (4.0, 96)])
+
+            lines, returncode = stdout[:3], 1
+            with self.assertRaises(subprocess.CalledProcessError) as failure:
+                hls_transcoder.encode_rendition("/src.mp4", output_dir, profile, profile.ladder[0], source, 1)
+        self.assertEqual(failure.exception.stderr, "Conversion failed!")
+
+    def test_retried_chunk_is_counted_once(self):
+        from . import tasks
+
+        progress.start(7, 60.0)
+        attempts = []
+
+        def encode_chunk(*args, on_progress):
+            attempts.append(progress.get_progress(7)["percent"])
+            on_progress(6.0, 150)  # a rendition finished before ffmpeg failed on the next
+            if len(attempts) == 1:
+                raise subprocess.CalledProcessError(1, ["ffmpeg"], stderr="Conversion failed!")
+            on_progress(24.0, 600)
+            return args[3].index
+
+        job = (7, "/src.mp4", "/out", "default", 0, 0.0, 30.0, {"height": 720})
+        with mock.patch.object(hls_transcoder, "encode_chunk", side_effect=encode_chunk):
+            with self.assertRaises(subprocess.CalledProcessError):
+                tasks.transcode_hls_chunk.run(*job)
+            self.assertEqual(progress.get_progress(7)["percent"], 0.0)
+            tasks.transcode_hls_chunk.run(*job)
+        self.assertEqual(attempts, [0.0, 0.0])
+        self.assertEqual(progress.get_progress(7)["percent"], 50.0)
+
+
+class TranscodeSourceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.enterContext(mock.patch.object(progress, "publish"))
+        self.profile = hls_transcoder.get_profile()
+        self.digest = hashlib.sha256(b"frames").hexdigest()
+        self.ladder = sources.output_dir_name(self.digest, self.profile.name)
+
+    def film(self, title, **fields):
+        with mock.patch("django.db.transaction.on_commit"):
+            return Film.objects.create(title=title, video_file=SimpleUploadedFile(f"{title}.mp4", b"frames"), **fields)
+
+    def transcoded(self, title):
+        return self.film(
+            title,
+            video_hash=self.digest,
+            processing_status=Film.ProcessingStatus.SUCCESS,
+            hls_manifest=f"{self.ladder}/master.m3u8",
+            trickplay_track=f"{self.ladder}/trickplay/thumbnails.vtt",
+        )
+
+    def test_failed_download_leaves_no_partial_copy(self):
+        class Dropped(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell():
+                    raise ConnectionResetError("connection reset by peer")
+                return super().read(size)
+
+        remote = mock.Mock()
+        remote.name = "films/videos/x.mp4"
+        type(remote).path = mock.PropertyMock(side_effect=NotImplementedError)
+        remote.open.return_value = Dropped(b"frames")
+        with self.assertRaises(ConnectionResetError):
+            sources.localize(remote)
+        self.assertEqual(list((Path(settings.MEDIA_ROOT) / sources.LOCAL_COPY_DIR).iterdir()), [])
+
+    def test_locks_belong_to_their_token(self):
+        key = sources.film_lock(1)
+        self.assertTrue(sources.acquire(key, "task-a"))
+        self.assertFalse(sources.acquire(key, "task-b"))
+        self.assertTrue(sources.acquire(key, "task-a"))  # a redelivered task finds its own lock
+        sources.release(key, "task-b")  # not its lock: a no-op
+        self.assertFalse(sources.acquire(key, "task-b"))
+        sources.release(key, "task-a")
+        self.assertTrue(sources.acquire(key, "task-b"))
+
+    def test_find_transcoded(self):
+        original = self.transcoded("Original")
+        self.film("Failed", video_hash=self.digest, processing_status=Film.ProcessingStatus.FAILED)
+        self.assertEqual(sources.find_transcoded(self.digest, self.profile.name), original)
+        self.assertIsNone(sources.find_transcoded(self.digest, self.profile.name, exclude_id=original.id))
+        self.assertIsNone(sources.find_transcoded(self.digest, "other-profile"))
+        self.assertIsNone(sources.find_transcoded("0" * 64, self.profile.name))
+
+    def test_identical_upload_reuses_the_ladder(self):
+        from . import tasks
+
+        original = self.transcoded("Original")
+        copy = self.film("Copy")
+        with mock.patch.object(scheduling, "is_overloaded", return_value=False), \
+                mock.patch.object(tasks, "chord") as chord:
+            tasks.convert_film_to_hls.run(copy.id)
+        chord.assert_not_called()
+        copy.refresh_from_db()
+        self.assertEqual(copy.processing_status, Film.ProcessingStatus.SUCCESS)
+        self.assertEqual((copy.hls_manifest.name, copy.video_hash), (original.hls_manifest.name, self.digest))
+        self.assertEqual(copy.trickplay_track.name, original.trickplay_track.name)
+        self.assertIn(f"film {original.id}", copy.processing_log)
+        self.assertTrue(sources.acquire(sources.film_lock(copy.id), "next"))  # released
+
+    def test_identical_upload_encoding_elsewhere_is_requeued(self):
+        from . import tasks
+
+        film = self.film("Copy")
+        self.assertTrue(sources.acquire(sources.source_lock(self.digest), "other-encode"))
+        with mock.patch.object(scheduling, "is_overloaded", return_value=False), \
+                mock.patch.object(scheduling, "defer") as defer, \
+                mock.patch.object(tasks, "chord") as chord:
+            tasks.convert_film_to_hls.run(film.id)
+        chord.assert_not_called()
+        defer.assert_called_once_with(film.id, 60)
+        self.assertFalse(sources.acquire(sources.source_lock(self.digest), "next"))  # still the other encode's
+        self.assertTrue(sources.acquire(sources.film_lock(film.id), "next"))
+
+
+class TranscodeRecoveryTests(TestCase):
+    """convert_film_to_hls with the chord and ffmpeg mocked out."""
+
+    def setUp(self):
+        from . import tasks
+
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.enterContext(mock.patch.object(progress, "publish"))
+        self.enterContext(mock.patch.object(scheduling, "is_overloaded", return_value=False))
+        self.chord = self.enterContext(mock.patch.object(tasks, "chord"))
+        self.tasks = tasks
+        with mock.patch("django.db.transaction.on_commit"):
+            self.film = Film.objects.create(title="Kati Kati", video_file=SimpleUploadedFile("k.mp4", b"frames"))
+        self.digest = hashlib.sha256(b"frames").hexdigest()
+
+    def run_task(self, task_id):
+        source = {"width": 1280, "height": 720, "duration": 300.0, "has_audio": True}
+        with mock.patch.object(hls_transcoder, "probe", return_value=source):
+            return self.tasks.convert_film_to_hls.apply((self.film.id,), task_id=task_id)
+
+    def test_redelivery_respects_the_locks(self):
+        self.assertTrue(self.run_task("delivery-1").successful())
+        self.assertEqual(self.chord.call_count, 1)
+        self.assertEqual(cache.get(sources.film_lock(self.film.id)), "delivery-1")  # held for the chord
+
+        self.run_task("delivery-1")  # redelivered after dispatching: nothing to do
+        self.run_task("delivery-2")  # another task while the chord runs
+        self.assertEqual(self.chord.call_count, 1)
+        self.assertEqual(cache.get(sources.source_lock(self.digest)), "delivery-1")
+
+    def test_redelivery_before_dispatch_takes_over(self):
+        # The first delivery took the lock and died before dispatching the chord.
+        self.assertTrue(sources.acquire(sources.film_lock(self.film.id), "delivery-1"))
+        self.run_task("delivery-1")
+        self.assertEqual(self.chord.call_count, 1)
+
+    def test_failure_marks_the_film_failed(self):
+        failure = subprocess.CalledProcessError(1, ["ffprobe"], stderr="x" * 5000 + "moov atom not found")
+        with mock.patch.object(hls_transcoder, "probe", side_effect=failure), self.assertLogs("films.tasks", "ERROR"):
+            self.tasks.convert_film_to_hls.apply((self.film.id,), task_id="delivery-1")
+        self.film.refresh_from_db()
+        self.assertEqual(self.film.processing_status, Film.ProcessingStatus.FAILED)
+        self.assertEqual(len(self.film.processing_log), 4000)
+        self.assertTrue(self.film.processing_log.endswith("moov atom not found"))
+        self.chord.assert_not_called()
+        for lock in (sources.film_lock(self.film.id), sources.source_lock(self.digest)):
+            self.assertIsNone(cache.get(lock))
+
+    def test_failed_chunk_marks_the_film_failed(self):
+        self.run_task("delivery-1")
+        error = subprocess.CalledProcessError(1, ["ffmpeg"], stderr="Error while decoding stream #0:0")
+        with self.assertLogs("films.tasks", "ERROR"):
+            self.tasks.hls_chunks_failed.run(None, error, None, self.film.id, self.digest, "delivery-1")
+        self.film.refresh_from_db()
+        self.assertEqual(self.film.processing_status, Film.ProcessingStatus.FAILED)
+        self.assertEqual(self.film.processing_log, "Error while decoding stream #0:0")
+        for lock in (sources.film_lock(self.film.id), sources.source_lock(self.digest)):
+            self.assertIsNone(cache.get(lock))
+
+
+class TrickplayTrackTests(TestCase):
+    def test_sprites_and_cues_follow_chunks(self):
+        from PIL import Image
+
+        options = trickplay.Options(interval=4, width=32, columns=2, rows=2)
+        source = {"width": 64, "height": 36}
+        with tempfile.TemporaryDirectory() as output_dir:
+            directory = Path(output_dir) / trickplay.TRICKPLAY_DIR
+            directory.mkdir()
+            # Two 6s chunks (two thumbnails each) and a 3s tail (one).
+            for index, count in ((0, 2), (1, 2), (2, 1)):
+                for n in range(count):
+                    Image.new("RGB", (32, 18)).save(directory / f"thumb_{index:05d}_{n:05d}.jpg")
+            track = trickplay.build_track(output_dir, [(0, 0, 6), (1, 6, 12), (2, 12, 15)], options, source)
+            cues = track.read_text().strip().split("\n\n")[1:]
+            self.assertEqual(cues[1], "00:00:04.000 --> 00:00:06.000\nsprite_000.jpg#xywh=32,0,32,18")
+            self.assertEqual(cues[4], "00:00:12.000 --> 00:00:15.000\nsprite_001.jpg#xywh=0,0,32,18")
+            self.assertEqual(Image.open(directory / "sprite_001.jpg").size, (32, 18))
+
+
+@skipUnless(mock_aws, "moto is not installed")
+@override_settings(
+    AWS_STORAGE_BUCKET_NAME="mbogiwood-test",
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_S3_REGION_NAME="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    HLS_PUBLISH_WORKERS=4,
+)
+class LadderPublishingTests(TestCase):
+    """Publishing a stitched ladder to moto's in-process S3."""
+
+    def setUp(self):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.addCleanup(self.aws.stop)
+        publishing.get_client.cache_clear()
+        self.addCleanup(publishing.get_client.cache_clear)
+        publishing.get_client().create_bucket(Bucket="mbogiwood-test")
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.ladder = Path(media_root.name) / "hls" / "abc" / "default"
+        for rung in ("240p", "480p"):
+            (self.ladder / rung).mkdir(parents=True)
+            (self.ladder / rung / "index.m3u8").write_text("#EXTM3U\n")
+            (self.ladder / rung / "chunk_00000.m3u8").write_text("#EXTM3U\n")
+            for n in range(3):
+                (self.ladder / rung / f"seg_{n:05d}.ts").write_bytes(b"\x47" * 188)
+        (self.ladder / "master.m3u8").write_text("#EXTM3U\n")
+
+    def publish(self, fail_times):
+        """Publish with ``seg_00001.ts`` of 480p failing its first ``fail_times`` uploads."""
+        client, order, failures = publishing.get_client(), [], []
+        upload_file = client.upload_file
+
+        def flaky(filename, bucket, key, **kwargs):
+            if key.endswith("480p/seg_00001.ts") and len(failures) < fail_times:
+                failures.append(key)
+                raise OSError("connection reset")
+            upload_file(filename, bucket, key, **kwargs)
+            order.append(key.rsplit("/", 2)[-2:])
+
+        with mock.patch.object(client, "upload_file", flaky), mock.patch("films.services.publishing.time.sleep"):
+            with self.assertLogs("films.services.publishing", "WARNING"):
+                return publishing.publish_ladder(self.ladder), order
+
+    def test_segments_then_playlists_then_master(self):
+        published, order = self.publish(fail_times=1)
+        self.assertEqual(published, 9)  # chunk playlists stay local
+        names = [name for *_, name in order]
+        self.assertTrue(all(name.endswith(".ts") for name in names[:6]))
+        self.assertEqual(names[6:], ["index.m3u8", "index.m3u8", "master.m3u8"])
+        head = publishing.get_client().head_object(
+            Bucket="mbogiwood-test", Key=publishing.bucket_key(self.ladder / "master.m3u8")
+        )
+        self.assertEqual(head["ContentType"], "application/vnd.apple.mpegurl")
+
+    def test_failed_segment_blocks_playlists(self):
+        with self.assertRaises(OSError):
+            self.publish(fail_times=10)
+        listing = publishing.get_client().list_objects_v2(Bucket="mbogiwood-test")
+        self.assertFalse([o["Key"] for o in listing["Contents"] if o["Key"].endswith(".m3u8")])
+
+        # Republishing only uploads what is missing.
+        self.assertEqual(publishing.publish_ladder(self.ladder), 4)
+
+
+@override_settings(STREAM_SIGNING_KEYS={"k2": "new-secret", "k1": "old-secret"}, AWS_STORAGE_BUCKET_NAME=None)
+class StreamingGatewayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        manifests._template.cache_clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        ladder = Path(media_root.name) / "hls" / "abc" / "default"
+        (ladder / "240p").mkdir(parents=True)
+        (ladder / "master.m3u8").write_text("#EXTM3U\n240p/index.m3u8\n")
+        (ladder / "240p" / "seg_00000.ts").write_bytes(b"\x47" * 188)
+
+        User = get_user_model()
+        self.viewer = User.objects.create_user(email="viewer@example.com", password="pass", full_name="Otieno Ouma")
+        with mock.patch("django.db.transaction.on_commit"):
+            self.film = Film.objects.create(
+                title="Kati Kati",
+                hls_manifest="hls/abc/default/master.m3u8",
+                processing_status=Film.ProcessingStatus.SUCCESS,
+            )
+
+    def test_token_scope_expiry_and_rotation(self):
+        token = streaming.make_token(self.viewer.pk, "hls/abc/default")
+        grant = streaming.read_token(token)
+        self.assertEqual(streaming.resolve(grant, "240p/seg_00000.ts"), "hls/abc/default/240p/seg_00000.ts")
+        self.assertIsNone(streaming.resolve(grant, "../other/master.m3u8"))
+        self.assertIsNone(streaming.read_token(token.replace(".", "x.", 1)))
+        key_id, payload, signature = token.split(".")
+        forged = streaming._b64encode(b"1:9999999999:hls/other/default")
+        self.assertIsNone(streaming.read_token(f"{key_id}.{forged}.{signature}"))
+
+        with override_settings(STREAM_SIGNING_KEYS={"k1": "old-secret"}):
+            old = streaming.make_token(self.viewer.pk, "hls/abc/default", ttl=60)
+        self.assertEqual(streaming.read_token(old).user_id, self.viewer.pk)  # still verifies after rotation
+        with override_settings(STREAM_SIGNING_KEYS={"k2": "new-secret"}):
+            self.assertIsNone(streaming.read_token(old))  # retired key
+        with mock.patch("films.services.streaming.time.time", return_value=time.time() + 3600):
+            self.assertIsNone(streaming.read_token(old))
+
+    @override_settings(STREAM_TOKEN_TTL=4 * 3600, STREAM_TOKEN_GRACE=1800)
+    def test_tokens_live_for_one_viewing(self):
+        scope = "hls/abc/default"
+        self.assertEqual(streaming.viewing_ttl(scope), 4 * 3600)  # no variant playlist to time
+        playlist = Path(settings.MEDIA_ROOT) / scope / "240p" / "index.m3u8"
+        playlist.write_text("#EXTM3U\n#EXTINF:6.000000,\nseg_00000.ts\n#EXTINF:4.500000,\nseg_00001.ts\n#EXT-X-ENDLIST\n")
+        self.assertEqual(streaming.viewing_ttl(scope), 11 + 1800)
+        with override_settings(STREAM_TOKEN_TTL=600):
+            self.assertEqual(streaming.viewing_ttl(scope), 600)
+
+    def test_stream_view_hands_out_gateway_urls(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        url = reverse("films:film-stream-api", args=[self.film.pk])
+        self.assertEqual(client.get(url).status_code, 403)
+
+        with mock.patch("payments.entitlements.has_access", return_value=True):
+            hls_url = client.get(url).json()["hls_url"]
+        prefix = hls_url.removesuffix("master.m3u8")
+        with self.assertNumQueries(0):
+            response = client.get(hls_url)
+            self.assertEqual(response.content.decode(), f"#EXTM3U\n{prefix}240p/index.m3u8\n")
+            self.assertEqual(response["Content-Type"], "application/vnd.apple.mpegurl")
+            segment = client.get(prefix + "240p/seg_00000.ts")
+            self.assertEqual(segment.status_code, 200)
+            segment.close()
+            self.assertEqual(client.get(hls_url.replace("/master.m3u8", "x/master.m3u8")).status_code, 403)
+
+        # The URL alone is not enough: it only plays in the viewer's browser.
+        self.assertEqual(self.client.get(hls_url).status_code, 403)
+        other = get_user_model().objects.create_user(email="friend@example.com", password="pass")
+        self.client.cookies[streaming.VIEWER_COOKIE] = client.cookies[streaming.VIEWER_COOKIE].value
+        self.assertEqual(self.client.get(hls_url).status_code, 200)
+        other_client = APIClient()
+        other_client.force_authenticate(other)
+        with mock.patch("payments.entitlements.has_access", return_value=True):
+            other_client.get(url)
+        self.assertEqual(other_client.get(hls_url).status_code, 403)
+
+    def test_bucket_playlists_list_presigned_media(self):
+        scope = "hls/abc/default"
+        playlist = Path(settings.MEDIA_ROOT) / scope / "240p" / "index.m3u8"
+        playlist.write_text('#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:6.000000,\nseg_00000.ts\n#EXT-X-ENDLIST\n')
+        token = streaming.make_token(self.viewer.pk, scope, ttl=600)
+        request = RequestFactory().get("/")
+        response = HttpResponse()
+        streaming.set_viewer_cookie(response, request, self.viewer.pk, 600)
+        self.client.cookies[streaming.VIEWER_COOKIE] = response.cookies[streaming.VIEWER_COOKIE].value
+
+        def presign(name, expires_in):
+            self.assertGreater(expires_in, 590)  # as long as the token
+            return f"https://bucket.example.com/{name}?sig"
+
+        with mock.patch.object(publishing, "is_configured", return_value=True), \
+                mock.patch.object(publishing, "presigned_url", side_effect=presign):
+            master = self.client.get(streaming.build_url(token)).content.decode()
+            variant = self.client.get(streaming.build_url(token, "240p/index.m3u8")).content.decode()
+        self.assertEqual(master, f"#EXTM3U\nhttp://testserver{streaming.url_prefix(token)}240p/index.m3u8\n")  # still the gateway
+        self.assertIn(f'URI="https://bucket.example.com/{scope}/240p/init.mp4?sig"', variant)
+        self.assertIn(f"\nhttps://bucket.example.com/{scope}/240p/seg_00000.ts?sig\n", variant)
+
+    def test_manifest_templates(self):
+        ladder = Path(settings.MEDIA_ROOT) / "hls" / "abc" / "default"
+        (ladder / "240p" / "index.m3u8").write_text(
+            '#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:6.000000,\nseg_00000.ts\n'
+            "#EXTINF:6.000000,\nhttps://ads.example.com/x.ts\n#EXT-X-ENDLIST\n"
+        )
+        (ladder / "trickplay").mkdir()
+        (ladder / "trickplay" / "thumbnails.vtt").write_text(
+            "WEBVTT\n\n00:00:00.000 --> 00:00:10.000\nsprite_000.jpg#xywh=0,0,240,136\n"
+        )
+        scope = "hls/abc/default"
+        self.assertEqual(
+            manifests.render(scope, "240p/index.m3u8", "/p/"),
+            '#EXTM3U\n#EXT-X-MAP:URI="/p/240p/init.mp4"\n#EXTINF:6.000000,\n/p/240p/seg_00000.ts\n'
+            "#EXTINF:6.000000,\nhttps://ads.example.com/x.ts\n#EXT-X-ENDLIST\n",
+        )
+        self.assertIn("\n/q/trickplay/sprite_000.jpg#xywh=0,0,240,136\n", manifests.render(scope, "trickplay/thumbnails.vtt", "/q/"))
+
+        # Served from the template until the ladder is re-transcoded.
+        self.assertEqual(manifests.render(scope, "master.m3u8", "/p/"), "#EXTM3U\n/p/240p/index.m3u8\n")
+        (ladder / "master.m3u8").write_text("#EXTM3U\n480p/index.m3u8\n")
+        self.assertEqual(manifests.render(scope, "master.m3u8", "/r/"), "#EXTM3U\n/r/240p/index.m3u8\n")
+        manifests.invalidate(scope)
+        self.assertEqual(manifests.render(scope, "master.m3u8", "/p/"), "#EXTM3U\n/p/480p/index.m3u8\n")
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        (Path(media_root.name) / "films" / "trailers").mkdir(parents=True)
+        (Path(media_root.name) / "films" / "trailers" / "t.mp4").write_bytes(bytes(range(100)))
+        (Path(media_root.name) / "hls").mkdir()
+        (Path(media_root.name) / "hls" / "master.m3u8").write_text("#EXTM3U\n")
+
+    def get(self, path="films/trailers/t.mp4", **headers):
+        response = media.serve(RequestFactory().get("/media/" + path, headers=headers), path)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_byte_ranges(self):
+        full = self.get()
+        self.assertEqual((full.status_code, full["Accept-Ranges"], full["Content-Length"]), (200, "bytes", "100"))
+        self.assertEqual(full["Content-Type"], "video/mp4")
+
+        part = self.get(Range="bytes=10-19")
+        self.assertEqual((part.status_code, part["Content-Range"], part["Content-Length"]), (206, "bytes 10-19/100", "10"))
+        self.assertEqual(self.body(part), bytes(range(10, 20)))
+        self.assertEqual(self.body(self.get(Range="bytes=-5")), bytes(range(95, 100)))
+        self.assertEqual(self.body(self.get(Range="bytes=90-")), bytes(range(90, 100)))
+        self.assertEqual(self.get(Range="bytes=100-").status_code, 416)
+        self.assertEqual(self.get(Range="bytes=0-1,5-6").status_code, 200)
+        self.assertEqual(self.get(Range="bytes=0-9", **{"If-Range": '"stale"'}).status_code, 200)
+        self.assertEqual(self.get(Range="bytes=0-9", **{"If-Range": full["ETag"]}).status_code, 206)
+
+    def test_validators_and_private_media(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(**{"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(self.get(**{"If-Modified-Since": self.get()["Last-Modified"]}).status_code, 304)
+        for path in ("hls/master.m3u8", "films/../hls/master.m3u8", "../etc/passwd"):
+            with self.assertRaises(Http404):
+                media.serve(RequestFactory().get("/media/" + path), path)
+
+
+@skipUnless(mock_aws, "moto is not installed")
+@override_settings(
+    AWS_STORAGE_BUCKET_NAME="mbogiwood-test",
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_S3_REGION_NAME="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+)
+class EdgeCacheTests(TestCase):
+    """The read-through cache against moto's in-process S3."""
+
+    def setUp(self):
+        cache.clear()
+        self.aws = mock_aws()
+        self.aws.start()
+        self.addCleanup(self.aws.stop)
+        publishing.get_client.cache_clear()
+        self.addCleanup(publishing.get_client.cache_clear)
+        client = publishing.get_client()
+        client.create_bucket(Bucket="mbogiwood-test")
+        for name in ("a", "b", "c"):
+            client.put_object(Bucket="mbogiwood-test", Key=f"media/hls/x/{name}.ts", Body=name.encode() * 100)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.edge = edge_cache.EdgeCache(directory.name, max_bytes=250)
+
+    def fetch(self, name):
+        with self.edge.open(name) as fh:
+            return fh.read()
+
+    def test_read_through_and_hit_ratio(self):
+        self.assertEqual(self.fetch("hls/x/a.ts"), b"a" * 100)
+        self.assertEqual(self.fetch("hls/x/a.ts"), b"a" * 100)
+        with self.assertRaises(FileNotFoundError):
+            self.edge.open("hls/x/missing.ts")
+        self.edge.wait_for_eviction()
+        stats = self.edge.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"], stats["bytes"]), (1, 1, 0.5, 100))
+
+    def test_concurrent_misses_fetch_once(self):
+        client, calls = publishing.get_client(), []
+        get_object = client.get_object
+
+        def slow_get_object(**kwargs):
+            calls.append(kwargs["Key"])
+            time.sleep(0.05)
+            return get_object(**kwargs)
+
+        with mock.patch.object(client, "get_object", slow_get_object), ThreadPoolExecutor(8) as pool:
+            bodies = list(pool.map(lambda _: self.fetch("hls/x/b.ts"), range(8)))
+        self.assertEqual(calls, ["media/hls/x/b.ts"])
+        self.assertEqual(bodies, [b"b" * 100] * 8)
+        self.assertEqual(self.edge.stats()["hits"], 7)
+
+    def test_least_recently_used_is_evicted(self):
+        self.fetch("hls/x/a.ts")
+        self.fetch("hls/x/b.ts")
+        self.fetch("hls/x/a.ts")
+        self.fetch("hls/x/c.ts")  # 300 bytes > 250: evict down to 225
+        self.edge.wait_for_eviction()
+        a, b, c = (self.edge.path(f"hls/x/{name}.ts") for name in "abc")
+        self.assertEqual((a.exists(), b.exists(), c.exists()), (True, False, True))
+        self.assertFalse(b.with_name("b.ts" + edge_cache.LOCK_SUFFIX).exists())  # its object is gone
+        self.assertTrue(a.with_name("a.ts" + edge_cache.LOCK_SUFFIX).exists())
+        self.assertEqual(self.edge.stats()["bytes"], 200)
+
+    def test_held_lock_files_are_kept(self):
+        held = self.edge.path("hls/x/gone.ts")
+        with self.edge._locked(held):
+            self.edge.evict()
+            self.assertTrue(held.with_name("gone.ts" + edge_cache.LOCK_SUFFIX).exists())
+        self.edge.evict()
+        self.assertFalse(held.with_name("gone.ts" + edge_cache.LOCK_SUFFIX).exists())
+
+        # A fetch that opened the lock file before evict() deleted it locks the new one.
+        lock_path = held.with_name("gone.ts" + edge_cache.LOCK_SUFFIX)
+        stale = open(lock_path, "a")
+        self.addCleanup(stale.close)
+        lock_path.unlink()
+        self.assertFalse(edge_cache._is_current(stale, lock_path))
+        with self.edge._locked(held):
+            self.assertTrue(lock_path.exists())
+
+    def test_open_file_survives_eviction(self):
+        self.fetch("hls/x/a.ts")
+        fh = self.edge.open("hls/x/a.ts")
+        self.edge.path("hls/x/a.ts").unlink()  # evicted by another process
+        response = media.open_file_response(RequestFactory().get("/", HTTP_RANGE="bytes=90-"), fh)
+        self.assertEqual(b"".join(response.streaming_content), b"a" * 10)
+        response.close()
+
+    def test_no_scan_on_the_request_thread(self):
+        threads = []
+        with mock.patch.object(self.edge, "evict", side_effect=lambda: threads.append(threading.current_thread())):
+            self.fetch("hls/x/a.ts")  # the first miss starts the initial scan
+            self.edge.wait_for_eviction()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+class FilmSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with mock.patch("django.db.transaction.on_commit"):
+            documentary = Category.objects.create(name="Documentary")
+            Film.objects.create(title="Mbogi Genje", description="Three friends in Nairobi")
+            Film.objects.create(title="Softie", category=documentary)
+            Film.objects.create(title="Kati Kati", description="A mbogi of ghosts")
+
+    def search(self, **params):
+        return self.client.get(reverse("films:film-search-api"), params)
+
+    def titles(self, response):
+        return [row["title"] for row in response.json()["results"]]
+
+    def test_prefix_and_category_matches(self):
+        # Title hits rank above description hits.
+        self.assertEqual(self.titles(self.search(q="mbo")), ["Mbogi Genje", "Kati Kati"])
+        self.assertEqual(self.titles(self.search(q="docu")), ["Softie"])
+
+    def test_degenerate_input(self):
+        self.assertEqual(self.titles(self.search(q="?!-- '\"*")), [])
+        self.assertEqual(self.titles(self.search(q="kati", page="abc")), ["Kati Kati"])
+        self.assertEqual(self.search(q="kati", page="99999999999999999999").status_code, 404)
+        self.assertEqual(self.search(q="kati", page=search.MAX_PAGE).json()["results"], [])
+
+
+class PosterDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name, POSTER_DERIVATIVE_WIDTHS=[32]))
+        self.enterContext(mock.patch("films.tasks.rebuild_catalog_snapshot.delay"))
+
+    def poster(self, colour):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 96), colour).save(buffer, "JPEG")
+        return SimpleUploadedFile(f"{colour}.jpg", buffer.getvalue())
+
+    def test_queued_only_when_the_poster_changes(self):
+        with mock.patch("films.tasks.generate_poster_derivatives.delay") as delay, self.captureOnCommitCallbacks(execute=True):
+            film = Film.objects.create(title="Supa Modo", poster=self.poster("red"))
+            film.title = "Supa Modo (2018)"
+            film.save()
+            Film.objects.get(pk=film.pk).save()
+        self.assertEqual(delay.call_count, 1)
+
+        with mock.patch("films.tasks.generate_poster_derivatives.delay") as delay, self.captureOnCommitCallbacks(execute=True):
+            film.poster = self.poster("blue")
+            film.save()
+        delay.assert_called_once_with(film.pk)
+
+    def test_new_poster_gets_new_names(self):
+        with mock.patch("django.db.transaction.on_commit"):
+            film = Film.objects.create(title="Rafiki", poster=self.poster("red"))
+        generate_poster_derivatives(film.pk)
+        film.refresh_from_db()
+        first = film.poster_derivatives["webp"]["32"]
+
+        with mock.patch("django.db.transaction.on_commit"):
+            film.poster = self.poster("blue")
+            film.save()
+        generate_poster_derivatives(film.pk)
+        second = Film.objects.get(pk=film.pk).poster_derivatives["webp"]["32"]
+        self.assertNotEqual(first, second)
+        self.assertTrue(default_storage.exists(second))
+        self.assertFalse(default_storage.exists(first))  # removed once the new set was recorded
+
+    @override_settings(POSTER_DERIVATIVE_WIDTHS=[])
+    def test_no_widths_no_derivatives(self):
+        with mock.patch("django.db.transaction.on_commit"):
+            film = Film.objects.create(title="Rafiki", poster=self.poster("red"))
+        generate_poster_derivatives(film.pk)
+        film.refresh_from_db()
+        self.assertEqual(film.poster_derivatives, {})
+        self.assertIsNone(posters.build_srcset(film.poster_derivatives))
+
+
+class TrailerDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.enterContext(mock.patch("films.tasks.rebuild_catalog_snapshot.delay"))
+
+    def test_failed_encode_is_recorded_and_not_requeued(self):
+        with mock.patch("django.db.transaction.on_commit"):
+            film = Film.objects.create(title="Atlantics", trailer_file=SimpleUploadedFile("t.mov", b"not a video"))
+        failure = subprocess.CalledProcessError(1, ["ffmpeg"], stderr="Invalid data found when processing input")
+        with mock.patch("films.services.trailers.generate_derivatives", side_effect=failure):
+            generate_trailer_derivatives(film.pk)
+        film.refresh_from_db()
+        self.assertEqual(film.trailer_derivatives["source"], film.trailer_file.name)
+        self.assertIn("Invalid data", film.trailer_derivatives["error"])
+        self.assertFalse(trailers.needs_derivatives(film))
+        self.assertIsNone(trailers.build_url(film.trailer_derivatives, "trailer"))
+
+        with mock.patch("films.tasks.generate_trailer_derivatives.apply_async") as apply_async, self.captureOnCommitCallbacks(execute=True):
+            film.title = "Atlantics (2019)"
+            film.save()
+        apply_async.assert_not_called()
+
+        with mock.patch("films.tasks.generate_trailer_derivatives.apply_async") as apply_async, self.captureOnCommitCallbacks(execute=True):
+            film.trailer_file = SimpleUploadedFile("t2.mov", b"another")
+            film.save()
+        apply_async.assert_called_once()
+
+    def test_probe_failure_is_recorded(self):
+        with mock.patch("django.db.transaction.on_commit"):
+            film = Film.objects.create(title="Atlantics", trailer_file=SimpleUploadedFile("t.mov", b"audio only"))
+        with mock.patch.object(hls_transcoder, "probe", side_effect=StopIteration):
+            generate_trailer_derivatives(film.pk)
+        film.refresh_from_db()
+        self.assertIn("Could not probe", film.trailer_derivatives["error"])
+        self.assertFalse(trailers.needs_derivatives(film))
+
+    def test_new_trailer_gets_new_names(self):
+        def encode(command, **kwargs):
+            Path(command[-1]).write_bytes(b"encoded " + Path(command[command.index("-i") + 1]).read_bytes())
+
+        source = {"width": 1280, "height": 720, "duration": 90.0, "has_audio": True}
+        self.enterContext(mock.patch.object(hls_transcoder, "probe", return_value=source))
+        self.enterContext(mock.patch("films.services.trailers.subprocess.run", side_effect=encode))
+        with mock.patch("django.db.transaction.on_commit"):
+            film = Film.objects.create(title="Rafiki", trailer_file=SimpleUploadedFile("t.mov", b"first cut"))
+        stale = Film.objects.get(pk=film.pk)
+        generate_trailer_derivatives(film.pk)
+        film.refresh_from_db()
+        first = film.trailer_derivatives
+
+        with mock.patch("django.db.transaction.on_commit"):
+            film.trailer_file = SimpleUploadedFile("t.mov", b"final cut")
+            film.save()
+        generate_trailer_derivatives(film.pk)
+        second = Film.objects.get(pk=film.pk).trailer_derivatives
+        self.assertNotEqual(first["trailer"], second["trailer"])
+        self.assertFalse(default_storage.exists(first["trailer"]))  # removed once the new set was recorded
+
+        # A task still holding the old trailer writes beside the new files, not over them.
+        trailers.generate_derivatives(stale)
+        with default_storage.open(second["preview"]) as fh:
+            self.assertEqual(fh.read(), b"encoded final cut")
+
+
+class ImportFilmsTests(TestCase):
+    def import_file(self, suffix, text):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / f"films{suffix}"
+        path.write_text(text, encoding="utf-8")
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch("films.tasks.rebuild_catalog_snapshot.delay"):
+            call_command("import_films", str(path), "--no-transcode", stdout=out, stderr=err)
+        return err.getvalue()
+
+    def test_csv_bad_rows_are_reported_and_skipped(self):
+        errors = self.import_file(".csv", (
+            "title,price,rental_period_days,release_date,status,category\n"
+            "Rafiki,150,3,2018-05-09,paid,Drama\n"
+            "Bad price,1.50.0,2,,paid,\n"
+            "Bad days,100,two,,paid,\n"
+            "Bad date,100,2,2018-02-30,paid,\n"
+            "Bad status,100,2,,free,\n"
+            ",100,2,,paid,\n"
+            "Supa Modo,0,,,promo,Drama\n"
+        ))
+        films = {film.title: film for film in Film.objects.all()}
+        self.assertEqual(set(films), {"Rafiki", "Supa Modo"})
+        self.assertEqual(films["Rafiki"].price, Decimal("150"))
+        self.assertEqual(films["Rafiki"].release_date.isoformat(), "2018-05-09")
+        self.assertEqual(films["Supa Modo"].rental_period_days, 2)
+        self.assertEqual(films["Supa Modo"].category.name, "Drama")
+        for line in (3, 4, 5, 6, 7):
+            self.assertIn(f"Line {line}:", errors)
+        self.assertIn("Skipped 5 invalid record(s)", errors)
+
+    def test_jsonl_bad_lines_are_reported_and_skipped(self):
+        errors = self.import_file(".jsonl", (
+            '{"title": "Atlantics", "price": 200, "status": "paid"}\n'
+            "\n"
+            '{"title": "Broken", \n'
+            '["not", "an", "object"]\n'
+            '{"title": "Negative", "price": -5}\n'
+        ))
+        self.assertEqual(list(Film.objects.values_list("title", flat=True)), ["Atlantics"])
+        self.assertIn("Line 3: not a JSON object", errors)
+        self.assertIn("Line 4: not a JSON object", errors)
+        self.assertIn("Line 5: price", errors)
+
+
+    def test_batch_is_retried_when_a_slug_is_taken_meanwhile(self):
+        from films.management.commands import import_films
+
+        with mock.patch("django.db.transaction.on_commit"):
+            Film.objects.create(title="Kesho")
+        allocated = [["kesho", "leo"]]  # allocated before "kesho" was taken
+        real = import_films.allocate_slugs
+        with mock.patch.object(
+            import_films, "allocate_slugs", side_effect=lambda *args: allocated.pop() if allocated else real(*args)
+        ):
+            self.import_file(".jsonl", '{"title": "Kesho"}\n{"title": "Leo"}\n')
+        self.assertEqual(sorted(Film.objects.values_list("slug", flat=True)), ["kesho", "kesho-1", "leo"])
+
+
+    def test_failed_batch_removes_its_posters(self):
+        from django.db import DatabaseError
+        from films.management.commands import import_films
+
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        poster = Path(media_root) / "upload.jpg"
+        poster.write_bytes(b"jpeg")
+        with mock.patch.object(import_films.Command, "save_batch", side_effect=DatabaseError("disk full")), \
+                self.assertRaises(DatabaseError):
+            self.import_file(".jsonl", f'{{"title": "Kesho", "poster": "{poster}"}}\n')
+        self.assertEqual(list((Path(media_root) / "films" / "posters").iterdir()), [])
+        self.assertFalse(Film.objects.exists())
+
+        with mock.patch.object(import_films.catalog, "invalidate") as invalidate:
+            self.import_file(".jsonl", '{"title": ""}\n')
+        invalidate.assert_not_called()  # nothing was imported
+
+
+class RelatedFilmTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from payments.models import Order
+
+        with mock.patch("django.db.transaction.on_commit"):
+            cls.films = {title: Film.objects.create(title=title) for title in "ABCD"}
+        User = get_user_model()
+        baskets = {"u1": "ABCA", "u2": "AB", "u3": "ABC", "u4": "AD"}  # u1 rented A twice
+        for name, titles in baskets.items():
+            user = User.objects.create_user(email=f"{name}@example.com", password="pass")
+            for title in titles:
+                Order.objects.create(
+                    user=user, film=cls.films[title], payment_method="mpesa", amount_cents=100, status=Order.Status.SUCCESS
+                )
+        Order.objects.create(user=user, film=cls.films["C"], payment_method="mpesa", amount_cents=100)  # pending
+
+    def neighbours(self):
+        rows = RelatedFilm.objects.order_by("film__title", "rank").values_list("film__title", "related__title")
+        result = {}
+        for film, related in rows:
+            result.setdefault(film, []).append(related)
+        return result
+
+    @override_settings(RELATED_FILMS_TOP_K=12, RELATED_FILMS_MIN_CO_PURCHASES=2)
+    def test_rebuild_ranks_by_co_purchases(self):
+        # Audiences A=4, B=3, C=2, D=1. Scores co^2 / (n_a * n_b): A-B 9/12,
+        # A-C 4/8, B-C 4/6; A-D has one co-purchase, under the threshold.
+        self.assertEqual(recommendations.rebuild_related_films(), 6)
+        self.assertEqual(self.neighbours(), {"A": ["B", "C"], "B": ["A", "C"], "C": ["B", "A"]})
+        self.assertAlmostEqual(RelatedFilm.objects.get(film=self.films["A"], rank=1).score, 0.75)
+
+        recommendations.rebuild_related_films(min_co_purchases=1)
+        self.assertEqual(self.neighbours()["A"], ["B", "C", "D"])
+        self.assertEqual(self.neighbours()["D"], ["A"])
+
+    def test_explicit_zero_is_not_the_default(self):
+        recommendations.rebuild_related_films(top_k=1, min_co_purchases=2)
+        self.assertEqual(self.neighbours(), {"A": ["B"], "B": ["A"], "C": ["B"]})
+        self.assertEqual(recommendations.rebuild_related_films(top_k=0), 0)
+        self.assertFalse(RelatedFilm.objects.exists())
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(leaderboards, "get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with mock.patch("django.db.transaction.on_commit"):
+            self.category = Category.objects.create(name="Drama")
+            self.a, self.b, self.c = (Film.objects.create(title=title, category=self.category) for title in "ABC")
+
+    def order(self, film):
+        from payments.models import Order
+
+        user = get_user_model().objects.create_user(email=f"{Order.objects.count()}@example.com", password="pass")
+        Order.objects.create(user=user, film=film, payment_method="mpesa", amount_cents=100, status=Order.Status.SUCCESS)
+
+    def test_rentals_and_ratings_update_both_boards(self):
+        for film in (self.a, self.a, self.b):
+            leaderboards.record_rental(film.id, self.category.id)
+        leaderboards.record_rating(self.b.id, self.category.id, 5)
+        leaderboards.record_rating(self.a.id, self.category.id, 1)
+
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TOP_RENTED), [self.a.id, self.b.id])
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TOP_RENTED, self.category.id), [self.a.id, self.b.id])
+        # Trending: A 1 + 1 - 1, B 1 + 1; ratings never count as rentals.
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TRENDING, self.category.id), [self.b.id, self.a.id])
+        self.assertEqual(self.redis.zscore(leaderboards.board_key(leaderboards.TOP_RENTED), self.b.id), 1)
+
+    def test_newer_events_weigh_more(self):
+        half_life = settings.LEADERBOARD_HALF_LIFE_HOURS * 3600
+        with mock.patch("time.time", return_value=1_000_000.0):
+            leaderboards.record_rental(self.a.id, None)
+            leaderboards.record_rental(self.a.id, None)
+        with mock.patch("time.time", return_value=1_000_000.0 + 2 * half_life):
+            leaderboards.record_rental(self.b.id, None)
+
+        trending = leaderboards.board_key(leaderboards.TRENDING)
+        self.assertEqual(self.redis.zscore(trending, self.a.id), 2)
+        self.assertEqual(self.redis.zscore(trending, self.b.id), 4)
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TRENDING), [self.b.id, self.a.id])
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TOP_RENTED), [self.a.id, self.b.id])
+
+    def test_reconcile_rebuilds_from_orders(self):
+        for film in (self.a, self.a, self.b):
+            self.order(film)
+        leaderboards.record_rental(self.c.id, self.category.id)  # no order behind it
+
+        self.assertEqual(leaderboards.reconcile(), 4)
+        for category in (None, self.category.id):
+            board = leaderboards.board_key(leaderboards.TOP_RENTED, category)
+            scores = self.redis.zrevrange(board, 0, -1, withscores=True)
+            self.assertEqual(scores, [(str(self.a.id).encode(), 2), (str(self.b.id).encode(), 1)])
+        self.assertEqual(leaderboards.top_film_ids(leaderboards.TRENDING), [self.a.id, self.b.id])
+        self.assertAlmostEqual(float(self.redis.get(leaderboards.EPOCH_KEY)), time.time(), delta=60)
+
+    def test_increments_during_reconcile_survive(self):
+        self.order(self.a)
+        aware = leaderboards._aware
+
+        def rent_while_reading(timestamp):
+            leaderboards.record_rental(self.b.id, self.category.id)
+            return aware(timestamp)
+
+        with mock.patch.object(leaderboards, "_aware", side_effect=rent_while_reading):
+            leaderboards.reconcile()
+
+        board = leaderboards.board_key(leaderboards.TOP_RENTED, self.category.id)
+        # _aware runs twice (orders, ratings): two rentals recorded mid-rebuild.
+        self.assertEqual(self.redis.zscore(board, self.b.id), 2)
+        self.assertEqual(self.redis.zscore(board, self.a.id), 1)
+        self.assertEqual(self.redis.keys("films:lb:delta:*"), [])
+        self.assertIsNone(self.redis.get(leaderboards.REBUILD_KEY))
+
+        leaderboards.record_rental(self.b.id, self.category.id)
+        self.assertEqual(self.redis.zscore(board, self.b.id), 3)
+        self.assertEqual(self.redis.keys("films:lb:delta:*"), [])
 
-# Create your tests here.
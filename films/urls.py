@@ -3,10 +3,19 @@ from django.urls import path, include
 from .views import (
     film_list_api,
     film_detail_api,
+    film_search_api,
+    leaderboard_api,
+    related_films_api,
     FilmUploadView,
+    legacy_upload_api,
+    upload_abort_api,
+    upload_parts_api,
+    upload_start_api,
     FilmmakerFilmListView,
     filmmaker_revenue_api,
+    film_progress_api,
     SecureFilmStreamView,
+    hls_gateway,
 )
 
 app_name = "films"
@@ -14,15 +23,28 @@ app_name = "films"
 urlpatterns = [
     # Public API Endpoints
     path("", film_list_api, name="film-list-api"),
+    path("search/", film_search_api, name="film-search-api"),
+    path("leaderboards/<str:board>/", leaderboard_api, name="film-leaderboard-api"),
+
+    # Direct-to-S3 uploads (listed before the slug routes they would match)
+    path("uploads/", upload_start_api, name="film-upload-start-api"),
+    path("uploads/parts/", upload_parts_api, name="film-upload-parts-api"),
+    path("uploads/complete/", FilmUploadView.as_view(), name="film-upload-api"),
+    path("uploads/abort/", upload_abort_api, name="film-upload-abort-api"),
+    # Removed in favour of the flow above; answers 410 with directions.
+    path("upload/", legacy_upload_api, name="film-legacy-upload-api"),
+
     path("<slug:slug>/", film_detail_api, name="film-detail-api"),
+    path("<slug:slug>/related/", related_films_api, name="film-related-api"),
 
     # Filmmaker Endpoints
-    path("upload/", FilmUploadView.as_view(), name="film-upload-api"),
     path("dashboard/my-films/", FilmmakerFilmListView.as_view(), name="filmmaker-film-list-api"),
     path("filmmaker/revenue/", filmmaker_revenue_api, name="filmmaker-revenue-api"),
+    path("<int:pk>/progress/", film_progress_api, name="film-progress-api"),
 
     # Streaming - Use a single, clean URL
     path("<int:pk>/stream/", SecureFilmStreamView.as_view(), name="film-stream-api"),
+    path("hls/<str:token>/<path:path>", hls_gateway, name="film-hls-gateway"),
 
     # Nested App URLs
     path("<slug:slug>/reviews/", include("reviews.urls")),
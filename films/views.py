@@ -1,18 +1,64 @@
 # FILE: films/views.py
 
+import functools
+import logging
+import posixpath
+import time
+
+import redis
+from django.core.files.storage import default_storage
 from django.db.models import Sum
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+)
 from django.shortcuts import get_object_or_404, render
-from django.utils import timezone
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from rest_framework import generics, permissions, status, views
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
 
+from core_api import media
+from payments import entitlements
 from payments.models import Order, Payout
 from .models import Film
-from .serializers import FilmSerializer, FilmUploadSerializer, RevenueSummarySerializer
+from .pagination import FilmCursorPagination
+from .services import (
+    catalog,
+    detail,
+    edge_cache,
+    leaderboards,
+    manifests,
+    progress,
+    publishing,
+    recommendations,
+    search,
+    streaming,
+    uploads,
+)
+from .serializers import (
+    FilmSerializer,
+    FilmUploadSerializer,
+    RevenueSummarySerializer,
+    UploadPartsSerializer,
+    UploadStartSerializer,
+    serialize_film_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that take the film list off the catalog snapshot.
+LIST_PARAMS = (FilmCursorPagination.cursor_query_param, FilmCursorPagination.page_size_query_param, "status")
 
 
 class IsFilmmaker(permissions.BasePermission):
@@ -29,38 +75,209 @@ class IsFilmmaker(permissions.BasePermission):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def film_list_api(request):
-    promo_films = Film.objects.filter(status=Film.PROMO).order_by("-created_at")
-    paid_films = Film.objects.filter(status=Film.PAID).order_by("-created_at")
-    return Response(
-        {
-            "promo_films": FilmSerializer(promo_films, many=True, context={"request": request}).data,
-            "paid_films": FilmSerializer(paid_films, many=True, context={"request": request}).data,
-        }
-    )
+    # Other parameters (utm_source, cache busters...) don't change the response.
+    if any(param in request.query_params for param in LIST_PARAMS):
+        return _paginated_film_list(request)
+
+    # First pages are served from the pre-rendered catalog snapshot;
+    # see films/services/catalog.py.
+    snapshot = catalog.get_snapshot()
+    etag = snapshot["etag"]
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(catalog.body_for(snapshot, request), content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _paginated_film_list(request):
+    """Cursor-paginate one (``?status=``) or both catalog sections."""
+    status_filter = request.query_params.get("status")
+    data = {}
+    for key, film_status in catalog.CATALOG_SECTIONS:
+        if status_filter and status_filter != film_status:
+            continue
+        paginator = FilmCursorPagination()
+        page = paginator.paginate_queryset(Film.objects.filter(status=film_status).listing_values(), request)
+        if not status_filter:
+            paginator.base_url = replace_query_param(paginator.base_url, "status", film_status)
+        data[key] = paginator.get_paginated_data(serialize_film_rows(page, request))
+    return Response(data)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def film_search_api(request):
+    """Ranked, prefix-matching full-text search: ``?q=<terms>&page=<n>``."""
+    query = request.query_params.get("q", "").strip()
+    page_size = FilmCursorPagination().get_page_size(request)
+    try:
+        page = max(int(request.query_params.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    if page > search.MAX_PAGE:
+        raise NotFound("Invalid page.")
+
+    rows = search.search_films(query, limit=page_size + 1, offset=(page - 1) * page_size) if query else []
+    next_link = None
+    if len(rows) > page_size:
+        next_link = replace_query_param(request.build_absolute_uri(), "page", page + 1)
+    return Response({"next": next_link, "results": serialize_film_rows(rows[:page_size], request)})
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def film_detail_api(request, slug):
-    film = get_object_or_404(Film, slug=slug)
-    return Response(FilmSerializer(film, context={"request": request}).data)
+    data = detail.get_film_detail(slug, request)
+    if data is None:
+        raise Http404("No Film matches the given query.")
+    return Response(data)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def related_films_api(request, slug):
+    """Precomputed "viewers also rented" films for ``slug``."""
+    limit = FilmCursorPagination().get_page_size(request)
+    rows = recommendations.related_film_rows(slug, limit)
+    return Response({"results": serialize_film_rows(rows, request)})
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def leaderboard_api(request, board):
+    """Top films on a leaderboard (``trending`` or ``top-rented``), optionally ``?category=<id>``."""
+    if board not in leaderboards.BOARDS:
+        raise Http404("Unknown leaderboard.")
+    limit = FilmCursorPagination().get_page_size(request)
+    category_id = request.query_params.get("category")
+    if category_id and not category_id.isdigit():
+        return Response({"error": "category must be a category id."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        film_ids = leaderboards.top_film_ids(board, category_id, limit)
+    except redis.RedisError:
+        logger.exception("Leaderboard %s unavailable", board)
+        return Response({"error": "Leaderboard temporarily unavailable."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    rows = {row["id"]: row for row in Film.objects.filter(id__in=film_ids).listing_values()}
+    ranked = [rows[pk] for pk in film_ids if pk in rows]
+    return Response({"results": serialize_film_rows(ranked, request)})
+
+
+def _uploads_unavailable():
+    return Response({"error": "Direct uploads are not configured."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsFilmmaker])
+def upload_start_api(request):
+    """Start a multipart upload straight to S3; returns the upload token and part size."""
+    if not uploads.is_configured():
+        return _uploads_unavailable()
+    serializer = UploadStartSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        data = uploads.start(request.user, **serializer.validated_data)
+    except uploads.UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsFilmmaker])
+def upload_parts_api(request):
+    """Presigned PUT URLs for a batch of parts."""
+    if not uploads.is_configured():
+        return _uploads_unavailable()
+    serializer = UploadPartsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        urls = uploads.presign_parts(serializer.validated_data["upload"], request.user, serializer.validated_data["parts"])
+    except uploads.UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"parts": urls})
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsFilmmaker])
+def upload_abort_api(request):
+    if not uploads.is_configured():
+        return _uploads_unavailable()
+    try:
+        uploads.abort(request.data.get("upload", ""), request.user)
+    except uploads.UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def legacy_upload_api(request):
+    """The old single-request upload endpoint; points clients to the direct-upload flow."""
+    return Response(
+        {
+            "error": "Uploading through this endpoint is no longer supported. Upload the file "
+            "straight to storage: start it, upload the parts to the presigned URLs, then complete it.",
+            "start": reverse("films:film-upload-start-api"),
+            "parts": reverse("films:film-upload-parts-api"),
+            "complete": reverse("films:film-upload-api"),
+        },
+        status=status.HTTP_410_GONE,
+    )
 
 
 class FilmUploadView(generics.CreateAPIView):
+    """Completes a direct upload, verifies it and creates the Film (transcoding follows)."""
     queryset = Film.objects.all()
     serializer_class = FilmUploadSerializer
     permission_classes = [IsAuthenticated, IsFilmmaker]
 
+    def create(self, request, *args, **kwargs):
+        if not uploads.is_configured():
+            return _uploads_unavailable()
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(filmmaker=self.request.user)
+        data = serializer.validated_data
+        try:
+            video_name = uploads.complete(data["upload"], self.request.user, data["parts"])
+        except uploads.UploadError as e:
+            raise ValidationError({"upload": [str(e)]})
+        try:
+            serializer.save(filmmaker=self.request.user, video_file=video_name)
+        except Exception:
+            uploads.discard(video_name)
+            raise
 
 
 class FilmmakerFilmListView(generics.ListAPIView):
     serializer_class = FilmSerializer
     permission_classes = [IsAuthenticated, IsFilmmaker]
+    pagination_class = FilmCursorPagination
 
     def get_queryset(self):
-        return Film.objects.filter(filmmaker=self.request.user)
+        return Film.objects.filter(filmmaker=self.request.user).listing_values()
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(serialize_film_rows(page, request))
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def film_progress_api(request, pk):
+    """Transcode progress of one of the filmmaker's films."""
+    films = Film.objects.all() if request.user.is_staff else Film.objects.filter(filmmaker=request.user)
+    film = get_object_or_404(films.only("id", "processing_status"), pk=pk)
+    snapshot = progress.get_progress(film.id) or {"percent": None, "fps": None, "eta_seconds": None}
+    # The film row is authoritative once the encode has finished or failed.
+    if film.processing_status in (Film.ProcessingStatus.SUCCESS, Film.ProcessingStatus.FAILED):
+        snapshot["status"] = film.processing_status
+    snapshot.setdefault("status", film.processing_status)
+    return Response(snapshot)
 
 
 @api_view(["GET"])
@@ -95,49 +312,77 @@ def watch_film(request, slug):
     if film.status == Film.PROMO:
         unlocked = True
     elif request.user.is_authenticated:
-        is_owner = film.filmmaker == request.user
-        has_access = Order.objects.filter(
-            user=request.user,
-            film=film,
-            status=Order.Status.SUCCESS,
-            access_expires_at__gt=timezone.now()
-        ).exists()
-        if is_owner or has_access:
+        is_owner = film.filmmaker_id == request.user.pk
+        if is_owner or entitlements.has_access(request.user, film):
             unlocked = True
 
     return render(request, "films/watch.html", {"film": film, "unlocked": unlocked})
 
 
 class SecureFilmStreamView(APIView):
+    """Signed URLs of the film's HLS ladder for the requesting user; see films/services/streaming.py."""
+
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
         film = get_object_or_404(Film, pk=pk)
-        is_owner = film.filmmaker == request.user
-        is_owner = film.filmmaker == request.user
-
-        has_access = Order.objects.filter(
-            user=request.user,
-            film=film,
-            status=Order.Status.SUCCESS,
-            access_expires_at__gt=timezone.now()
-        ).exists()
+        is_owner = film.filmmaker_id == request.user.pk
 
-        if not has_access and not is_owner:
-            return Response({"error": "You do not have permission to stream this film."}, status=status.HTTP_403_FORBIDDEN)
-        if not has_access and not is_owner:
+        if not is_owner and not entitlements.has_access(request.user, film):
             return Response({"error": "You do not have permission to stream this film."}, status=status.HTTP_403_FORBIDDEN)
 
-        if film.processing_status != Film.ProcessingStatus.SUCCESS or not film.hls_manifest_path:
+        if film.processing_status != Film.ProcessingStatus.SUCCESS or not film.hls_manifest:
             return Response({"error": "This film is not yet available for streaming."}, status=status.HTTP_404_NOT_FOUND)
-        
-        hls_full_url = request.build_absolute_uri(f'/media/{film.hls_manifest_path}')
-        
-        return Response({'hls_url': hls_full_url})
 
-        if film.processing_status != Film.ProcessingStatus.SUCCESS or not film.hls_manifest_path:
-            return Response({"error": "This film is not yet available for streaming."}, status=status.HTTP_404_NOT_FOUND)
-        
-        hls_full_url = request.build_absolute_uri(f'/media/{film.hls_manifest_path}')
-        
-        return Response({'hls_url': hls_full_url})
\ No newline at end of file
+        scope = streaming.scope_for(film)
+        ttl = streaming.viewing_ttl(scope)
+        token = streaming.make_token(request.user.pk, scope, ttl=ttl)
+        thumbnails_url = None
+        if film.trickplay_track and film.trickplay_track.name.startswith(scope + "/"):
+            thumbnails_url = streaming.build_url(token, film.trickplay_track.name[len(scope) + 1:], request)
+        response = Response({"hls_url": streaming.build_url(token, request=request), "thumbnails_url": thumbnails_url})
+        streaming.set_viewer_cookie(response, request, request.user.pk, ttl)
+        return response
+
+
+def hls_gateway(request, token, path):
+    """
+    Serve one file of an HLS ladder to the viewer a streaming token was
+    issued to. Nothing here touches the database or cache. Playlists are
+    rendered from cached templates (films/services/manifests.py), with
+    presigned bucket URLs for their media unless there is an edge cache.
+    Other files come from the edge cache if there is one, else by redirect
+    to the bucket, or from MEDIA_ROOT without a bucket.
+    """
+    grant = streaming.read_token(token)
+    name = streaming.resolve(grant, path) if grant else None
+    if name is None or not streaming.is_viewer(request, grant):
+        return HttpResponseForbidden()
+    content_type = publishing.CONTENT_TYPES.get(posixpath.splitext(name)[1])
+    if manifests.is_manifest(name):
+        sign = None
+        if publishing.is_configured() and not edge_cache.is_enabled():
+            expires_in = max(1, grant.expires - int(time.time()))
+            sign = functools.partial(publishing.presigned_url, expires_in=expires_in)
+        try:
+            body = manifests.render(grant.scope, path, streaming.url_prefix(token, request), sign=sign)
+        except FileNotFoundError:
+            raise Http404
+        response = HttpResponse(body, content_type=content_type)
+        patch_cache_control(response, private=True, max_age=streaming.EXPIRY_STEP)
+        return response
+    if edge_cache.is_enabled():
+        try:
+            fh = edge_cache.get_cache().open(name)
+        except FileNotFoundError:
+            raise Http404
+        response = media.open_file_response(request, fh, content_type)
+        patch_cache_control(response, private=True)
+        return response
+    if publishing.is_configured():
+        response = HttpResponseRedirect(publishing.presigned_url(name))
+        patch_cache_control(response, private=True, max_age=publishing.PRESIGNED_URL_SECONDS // 2)
+        return response
+    response = media.file_response(request, default_storage.path(name), content_type)
+    patch_cache_control(response, private=True)
+    return response
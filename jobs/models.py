@@ -1,8 +1,9 @@
 # FILE: jobs/models.py
 from django.db import models
-from django.utils.text import slugify
 from django.conf import settings
 
+from core_api.slugs import save_with_unique_slug
+
 
 class Job(models.Model):
     """Represents a job posting for filmmakers or crew members."""
@@ -49,13 +50,7 @@ class Job(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Job.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, self.title, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
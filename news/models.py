@@ -2,7 +2,8 @@
 
 from django.db import models
 from django.conf import settings
-from django.utils.text import slugify
+
+from core_api.slugs import save_with_unique_slug
 
 class Article(models.Model):
     """
@@ -26,7 +27,7 @@ class Article(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            return save_with_unique_slug(self, self.title, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
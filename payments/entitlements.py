@@ -0,0 +1,65 @@
+# payments/entitlements.py
+"""
+Who may stream what.
+
+Every successful order grants or extends a ``FilmAccess`` row. Access checks
+never scan orders: each user's rows are cached as one
+``{film_id: expires_at timestamp}`` map, so a check is a single cache lookup
+plus a clock comparison. Expiry therefore needs no invalidation, because an
+expired entry stops counting the moment it passes. The map is dropped when
+a row is written or deleted (see ``payments.signals``). Expired rows stay in
+the map on purpose: reviews only need the film to have been rented once.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from payments.models import FilmAccess
+
+CACHE_KEY = "payments:entitlements:{user_id}"
+CACHE_SECONDS = 60 * 60 * 24
+
+
+def _cache_key(user_id):
+    return CACHE_KEY.format(user_id=user_id)
+
+
+def entitlements(user_id):
+    """``{film_id: expires_at timestamp}`` of every film the user has rented."""
+    key = _cache_key(user_id)
+    grants = cache.get(key)
+    if grants is None:
+        grants = {
+            film_id: expires_at.timestamp()
+            for film_id, expires_at in FilmAccess.objects.filter(user_id=user_id).values_list("film_id", "expires_at")
+        }
+        cache.set(key, grants, timeout=CACHE_SECONDS)
+    return grants
+
+
+def invalidate(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def _film_id(film):
+    return getattr(film, "pk", film)
+
+
+def expires_at(user, film):
+    """When ``user``'s access to ``film`` (a Film or its id) ends, or None if it has none now."""
+    if not user.is_authenticated:
+        return None
+    expiry = entitlements(user.pk).get(_film_id(film))
+    if expiry is None or expiry <= timezone.now().timestamp():
+        return None
+    return datetime.fromtimestamp(expiry, tz=dt_timezone.utc)
+
+
+def has_access(user, film):
+    return expires_at(user, film) is not None
+
+
+def has_rented(user, film):
+    """Whether ``user`` ever rented ``film``, even if the rental has lapsed."""
+    return user.is_authenticated and _film_id(film) in entitlements(user.pk)
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-17 13:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_film_access(apps, schema_editor):
+    """One row per user and film from the latest-expiring successful order."""
+    Order = apps.get_model("payments", "Order")
+    FilmAccess = apps.get_model("payments", "FilmAccess")
+    latest = {}
+    orders = Order.objects.filter(status="success", access_expires_at__isnull=False).order_by("access_expires_at")
+    for order in orders.only("id", "user_id", "film_id", "access_expires_at").iterator():
+        latest[(order.user_id, order.film_id)] = order
+    FilmAccess.objects.bulk_create(
+        [
+            FilmAccess(user_id=user_id, film_id=film_id, expires_at=order.access_expires_at, order_id=order.id)
+            for (user_id, film_id), order in latest.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('films', '0010_film_trailer_derivatives'),
+        ('payments', '0005_alter_paymenttransaction_order'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('film', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access_grants', to='films.film')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.order')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='film_access', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'film access',
+                'constraints': [models.UniqueConstraint(fields=('user', 'film'), name='unique_film_access')],
+            },
+        ),
+        migrations.RunPython(backfill_film_access, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from films.models import Film
+from films.services import leaderboards
 
 
 class Order(models.Model):
@@ -57,7 +58,10 @@ class Order(models.Model):
         self.filmmaker_payout_cents = self.amount_cents - self.platform_fee_cents
         self.status = self.Status.SUCCESS
         self.access_expires_at = timezone.now() + timedelta(days=self.film.rental_period_days)
-        self.save()
+        with transaction.atomic():
+            self.save()
+            FilmAccess.grant(self)
+        transaction.on_commit(lambda: leaderboards.record_rental(self.film_id, self.film.category_id))
 
     def has_access(self):
         return (
@@ -67,6 +71,51 @@ class Order(models.Model):
         )
 
 
+class FilmAccess(models.Model):
+    """
+    A user's entitlement to stream a film until ``expires_at``: one row per
+    user and film, extended by every successful order. Checked through
+    payments.entitlements, which caches each user's rows.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="film_access",
+    )
+    film = models.ForeignKey(
+        Film,
+        on_delete=models.CASCADE,
+        related_name="access_grants",
+    )
+    expires_at = models.DateTimeField()
+    # The order that granted (or last extended) the access.
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "film"], name="unique_film_access")]
+        verbose_name_plural = "film access"
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.film_id} until {self.expires_at:%Y-%m-%d %H:%M}"
+
+    @classmethod
+    def grant(cls, order):
+        """Record ``order``'s access, never shortening a longer one already held."""
+        access, created = cls.objects.select_for_update().get_or_create(
+            user_id=order.user_id,
+            film_id=order.film_id,
+            defaults={"expires_at": order.access_expires_at, "order": order},
+        )
+        if not created and order.access_expires_at > access.expires_at:
+            access.expires_at, access.order = order.access_expires_at, order
+            access.save(update_fields=["expires_at", "order", "updated_at"])
+        return access
+
+
 class Payout(models.Model):
     """Tracks payouts to filmmakers."""
 
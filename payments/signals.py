@@ -0,0 +1,14 @@
+# payments/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import FilmAccess
+from . import entitlements
+
+
+@receiver(post_save, sender=FilmAccess)
+@receiver(post_delete, sender=FilmAccess)
+def invalidate_entitlements(sender, instance, **kwargs):
+    # After the commit, so the next check reloads the committed rows.
+    transaction.on_commit(lambda: entitlements.invalidate(instance.user_id))
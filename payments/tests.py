@@ -1,3 +1,61 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from films.models import Film
+
+from . import entitlements
+from .models import FilmAccess, Order
+
+
+class EntitlementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.viewer = User.objects.create_user(email="viewer@example.com", password="pass", full_name="Achieng Otieno")
+        with mock.patch("django.db.transaction.on_commit"):
+            self.film = Film.objects.create(title="Nairobi Half Life", rental_period_days=2)
+
+    def rent(self):
+        order = Order.objects.create(
+            user=self.viewer, film=self.film, payment_method=Order.PaymentMethod.MPESA, amount_cents=15000
+        )
+        with mock.patch("films.services.leaderboards.record_rental"), self.captureOnCommitCallbacks(execute=True):
+            order.activate_access()
+        return order
+
+    def test_purchase_grants_cached_access(self):
+        self.assertFalse(entitlements.has_access(self.viewer, self.film))  # caches the empty set
+        order = self.rent()
+        with self.assertNumQueries(1):
+            self.assertEqual(entitlements.expires_at(self.viewer, self.film), order.access_expires_at)
+        with self.assertNumQueries(0):
+            self.assertTrue(entitlements.has_access(self.viewer, self.film.pk))
+
+    def test_access_lapses_without_invalidation(self):
+        self.rent()
+        self.assertTrue(entitlements.has_access(self.viewer, self.film))
+        later = timezone.now() + timedelta(days=3)
+        with mock.patch("django.utils.timezone.now", return_value=later), self.assertNumQueries(0):
+            self.assertFalse(entitlements.has_access(self.viewer, self.film))
+            self.assertTrue(entitlements.has_rented(self.viewer, self.film))
+
+    def test_renting_again_never_shortens_access(self):
+        first = self.rent()
+        FilmAccess.objects.filter(user=self.viewer).update(expires_at=first.access_expires_at + timedelta(days=10))
+        self.rent()
+        self.assertEqual(FilmAccess.objects.get().expires_at, first.access_expires_at + timedelta(days=10))
 
-# Create your tests here.
+    def test_film_access_api(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        url = reverse("payments:film-access-api", args=[self.film.pk])
+        self.assertEqual(client.get(url).json(), {"access": False})
+        self.rent()
+        self.assertTrue(client.get(url).json()["access"])
@@ -14,6 +14,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
 from films.models import Film
+from . import entitlements
 from .models import Order, PaymentTransaction, Payout, PayoutRequest
 from .serializers import (
     OrderSerializer,
@@ -324,14 +325,11 @@ def film_access_api(request, film_id):
     """Checks if the logged-in user has active access to a given film."""
     film = get_object_or_404(Film, id=film_id)
 
-    order = Order.objects.filter(
-        user=request.user, film=film, status=Order.Status.SUCCESS
-    ).first()
-
-    if order and order.has_access():
+    expires_at = entitlements.expires_at(request.user, film)
+    if expires_at:
         return Response({
             "access": True,
-            "expires_at": order.access_expires_at.isoformat() if order.access_expires_at else None,
+            "expires_at": expires_at.isoformat(),
             "stream_url": request.build_absolute_uri(
                 reverse("films:film-stream-api", args=[film.id])
             ),
@@ -56,3 +56,6 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.full_name or self.email
+
+    def get_full_name(self):
+        return self.full_name or ""